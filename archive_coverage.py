@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+Инкрементальное отслеживание содержимого архивов камер.
+
+Вместо запроса всей истории (`past`..`future`) при каждой проверке трекер запрашивает только
+хвост после последнего известного конца записи и вливает его в локальный индекс интервалов,
+который можно сохранять на диск между запусками.
+"""
+
+import json
+import logging
+import numbers
+import os.path
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .archive_intervals import IntervalSet
+from .http_api import Camera, replace_file
+from .timestamp_codec import arrow_to_ms, ms_to_arrow
+
+logger = logging.getLogger(__name__)
+
+
+def _to_ms(t):
+    return t if isinstance(t, numbers.Number) else arrow_to_ms(t)
+
+
+class ArchiveCoverageTracker(object):
+    """
+        tracker = ArchiveCoverageTracker(web_api, index_path='coverage.json')
+        tracker.update_many(cameras)
+        if not tracker.is_recorded(camera, t1, t2):
+            ...
+        tracker.save()
+
+    Индекс только пополняется: удаление старых записей из архива (перезапись по кругу) трекер не
+    видит. Для полной пересинхронизации камеры есть :meth:`refresh`, для отбрасывания старой
+    истории -- :meth:`forget_before`.
+    """
+
+    def __init__(self, api, index_path=None, overlap=60 * 1000, scale=None):
+        """
+        :param api: :class:`WebHttpApi`
+        :param str index_path: JSON-файл индекса. Если он есть, индекс загружается из него.
+        :param int overlap: Насколько (мс) раньше последнего известного конца записи начинать
+                            запрос, чтобы подхватить запоздавшие записи.
+        :param int scale: См. `scale` в :meth:`WebHttpApi.get_arch_intervals`.
+        """
+        self.api = api
+        self.index_path = index_path
+        self.overlap = overlap
+        self.scale = scale
+        self._lock = threading.Lock()
+        self._index = {}
+        if index_path is not None and os.path.exists(index_path):
+            self.load()
+
+    @staticmethod
+    def _key(camera):
+        return camera.id if isinstance(camera, Camera) else camera
+
+    def intervals(self, camera):
+        """
+        :return: Локально известные интервалы камеры.
+        :return type: :class:`IntervalSet`
+        """
+        with self._lock:
+            return self._index.get(self._key(camera), IntervalSet())
+
+    def last_end(self, camera):
+        """
+        :return: Последний известный конец записи (мс) или None.
+        """
+        return self.intervals(camera).end
+
+    def update(self, camera):
+        """
+        Запрашивает новые интервалы камеры и вливает их в индекс.
+
+        :param camera: :class:`Camera`
+        :return type: :class:`IntervalSet`
+        """
+        last_end = self.last_end(camera)
+        begin_time = None if last_end is None else ms_to_arrow(last_end - self.overlap)
+        tail = self.api.get_arch_interval_set(camera, begin_time=begin_time, scale=self.scale)
+        key = self._key(camera)
+        with self._lock:
+            merged = self._index.get(key, IntervalSet()) | tail
+            self._index[key] = merged
+        logger.debug('{}: {} new intervals since {}, {} in index'.format(
+            camera, len(tail), begin_time, len(merged)))
+        return merged
+
+    def update_many(self, cameras, max_workers=8):
+        """
+        :meth:`update` для многих камер параллельно. Ошибки отдельных камер логируются.
+
+        :return: Словарь камера -> исключение для камер, которые обновить не удалось.
+        """
+        errors = {}
+        self.api._ensure_pool_size(max_workers)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {executor.submit(self.update, cam): cam for cam in cameras}
+            for future, cam in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error('Can\'t update archive coverage for {}: {}'.format(cam, e))
+                    errors[cam] = e
+        finally:
+            executor.shutdown(wait=True)
+        return errors
+
+    def refresh(self, camera):
+        """
+        Забывает известные интервалы камеры и запрашивает всю историю заново.
+        """
+        with self._lock:
+            self._index.pop(self._key(camera), None)
+        return self.update(camera)
+
+    def forget_before(self, t):
+        """
+        Отбрасывает из индекса всех камер записи раньше `t`.
+
+        :param t: :class:`Arrow` или миллисекунды.
+        """
+        t = _to_ms(t)
+        with self._lock:
+            for key, intervals in self._index.items():
+                if intervals:
+                    self._index[key] = intervals.clip(t, max(intervals.end, t))
+
+    def is_recorded(self, camera, begin, end):
+        """
+        Записан ли отрезок `[begin, end]` целиком, без разрывов (по локальному индексу).
+
+        :param begin: :class:`Arrow` или миллисекунды.
+        :param end: :class:`Arrow` или миллисекунды.
+        """
+        return self.intervals(camera).covers(_to_ms(begin), _to_ms(end))
+
+    def coverage(self, camera, begin, end):
+        """
+        Доля (0..1) отрезка `[begin, end]`, покрытая записью (по локальному индексу).
+        """
+        return self.intervals(camera).coverage(_to_ms(begin), _to_ms(end))
+
+    def gaps(self, camera, begin, end):
+        return self.intervals(camera).gaps(_to_ms(begin), _to_ms(end))
+
+    def save(self, path=None):
+        """
+        Атомарно сохраняет индекс в JSON-файл (по умолчанию -- `index_path`).
+        """
+        path = path or self.index_path
+        with self._lock:
+            data = {key: {'begins': list(map(int, i.begins)), 'ends': list(map(int, i.ends))}
+                    for key, i in self._index.items()}
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as fd:
+            json.dump(data, fd, separators=(',', ':'))
+        replace_file(tmp_path, path)
+
+    def load(self, path=None):
+        path = path or self.index_path
+        with open(path) as fd:
+            data = json.load(fd)
+        with self._lock:
+            self._index = {key: IntervalSet(i['begins'], i['ends']) for key, i in data.items()}
@@ -0,0 +1,201 @@
+# -*- coding: utf-8 -*-
+"""
+Компактное представление содержимого архива: множество непересекающихся интервалов времени,
+хранящееся в двух массивах миллисекунд от эпохи (UTC).
+"""
+
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right
+
+from .timestamp_codec import INT64_TYPECODE, arrow_to_ms, ms_to_arrow, ts_to_ms_bulk
+
+
+class IntervalSet(object):
+    """
+    Отсортированный набор непересекающихся интервалов `[begin, end]` в миллисекундах.
+    Пересекающиеся и соприкасающиеся интервалы при создании склеиваются. Длительность интервала --
+    `end - begin`, разрыв между соседними интервалами -- `[end, следующий begin]`.
+
+    Поиск точки и отрезка -- O(log n), объединение, пересечение и разрывы -- O(n + m).
+    """
+
+    __slots__ = ('begins', 'ends')
+
+    def __init__(self, begins=(), ends=()):
+        """
+        :param begins: Начала интервалов (мс), в любом порядке.
+        :param ends: Концы интервалов (мс), в том же порядке, что и `begins`.
+        """
+        self._set_sorted_pairs(sorted(zip(begins, ends)))
+
+    def _set_sorted_pairs(self, pairs):
+        self.begins = array(INT64_TYPECODE)
+        self.ends = array(INT64_TYPECODE)
+        for b, e in pairs:
+            if e < b:
+                raise ValueError('Interval end {} is before its begin {}'.format(e, b))
+            if self.ends and b <= self.ends[-1]:
+                if e > self.ends[-1]:
+                    self.ends[-1] = e
+            else:
+                self.begins.append(b)
+                self.ends.append(e)
+
+    @classmethod
+    def _from_normalized(cls, begins, ends):
+        obj = cls.__new__(cls)
+        obj.begins = array(INT64_TYPECODE, begins)
+        obj.ends = array(INT64_TYPECODE, ends)
+        return obj
+
+    @classmethod
+    def from_web_api(cls, intervals):
+        """
+        :param intervals: Интервалы в формате Web API: словари со строками `begin` и `end`.
+        """
+        return cls(ts_to_ms_bulk([i['begin'] for i in intervals]),
+                   ts_to_ms_bulk([i['end'] for i in intervals]))
+
+    @classmethod
+    def from_arrow(cls, intervals):
+        """
+        :param intervals: Словари с :class:`Arrow` в `begin` и `end`, как возвращает
+                          `WebHttpApi.get_arch_intervals`.
+        """
+        return cls([arrow_to_ms(i['begin']) for i in intervals],
+                   [arrow_to_ms(i['end']) for i in intervals])
+
+    def to_arrow(self):
+        return [{'begin': ms_to_arrow(b), 'end': ms_to_arrow(e)} for b, e in self]
+
+    def __len__(self):
+        return len(self.begins)
+
+    def __iter__(self):
+        return iter(zip(self.begins, self.ends))
+
+    def __eq__(self, other):
+        return (isinstance(other, IntervalSet) and
+                self.begins == other.begins and self.ends == other.ends)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, list(self))
+
+    def __or__(self, other):
+        return self.union(other)
+
+    def __and__(self, other):
+        return self.intersection(other)
+
+    @property
+    def begin(self):
+        return self.begins[0] if self.begins else None
+
+    @property
+    def end(self):
+        return self.ends[-1] if self.ends else None
+
+    def total(self):
+        """
+        Суммарная длительность интервалов (мс).
+        """
+        return sum(self.ends) - sum(self.begins)
+
+    def _find(self, t):
+        """
+        Номер интервала, содержащего `t`, или -1.
+        """
+        i = bisect_right(self.begins, t) - 1
+        if i >= 0 and t <= self.ends[i]:
+            return i
+        return -1
+
+    def contains(self, t):
+        return self._find(t) >= 0
+
+    __contains__ = contains
+
+    def covers(self, begin, end):
+        """
+        Целиком ли отрезок `[begin, end]` лежит в одном интервале (записан без разрывов).
+        """
+        i = self._find(begin)
+        return i >= 0 and end <= self.ends[i]
+
+    def clip(self, begin, end):
+        """
+        Часть набора, лежащая в отрезке `[begin, end]`.
+        """
+        lo = bisect_left(self.ends, begin)
+        hi = bisect_right(self.begins, end)
+        begins = self.begins[lo:hi]
+        ends = self.ends[lo:hi]
+        if begins:
+            begins[0] = max(begins[0], begin)
+            ends[-1] = min(ends[-1], end)
+        return self._from_normalized(begins, ends)
+
+    def union(self, other):
+        obj = IntervalSet.__new__(IntervalSet)
+        obj._set_sorted_pairs(heapq.merge(iter(self), iter(other)))
+        return obj
+
+    def intersection(self, other):
+        begins, ends = [], []
+        i = j = 0
+        while i < len(self.begins) and j < len(other.begins):
+            b = max(self.begins[i], other.begins[j])
+            e = min(self.ends[i], other.ends[j])
+            if b <= e:
+                begins.append(b)
+                ends.append(e)
+            if self.ends[i] < other.ends[j]:
+                i += 1
+            else:
+                j += 1
+        return self._from_normalized(begins, ends)
+
+    def gaps(self, begin=None, end=None):
+        """
+        Разрывы между интервалами. Если заданы `begin` и `end`, рассматривается только отрезок
+        `[begin, end]`, включая разрывы на его краях.
+        """
+        bounded = begin is not None and end is not None
+        clipped = self.clip(begin, end) if bounded else self
+        begins, ends = [], []
+        prev_end = begin if bounded else None
+        for b, e in clipped:
+            if prev_end is not None and b > prev_end:
+                begins.append(prev_end)
+                ends.append(b)
+            prev_end = e
+        if bounded and prev_end < end:
+            begins.append(prev_end)
+            ends.append(end)
+        return self._from_normalized(begins, ends)
+
+    def coverage(self, begin, end):
+        """
+        Доля (0..1) отрезка `[begin, end]`, покрытая интервалами.
+        """
+        if end <= begin:
+            return 1.0 if self.contains(begin) else 0.0
+        return float(self.clip(begin, end).total()) / (end - begin)
+
+    def merge_by_scale(self, scale):
+        """
+        Склеивает интервалы, разрыв между которыми меньше `scale` мс (так же, как параметр
+        `scale` Web API).
+        """
+        begins, ends = [], []
+        for b, e in self:
+            if ends and b - ends[-1] < scale:
+                ends[-1] = e
+            else:
+                begins.append(b)
+                ends.append(e)
+        return self._from_normalized(begins, ends)
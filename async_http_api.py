@@ -0,0 +1,539 @@
+# -*- coding: utf-8 -*-
+"""
+asyncio-версия :class:`WebHttpApi` и :class:`RsgHttpApi` (только Python 3.5+, нужен aiohttp).
+
+Методы повторяют синхронные, но являются корутинами; ошибки те же: :class:`ServerError` и
+:class:`RSGServerError`, проверка ответов делается теми же `check_for_error`.
+
+Поддерживается не весь набор методов синхронных классов. Нет: массового создания объектов
+(`create_*_bulk`), `batch`/`checkpoint`, кэша объектов (`cache_ttl`, `find_detectors`,
+`iter_*`), политики повторов, а также `scan_arch_intervals` и `download_export_files` --
+вместо них достаточно `asyncio.gather` над `get_all_arch_intervals` и `export_video`.
+
+    async with AsyncRsgHttpApi('axxon-node', port=8000, max_in_flight=200) as api:
+        cameras = await api.get_cameras()
+"""
+
+import asyncio
+import json
+import logging
+import os.path
+import time
+from datetime import datetime
+from operator import itemgetter
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+
+from .archive_intervals import IntervalSet
+from .http_api import (Archive, Camera, Detector, ExportJobError, ExportJobState,
+                       RSGRequestLogWriter, RsgHttpApi, TimeSortOrder, WebHttpApi,
+                       add_int_to_dict, arrow_to_ts, intervals_to_arrow, older_page_end,
+                       pretty_dict, replace_file)
+from .http_metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+
+class _BufferedResponse(object):
+    """
+    Полностью прочитанный ответ aiohttp с интерфейсом `requests.Response` в объеме, нужном
+    `check_for_error` и вызывающему коду.
+    """
+
+    def __init__(self, method, url, status_code, headers, content, elapsed):
+        self.method = method
+        self.url = url
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.elapsed = elapsed
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8', 'replace')
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(
+                '{} Error for url: {}'.format(self.status_code, self.url), response=None)
+
+
+class AsyncConnection(object):
+    def __init__(self, addr='localhost', port=None, auth=('root', 'root'), prefix=None,
+                 limit=100, max_in_flight=None, timeout=None):
+        """
+        :param int limit: Размер пула соединений aiohttp.
+        :param int max_in_flight: Максимальное число одновременных запросов (по умолчанию --
+                                  `limit`).
+        :param float timeout: Общий таймаут одного запроса (сек.).
+        """
+        assert port is not None
+        self.addr = addr
+        self.port = port
+        self.prefix = prefix
+        self.auth = aiohttp.BasicAuth(*auth) if auth else None
+        self.limit = limit
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_in_flight or limit)
+        self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    @staticmethod
+    def check_for_error(r):
+        raise Exception('Mehtod AsyncConnection.check_for_error(...) must be overridden')
+
+    @property
+    def base_url(self):
+        base_url = 'http://{}:{}'.format(self.addr, self.port)
+        if self.prefix:
+            base_url += '/{}'.format(self.prefix)
+        return base_url
+
+    @property
+    def session(self):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(
+                auth=self.auth,
+                connector=aiohttp.TCPConnector(limit=self.limit),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @staticmethod
+    def _fix_params(params):
+        # aiohttp, в отличие от requests, не принимает bool и None в параметрах запроса.
+        if not params:
+            return params
+        return {k: (str(v).lower() if isinstance(v, bool) else v)
+                for k, v in params.items() if v is not None}
+
+    async def request(self, method, path, **kwargs):
+        assert path.startswith('/')
+        kwargs['params'] = self._fix_params(kwargs.get('params'))
+        url = self.base_url + path
+        async with self._semaphore:
+            start = time.time()
+            async with self.session.request(method, url, **kwargs) as r:
+                content = await r.read()
+                r = _BufferedResponse(method, str(r.url), r.status, r.headers, content,
+                                      time.time() - start)
+        self.on_response(r, kwargs)
+        self.check_for_error(r)
+        return r
+
+    def on_response(self, r, kwargs):
+        pass
+
+    async def get(self, path, **kwargs):
+        return await self.request('GET', path, **kwargs)
+
+    async def post(self, path, **kwargs):
+        return await self.request('POST', path, **kwargs)
+
+    async def put(self, path, **kwargs):
+        return await self.request('PUT', path, **kwargs)
+
+    async def delete(self, path, **kwargs):
+        return await self.request('DELETE', path, **kwargs)
+
+
+class AsyncWebHttpApi(AsyncConnection):
+
+    check_for_error = staticmethod(WebHttpApi.check_for_error)
+    _prepare_save_dir = staticmethod(WebHttpApi._prepare_save_dir)
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncWebHttpApi, self).__init__(*args, **kwargs)
+        self._nodes = None
+
+    async def get_nodes(self, cached=False):
+        if not cached or self._nodes is None:
+            self._nodes = (await self.get('/hosts')).json()
+        return list(self._nodes)
+
+    async def _single_node(self):
+        nodes = await self.get_nodes(cached=True)
+        if len(nodes) != 1:
+            raise Exception('Cann\'t choose node name automatically: get_nodes() returns {}'.format(
+                nodes))
+        return nodes[0]
+
+    async def get_cpu_load(self):
+        j = (await self.get('/statistics/hardware')).json()
+        return float(j[0]['totalCPU'].replace(',', '.')) / 100
+
+    async def _get_arch_intervals_page(self, cam, begin_time, end_time, params):
+        r = await self.get(
+            '/archive/contents/intervals/{}/{}/{}'.format(cam.video_source_id, end_time, begin_time),
+            params=params)
+        data = r.json()
+        return data['intervals'], data['more']
+
+    async def get_arch_intervals(self, display_id, node=None, channel=0, stream=0,
+                                 begin_time=None, end_time=None, limit=None, scale=None,
+                                 sort_order=TimeSortOrder.NEWER_FIRST):
+        """
+        См. :meth:`WebHttpApi.get_arch_intervals`.
+        """
+        if node is None:
+            node = await self._single_node()
+        params = {}
+        add_int_to_dict(params, 'limit', limit)
+        add_int_to_dict(params, 'scale', scale)
+        end_time = 'future' if end_time is None else arrow_to_ts(end_time)
+        begin_time = 'past' if begin_time is None else arrow_to_ts(begin_time)
+
+        cam = Camera.from_display_id(node, display_id, channel=channel, stream=stream)
+        intervals, more = await self._get_arch_intervals_page(cam, begin_time, end_time, params)
+        intervals = sorted(intervals, key=itemgetter('begin'),
+                           reverse=(sort_order is TimeSortOrder.NEWER_FIRST))
+        return intervals_to_arrow(intervals), more
+
+    async def get_all_arch_intervals(self, camera, begin_time=None, end_time=None,
+                                     limit=None, scale=None):
+        """
+        См. :meth:`WebHttpApi.get_all_arch_intervals`.
+        """
+        params = {}
+        add_int_to_dict(params, 'limit', limit)
+        add_int_to_dict(params, 'scale', scale)
+        begin_ts = 'past' if begin_time is None else arrow_to_ts(begin_time)
+        end_ts = 'future' if end_time is None else arrow_to_ts(end_time)
+
+        result = []
+        seen = set()
+        while True:
+            page, more = await self._get_arch_intervals_page(camera, begin_ts, end_ts, params)
+            fresh = [i for i in page if (i['begin'], i['end']) not in seen]
+            result.extend(fresh)
+            if not more or not page:
+                break
+            end_ts = older_page_end(page, fresh, end_ts)
+            if end_ts is None:
+                break
+            seen = set((i['begin'], i['end']) for i in page)
+        result.sort(key=itemgetter('begin'), reverse=True)
+        return result
+
+    async def get_arch_interval_set(self, camera, begin_time=None, end_time=None,
+                                    limit=None, scale=None):
+        """
+        См. :meth:`WebHttpApi.get_arch_interval_set`.
+        """
+        return IntervalSet.from_web_api(await self.get_all_arch_intervals(
+            camera, begin_time=begin_time, end_time=end_time, limit=limit, scale=scale))
+
+    async def start_export(self, display_id, begin_time, end_time, format_, node=None):
+        """
+        См. :meth:`WebHttpApi.start_export`.
+        """
+        format_ = str(format_).lower()
+        if format_ not in ['mkv', 'avi', 'exe', 'jpg', 'pdf']:
+            raise Exception('Unsupported export format_ = {}'.format(format_))
+        if node is None:
+            node = await self._single_node()
+        cam = Camera.from_display_id(node, display_id)
+        r = await self.post(
+            '/export/archive/{}/{}/{}'.format(cam.video_source_id, arrow_to_ts(begin_time),
+                                              arrow_to_ts(end_time)),
+            data=json.dumps({'format': format_}))
+        return r.headers['Location']
+
+    async def get_export_status(self, job_id):
+        return (await self.get('{}/status'.format(job_id))).json()
+
+    async def cancel_export(self, job_id):
+        await self.delete(job_id)
+
+    async def export_video(self, display_id, begin_time, end_time,
+                           format_, save_dir, node=None, timeout=None,
+                           min_interval=1.0, max_interval=30.0):
+        """
+        См. :meth:`WebHttpApi.export_video`.
+        """
+        self._prepare_save_dir(save_dir)
+        job_id = await self.start_export(display_id, begin_time, end_time, format_, node=node)
+        started = time.time()
+        while True:
+            status = await self.get_export_status(job_id)
+            if status.get('state', None) != ExportJobState.IN_PROGRESS.value:
+                break
+            elapsed = time.time() - started
+            if timeout is not None and elapsed > timeout:
+                await self.cancel_export(job_id)
+                raise ExportJobError('Export job_id = \'{}\' timed out at progress {}'.format(
+                    job_id, status.get('progress')))
+            try:
+                p = float(status['progress'])
+                sleep = (1.0 - p) / p * elapsed / 2.0
+            except (KeyError, TypeError, ValueError, ZeroDivisionError):
+                sleep = min_interval
+            sleep = min(max(sleep, min_interval), max_interval)
+            if timeout is not None:
+                sleep = min(sleep, max(timeout - elapsed, 0))
+            await asyncio.sleep(sleep)
+
+        if status['state'] != ExportJobState.DONE.value:
+            raise ExportJobError('Error during export: \"{}\" (code={}). Progress: {}.'.format(
+                status.get('error'), status['state'], status.get('progress')))
+        return await asyncio.gather(*[self._download_export_file(job_id, file_name, save_dir)
+                                      for file_name in status['files']])
+
+    async def _download_export_file(self, job_id, file_name, save_dir):
+        path = os.path.join(save_dir, file_name)
+        part_path = WebHttpApi.part_path(job_id, path)
+        url = self.base_url + '{}/file'.format(job_id)
+        # Общий таймаут сессии ограничивал бы все скачивание целиком, поэтому для файлов
+        # ограничены только соединение и пауза между порциями данных.
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.timeout,
+                                        sock_read=self.timeout)
+        try:
+            async with self._semaphore:
+                async with self.session.get(url, params={'name': file_name},
+                                            timeout=timeout) as r:
+                    if r.status >= 400:
+                        self.check_for_error(_BufferedResponse('GET', str(r.url), r.status,
+                                                               r.headers, await r.read(), 0))
+                    with open(part_path, 'wb') as fd:
+                        async for chunk in r.content.iter_chunked(1024*1024):
+                            fd.write(chunk)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+        replace_file(part_path, path)
+        return path
+
+
+class AsyncRsgHttpApi(AsyncConnection):
+
+    check_for_error = staticmethod(RsgHttpApi.check_for_error)
+    fix_drive_letter_case = staticmethod(RsgHttpApi.fix_drive_letter_case)
+    _split_camera_data = staticmethod(RsgHttpApi._split_camera_data)
+    _split_detector_data = staticmethod(RsgHttpApi._split_detector_data)
+    _archive_data = RsgHttpApi.__dict__['_archive_data']
+
+    def __init__(self, *args, **kwargs):
+        """
+        :param str log_db: См. :class:`RsgHttpApi`.
+        """
+        log_db = kwargs.pop('log_db', None)
+        super(AsyncRsgHttpApi, self).__init__(*args, **kwargs)
+        self.log_writer = RSGRequestLogWriter(log_db) if log_db is not None else None
+        self.objects_functions = {
+            'Camera': self.get_cameras,
+            'Archive': self.get_archives,
+            'Detector': self.get_detectors,
+        }
+        self.locks = {name: asyncio.Lock() for name in self.objects_functions}
+
+    async def close(self):
+        await super(AsyncRsgHttpApi, self).close()
+        if self.log_writer is not None:
+            self.log_writer.close()
+
+    def on_response(self, r, kwargs):
+        if self.log_writer is not None:
+            body = kwargs.get('json')
+            self.log_writer.write({
+                'method': r.method,
+                'url': r.url,
+                'body': json.dumps(body) if body is not None else (kwargs.get('data') or ''),
+                'utc_start': datetime.utcfromtimestamp(time.time() - r.elapsed),
+                'delta': r.elapsed,
+                'status_code': r.status_code,
+                'route': route_template(urlsplit(r.url).path),
+            })
+
+    async def _create_object(self, object_class, post):
+        """
+        Асинхронный аналог :meth:`RsgHttpApi.get_new_object`: `post()` возвращает корутину,
+        создающую объект, а новый объект находится сравнением списков до и после.
+        """
+        name = object_class.__name__
+        function = self.objects_functions[name]
+        async with self.locks[name]:
+            objects_before = await function()
+            await post()
+            objects_after = await function()
+        objects_new = list(set(objects_after) - set(objects_before))
+        assert len(objects_new) == 1
+        return objects_new[0]
+
+    async def flush(self):
+        await self.post('/rsg', json={'action': 'flush'})
+
+    async def create_camera(self, data):
+        ini_data, upd_data = self._split_camera_data(data)
+        camera = await self._create_object(
+            Camera, lambda: self.post('/rsg/ipint', json=ini_data))
+        await self.put('/rsg/ipint', json=upd_data, params={'id': camera.id})
+        await self.flush()
+        logger.info("{} created.".format(camera))
+        return camera
+
+    async def create_virtual_camera(self, video_clips_folder=None):
+        data = {
+            'Vendor': 'AxxonSoft',
+            'Model': 'Virtual',
+        }
+        if video_clips_folder is not None:
+            data['vstream-virtual/folder'] = self.fix_drive_letter_case(video_clips_folder)
+        return await self.create_camera(data)
+
+    async def create_archive(self, archive_file, size=5, should_format=True, color='Red',
+                             name=None):
+        data = self._archive_data(archive_file, size=size,
+                                  should_format=should_format, color=color, name=name)
+        arch = await self._create_object(
+            Archive, lambda: self.post('/rsg/archive', json=data))
+        await self.flush()
+        logger.info('{} created.'.format(arch))
+        return arch
+
+    async def create_detector(self, data, camera):
+        ini_data, upd_data = self._split_detector_data(data)
+        detector = await self._create_object(
+            Detector,
+            lambda: self.post('/rsg/detector', json=ini_data,
+                              params={'pid': camera.source_endpoint_id}))
+        upd_id = '{0}|{1}'.format(camera.id, detector.id)
+        await self.put('/rsg/detector', json=upd_data, params={'id': upd_id})
+        await self.flush()
+        logger.info('{} created ({}).'.format(detector, camera))
+        return detector
+
+    async def update_detector(self, detector, data):
+        upd_id = '{0}|{1}'.format(detector.camera.id, detector.id)
+        await self.put('/rsg/detector', json=data, params={'id': upd_id})
+        await self.flush()
+        logger.info('{} updated.'.format(detector))
+
+    async def update_camera(self, camera, data):
+        await self.put('/rsg/ipint', json=data, params={'id': camera.id})
+        await self.flush()
+        logger.info('{} updated.'.format(camera))
+
+    async def update_archive(self, archive, data):
+        await self.put('/rsg/archive', json=data, params={'id': archive.id})
+        await self.flush()
+        logger.info('{} updated.'.format(archive))
+
+    async def get_camera(self, display_id):
+        cameras = [c for c in await self.get_cameras() if c.display_id == int(display_id)]
+        assert len(cameras) == 1
+        return cameras[0]
+
+    get_camera_by_id = get_camera
+
+    async def get_cameras(self):
+        _list = (await self.get('/rsg/ipint')).json()['Data']
+        return [Camera(item['Id']) for item in _list]
+
+    async def get_archives(self):
+        _list = (await self.get('/rsg/archive')).json()['Data']
+        return [Archive(item['Name']) for item in _list]
+
+    async def get_detectors(self):
+        detectors = []
+        for c in (await self.get('/rsg/detector')).json()['Data']:
+            camera = Camera(c['Id'])
+            for ch in c['Children']:
+                detectors.append(Detector.from_rsg(ch, camera))
+        return detectors
+
+    async def delete_vmda_data(self, camera):
+        await self.delete('/rsg/vmda/data', params={'id': camera.id})
+        await self.flush()
+        logger.info('VMDA data for {} deleted.'.format(camera))
+
+    async def delete_camera(self, camera, remove_vmda_data=True):
+        if remove_vmda_data:
+            await self.delete_vmda_data(camera)
+        await self.delete('/rsg/ipint', params={'id': camera.id})
+        await self.flush()
+        logger.info('{} deleted.'.format(camera))
+
+    async def delete_archive(self, archive):
+        await self.delete('/rsg/archive', params={'id': archive.id})
+        await self.flush()
+        logger.info('{} deleted.'.format(archive))
+
+    async def delete_detector(self, detector):
+        del_id = '{0}|{1}'.format(detector.camera.id, detector.id)
+        await self.delete('/rsg/detector', params={'id': del_id})
+        await self.flush()
+        logger.info('{} deleted.'.format(detector))
+
+    async def delete_all_cameras(self):
+        await self.delete('/rsg/ipint', params={'id': '.'})
+        await self.flush()
+        logger.info("All cameras deleted.")
+
+    async def delete_all_archives(self):
+        await self.delete('/rsg/archive', params={'id': '.'})
+        await self.flush()
+        logger.info("All archives deleted.")
+
+    async def delete_all_detectors(self):
+        await self.delete('/rsg/detector', params={'id': '.'})
+        await self.flush()
+        logger.info("All detectors deleted.")
+
+    async def bind_camera_to_archive(self, camera, archive, permanent_write=False,
+                                     replication=False):
+        params = {
+            'id': camera.source_endpoint_id,
+            'pid': archive.id,
+        }
+        data = {
+            'Bind': camera.source_endpoint_id,
+            'PermanentWrite': permanent_write,
+        }
+        if replication:
+            data['SourceArchive'] = camera.embedded_storage_id
+        await self.post('/rsg/binding', json=data, params=params)
+        await self.flush()
+        logger.info('{} bound to {}.'.format(camera, archive))
+
+    async def start_import(self, camera, archive, begin_time, end_time):
+        data = {
+            'Archive': archive.id,
+            'BindingName': camera.source_endpoint_id,
+            'BeginTime': int(begin_time),
+            'EndTime': int(end_time),
+        }
+        j = (await self.post('/rsg/binding/replication', json=data)).json()
+        await self.flush()
+        return j['Data']['Token']
+
+    async def get_import_progress(self, token):
+        j = (await self.get('/rsg/binding/replication', params={'id': token})).json()
+        return float(j['Data']['Progress']) / 100
+
+    async def get_info(self, obj):
+        if isinstance(obj, Camera):
+            res = (await self.get('/rsg/ipint?id="{}"'.format(obj.id))).json()['Data']
+        elif isinstance(obj, Archive):
+            res = (await self.get('/rsg/archive?id="{}"'.format(obj.id))).json()['Data']
+        elif isinstance(obj, Detector):
+            res = (await self.get('/rsg/detector?id="{}|{}"'.format(
+                obj.camera.id, obj.id))).json()['Data']
+        if len(res) > 1:
+            logger.error('len(res) > 1\nrequested object: {} (id = {})\nres:{}'.format(
+                obj, obj.id, pretty_dict(res)))
+        return res
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+"""
+Работа с многосерверным доменом: по паре соединений (Web API и RSG) на каждую ноду, маршрутизация
+операций с объектами на ноду из их id и параллельные запросы ко всем нодам.
+
+    with ClusterApi('node-1', web_port=80, rsg_port=8000) as cluster:
+        loads = cluster.get_cpu_load()          # {нода: загрузка}
+        cameras = cluster.get_cameras()         # камеры всех нод одним списком
+        cluster.rsg_for(camera).delete_camera(camera)
+        for result in cluster.scan_arch_intervals(cameras):
+            ...
+"""
+
+import logging
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError, wait
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .archive_intervals import IntervalSet
+from .http_api import ArchIntervalsScanResult, AxxonObject, Camera, RsgHttpApi, WebHttpApi
+
+logger = logging.getLogger(__name__)
+
+NodeResult = namedtuple('NodeResult', ['node', 'value', 'error'])
+
+
+class ClusterError(RuntimeError):
+    """
+    Не все ноды ответили без ошибок.
+
+    :ivar result: :class:`ClusterResult` -- значения ответивших нод и ошибки остальных.
+    """
+
+    def __init__(self, result):
+        self.result = result
+        super(ClusterError, self).__init__('Requests to {} failed: {}'.format(
+            ', '.join(sorted(result.errors)),
+            '; '.join('{}: {}'.format(node, result.errors[node]) for node in sorted(result.errors))))
+
+
+class ClusterResult(dict):
+    """
+    Результат параллельного запроса: нода -> значение для нод, ответивших без ошибок.
+
+    :ivar dict errors: Нода -> исключение (для не уложившихся в таймаут --
+                       `concurrent.futures.TimeoutError`).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(ClusterResult, self).__init__(*args, **kwargs)
+        self.errors = {}
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def merged(self):
+        """
+        Списки значений всех нод одним списком без повторов (объект, который видят несколько
+        нод, попадает в результат один раз).
+        """
+        seen = set()
+        result = []
+        for node in sorted(self):
+            for item in self[node]:
+                if item not in seen:
+                    seen.add(item)
+                    result.append(item)
+        return result
+
+
+class ClusterApi(object):
+    def __init__(self, addr='localhost', web_port=None, rsg_port=None, nodes=None, addresses=None,
+                 timeout=30.0, timeouts=None, max_workers=16, web_kwargs=None, rsg_kwargs=None,
+                 **kwargs):
+        """
+        :param str addr: Адрес любой ноды домена; у нее запрашивается список нод (`get_nodes()`),
+                         если не заданы ни `nodes`, ни `addresses`.
+        :param int web_port: Порт Web API на каждой ноде.
+        :param int rsg_port: Порт RSG на каждой ноде.
+        :param list nodes: Имена нод.
+        :param dict addresses: Имя ноды -> адрес. По умолчанию адрес ноды -- ее имя.
+        :param float timeout: Сколько секунд ждать ответа каждой ноды при параллельных запросах.
+        :param dict timeouts: Таймауты отдельных нод (имя ноды -> сек.).
+        :param int max_workers: Сколько нод опрашивается одновременно.
+        :param dict web_kwargs: Дополнительные параметры :class:`WebHttpApi` (например, `prefix`).
+        :param dict rsg_kwargs: Дополнительные параметры :class:`RsgHttpApi` (например,
+                                `cache_ttl`).
+        :param kwargs: Общие параметры соединений: `auth`, `instrumentation`, `resilience`.
+                       Сетевые таймауты запросов задаются через `resilience`; `timeout` и
+                       `timeouts` ограничивают только ожидание результата.
+        """
+        assert web_port is not None or rsg_port is not None
+        self.addr = addr
+        self.web_port = web_port
+        self.rsg_port = rsg_port
+        self.addresses = dict(addresses or {})
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        self.max_workers = max_workers
+        self.web_kwargs = dict(kwargs, **(web_kwargs or {}))
+        self.rsg_kwargs = dict(kwargs, **(rsg_kwargs or {}))
+        self._lock = threading.Lock()
+        self._web = {}
+        self._rsg = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Нода -> вызов fan_out, не уложившийся в таймаут и все еще занимающий поток.
+        self._stuck = {}
+        if nodes is None and self.addresses:
+            nodes = sorted(self.addresses)
+        self._nodes = list(nodes) if nodes is not None else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            connections = list(self._web.values()) + list(self._rsg.values())
+            self._web = {}
+            self._rsg = {}
+        for connection in connections:
+            connection.close()
+
+    def get_nodes(self, cached=True):
+        """
+        :param bool cached: Вернуть список, полученный при предыдущем запросе (или заданный при
+                            создании).
+        """
+        if not cached or self._nodes is None:
+            seed = WebHttpApi(self.addr, port=self.web_port, **self.web_kwargs)
+            try:
+                self._nodes = seed.get_nodes()
+            finally:
+                seed.close()
+        return list(self._nodes)
+
+    def address(self, node):
+        return self.addresses.get(node, node)
+
+    @staticmethod
+    def node_of(obj):
+        """
+        :param obj: :class:`AxxonObject` или имя ноды.
+        """
+        if isinstance(obj, AxxonObject):
+            if obj.node is None:
+                raise ValueError('Can\'t get node name from id {!r}'.format(obj.id))
+            return obj.node
+        return obj
+
+    def _connection(self, pool, node, cls, port, kwargs):
+        with self._lock:
+            connection = pool.get(node)
+            if connection is None:
+                assert port is not None, 'Port for {} is not set'.format(cls.__name__)
+                connection = pool[node] = cls(self.address(node), port=port, **kwargs)
+            return connection
+
+    def web(self, node):
+        """
+        :return: Соединение с Web API ноды (одно на ноду, создается при первом обращении).
+        :return type: :class:`WebHttpApi`
+        """
+        return self._connection(self._web, node, WebHttpApi, self.web_port, self.web_kwargs)
+
+    def rsg(self, node):
+        """
+        :return: Соединение с RSG ноды (одно на ноду, создается при первом обращении).
+        :return type: :class:`RsgHttpApi`
+        """
+        return self._connection(self._rsg, node, RsgHttpApi, self.rsg_port, self.rsg_kwargs)
+
+    def web_for(self, obj):
+        """
+        Соединение с Web API ноды, которой принадлежит объект (см. :meth:`node_of`).
+        """
+        return self.web(self.node_of(obj))
+
+    def rsg_for(self, obj):
+        """
+        Соединение с RSG ноды, которой принадлежит объект (см. :meth:`node_of`).
+        """
+        return self.rsg(self.node_of(obj))
+
+    def timeout_for(self, node):
+        return self.timeouts.get(node, self.timeout)
+
+    def fan_out(self, function, nodes=None):
+        """
+        Параллельно вызывает `function(node)` для каждой ноды. Результат каждой ноды ждем не
+        дольше ее таймаута (см. :meth:`timeout_for`), отсчитывая от начала вызова, так что
+        зависшая нода не задерживает остальные.
+
+        Прервать уже выполняющийся вызов нельзя, он продолжает занимать поток. Пока такой вызов
+        не завершится, новые вызовы для этой ноды не запускаются и сразу завершаются
+        `TimeoutError`, чтобы зависшая нода не заняла все потоки.
+
+        :param nodes: По умолчанию -- все ноды (см. :meth:`get_nodes`).
+        :return: Генератор :class:`NodeResult` в порядке готовности.
+        """
+        if nodes is None:
+            nodes = self.get_nodes()
+        start = time.time()
+        futures = {}
+        for node in nodes:
+            with self._lock:
+                stuck = self._stuck.get(node)
+                if stuck is not None and stuck.done():
+                    del self._stuck[node]
+                    stuck = None
+            if stuck is not None:
+                logger.error('{} is still busy with a timed out request'.format(node))
+                yield NodeResult(node, None, TimeoutError(
+                    '{} is still busy with a timed out request'.format(node)))
+                continue
+            futures[self._executor.submit(function, node)] = node
+        deadlines = {future: start + self.timeout_for(node) for future, node in futures.items()}
+        pending = set(futures)
+        while pending:
+            now = time.time()
+            for future in [f for f in pending if deadlines[f] <= now and not f.done()]:
+                pending.remove(future)
+                node = futures[future]
+                if not future.cancel():
+                    with self._lock:
+                        self._stuck[node] = future
+                logger.error('{} did not respond in {} s'.format(node, self.timeout_for(node)))
+                yield NodeResult(node, None, TimeoutError('{} did not respond in {} s'.format(
+                    node, self.timeout_for(node))))
+            if not pending:
+                break
+            timeout = max(min(deadlines[f] for f in pending) - time.time(), 0)
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.remove(future)
+                node = futures[future]
+                error = future.exception()
+                if error is not None:
+                    logger.error('Request to {} failed: {}'.format(node, error))
+                    yield NodeResult(node, None, error)
+                else:
+                    yield NodeResult(node, future.result(), None)
+
+    def collect(self, function, nodes=None):
+        """
+        Как :meth:`fan_out`, но возвращает результаты всех нод сразу.
+
+        :return type: :class:`ClusterResult`
+        """
+        result = ClusterResult()
+        for node, value, error in self.fan_out(function, nodes):
+            if error is None:
+                result[node] = value
+            else:
+                result.errors[node] = error
+        return result
+
+    def get_cpu_load(self, nodes=None):
+        """
+        :return: Нода -> загрузка процессора (0..1).
+        :return type: :class:`ClusterResult`
+        """
+        return self.collect(lambda node: self.web(node).get_cpu_load(), nodes)
+
+    def _merged(self, function, nodes, strict):
+        result = self.collect(function, nodes)
+        if strict and result.errors:
+            raise ClusterError(result)
+        return result.merged()
+
+    def get_cameras(self, nodes=None, strict=True):
+        """
+        :param bool strict: Если какая-то нода ответила ошибкой или не ответила, выбросить
+                            :class:`ClusterError` (в нем есть и результаты остальных нод). Иначе
+                            ошибки нод только логируются.
+        :return: Камеры всех нод без повторов.
+        """
+        return self._merged(lambda node: self.rsg(node).get_cameras(), nodes, strict)
+
+    def get_archives(self, nodes=None, strict=True):
+        """
+        См. :meth:`get_cameras`.
+        """
+        return self._merged(lambda node: self.rsg(node).get_archives(), nodes, strict)
+
+    def get_detectors(self, nodes=None, strict=True):
+        """
+        См. :meth:`get_cameras`.
+        """
+        return self._merged(lambda node: self.rsg(node).get_detectors(), nodes, strict)
+
+    def scan_arch_intervals(self, cameras, begin_time=None, end_time=None, limit=None,
+                            scale=None, max_workers_per_node=8, as_interval_set=False):
+        """
+        :meth:`WebHttpApi.scan_arch_intervals` для камер разных нод: каждая камера запрашивается
+        у своей ноды, ноды сканируются одновременно, каждая в своем потоке.
+
+        Таймаут ноды (см. :meth:`timeout_for`) -- наибольшая пауза между ее результатами. Если
+        нода не уложилась в него или ее сканирование прервалось ошибкой, для ее оставшихся камер
+        отдаются результаты с пустыми интервалами и этой ошибкой.
+
+        :param cameras: Объекты :class:`Camera`.
+        :return: Генератор :class:`ArchIntervalsScanResult`; результаты отдаются по мере
+                 готовности, ошибки -- в поле `error`.
+        """
+        by_node = {}
+        for camera in cameras:
+            assert isinstance(camera, Camera)
+            by_node.setdefault(self.node_of(camera), []).append(camera)
+
+        results = queue.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def feed(node):
+            scan = self.web(node).scan_arch_intervals(
+                by_node[node], begin_time=begin_time, end_time=end_time, limit=limit,
+                scale=scale, max_workers=max_workers_per_node, as_interval_set=as_interval_set)
+            try:
+                for result in scan:
+                    if stop.is_set():
+                        return
+                    results.put((node, result))
+            except Exception as e:
+                results.put((node, e))
+                return
+            finally:
+                scan.close()
+            results.put((node, done))
+
+        remaining = {node: set(node_cameras) for node, node_cameras in by_node.items()}
+        deadlines = {}
+        for node in by_node:
+            thread = threading.Thread(target=feed, args=(node,),
+                                      name='ClusterApi.scan({})'.format(node))
+            thread.daemon = True
+            thread.start()
+            deadlines[node] = time.time() + self.timeout_for(node)
+
+        def fail(node, error):
+            logger.error('Can\'t scan archive intervals on {}: {}'.format(node, error))
+            del deadlines[node]
+            for camera in by_node[node]:
+                if camera in remaining[node]:
+                    yield ArchIntervalsScanResult(
+                        camera, IntervalSet() if as_interval_set else [], error)
+
+        try:
+            while deadlines:
+                now = time.time()
+                for node in [n for n, deadline in deadlines.items() if deadline <= now]:
+                    for result in fail(node, TimeoutError('{} did not respond in {} s'.format(
+                            node, self.timeout_for(node)))):
+                        yield result
+                if not deadlines:
+                    break
+                try:
+                    node, item = results.get(timeout=max(min(deadlines.values()) - now, 0))
+                except queue.Empty:
+                    continue
+                if node not in deadlines:
+                    # Нода уже признана не ответившей.
+                    continue
+                if item is done:
+                    del deadlines[node]
+                elif isinstance(item, Exception):
+                    for result in fail(node, item):
+                        yield result
+                else:
+                    remaining[node].discard(item.camera)
+                    deadlines[node] = time.time() + self.timeout_for(node)
+                    yield item
+        finally:
+            stop.set()
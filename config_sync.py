@@ -0,0 +1,373 @@
+# -*- coding: utf-8 -*-
+"""
+Приведение конфигурации RSG к желаемому состоянию: текущие камеры, детекторы и архивы
+запрашиваются один раз, по разнице строится план, и выполняются только нужные создания,
+изменения и удаления -- в одном :meth:`RsgHttpApi.batch`, с одним flush в конце. Повторная
+подготовка стенда стоит столько, сколько в ней изменилось, а не сколько в ней объектов.
+
+Желаемое состояние:
+
+    {
+        'archives': [{'name': 'A1', 'file': 'D:/archives/A1.afs', 'size': 5, 'color': 'Red'}],
+        'cameras': [{
+            'name': 'Entrance',                 # DisplayName, ключ сопоставления
+            'settings': {'Vendor': 'AxxonSoft', 'Model': 'Virtual'},
+            'archive': 'A1',                    # имя архива для привязки
+            'permanent_write': True,
+            'detectors': [{
+                'name': 'plates',               # DisplayName детектора на этой камере
+                'settings': dict(LICENSE_PLATES_RECOGNITION_DETECTOR, Sensitivity=7),
+            }],
+        }],
+    }
+
+    sync = ConfigSync(rsg_api, prune=True)
+    plan = sync.plan(desired)
+    print(plan.summary())
+    sync.apply(plan)
+
+Камеры и детекторы сопоставляются по `DisplayName`, архивы -- по имени (части id после
+`MultimediaStorage.`). Смена `Vendor`/`Model` камеры или `DetectorModule`/`DetectorType`
+детектора -- пересоздание объекта. Списка привязок RSG не отдает, поэтому привязки делаются
+для новых камер, а для существующих -- только с `rebind=True`.
+"""
+
+import json
+import logging
+
+import requests
+
+from .http_api import Archive, Camera, Detector, ServerError
+
+logger = logging.getLogger(__name__)
+
+CAMERA_INIT_KEYS = ('Vendor', 'Model')
+DETECTOR_INIT_KEYS = ('DetectorModule', 'DetectorType')
+VIRTUAL_CAMERA = {'Vendor': 'AxxonSoft', 'Model': 'Virtual'}
+
+
+def _same(current, desired):
+    """
+    RSG может вернуть число или логическое значение строкой: `'50'`, `'true'`.
+    """
+    if current == desired:
+        return True
+    if isinstance(desired, bool):
+        desired = 'true' if desired else 'false'
+    return current is not None and str(current).lower() == str(desired).lower()
+
+
+def _changes(current, desired, skip=()):
+    """
+    :return: Настройки из `desired`, значения которых отличаются от `current`.
+    """
+    return {k: v for k, v in desired.items()
+            if k not in skip and not _same(current.get(k), v)}
+
+
+class SyncPlan(object):
+    """
+    Список изменений. Объекты в `create_*` -- описания из желаемого состояния, в `update_*` --
+    пары (объект, изменившиеся настройки), в `delete_*` -- объекты.
+
+    :ivar list create_detectors: Тройки (ключ камеры, описание камеры, описание детектора).
+    :ivar list bindings: Пары (ключ камеры, описание камеры).
+    """
+
+    KINDS = ('create_archives', 'update_archives', 'delete_archives',
+             'create_cameras', 'update_cameras', 'delete_cameras',
+             'create_detectors', 'update_detectors', 'delete_detectors', 'bindings')
+
+    def __init__(self):
+        for kind in self.KINDS:
+            setattr(self, kind, [])
+        # Ключ камеры -> существующая камера (для детекторов и привязок существующих камер).
+        self.cameras = {}
+        self.archives = {}
+
+    def __len__(self):
+        return sum(len(getattr(self, kind)) for kind in self.KINDS)
+
+    def summary(self):
+        return {kind: len(getattr(self, kind)) for kind in self.KINDS}
+
+
+class SyncResult(object):
+    """
+    :ivar dict errors: Описание операции -> исключение.
+    """
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.errors = {}
+        self.cameras = dict(plan.cameras)
+        self.archives = dict(plan.archives)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def fail(self, what, error):
+        logger.error('Can\'t {}: {}'.format(what, error))
+        self.errors[what] = error
+
+
+class ConfigSync(object):
+    def __init__(self, api, prune=False, rebind=False):
+        """
+        :param api: :class:`RsgHttpApi`
+        :param bool prune: Удалять камеры, детекторы (на описанных камерах) и архивы, которых нет
+                           в желаемом состоянии.
+        :param bool rebind: Заново привязывать к архивам и существующие камеры.
+        """
+        self.api = api
+        self.prune = prune
+        self.rebind = rebind
+
+    def fetch(self):
+        """
+        Текущая конфигурация: три GET-запроса.
+
+        :return: Словари по ключам сопоставления: камеры `{DisplayName: (Camera, настройки)}`,
+                 детекторы `{DisplayName камеры: {DisplayName: (Detector, настройки)}}`, архивы
+                 `{имя: (Archive, настройки)}`.
+        """
+        cameras = {}
+        by_id = {}
+        for item in self.api.iter_items('/rsg/ipint'):
+            camera = Camera(item['Id'])
+            key = item.get('DisplayName', camera.id)
+            if key in cameras:
+                logger.warning('Duplicate camera name {!r}: {} and {}'.format(
+                    key, cameras[key][0], camera))
+            cameras[key] = (camera, item)
+            by_id[camera.id] = key
+
+        detectors = {}
+        for item in self.api.iter_items('/rsg/detector'):
+            camera = Camera(item['Id'])
+            camera_key = by_id.get(camera.id, camera.id)
+            for child in item['Children']:
+                detector = Detector.from_rsg(child, camera)
+                settings = child.get('Settings', {})
+                key = settings.get('DisplayName', detector.id)
+                detectors.setdefault(camera_key, {})[key] = (detector, settings)
+
+        archives = {}
+        for item in self.api.iter_items('/rsg/archive'):
+            archive = Archive(item['Name'])
+            archives[archive.name] = (archive, item)
+        return cameras, detectors, archives
+
+    def plan(self, desired):
+        """
+        :param dict desired: Желаемое состояние (см. описание модуля).
+        :return type: :class:`SyncPlan`
+        """
+        cameras, detectors, archives = self.fetch()
+        plan = SyncPlan()
+
+        wanted_archives = {}
+        for spec in desired.get('archives', []):
+            wanted_archives[spec['name']] = spec
+            current = archives.get(spec['name'])
+            if current is None:
+                plan.create_archives.append(spec)
+                continue
+            plan.archives[spec['name']] = current[0]
+            if 'color' in spec and not _same(current[1].get('Color'), spec['color']):
+                plan.update_archives.append((current[0], {'Color': spec['color']}))
+        if self.prune:
+            plan.delete_archives.extend(archive for name, (archive, _) in sorted(archives.items())
+                                        if name not in wanted_archives)
+
+        wanted_cameras = set()
+        for spec in desired.get('cameras', []):
+            key = spec['name']
+            wanted_cameras.add(key)
+            data = dict(VIRTUAL_CAMERA, **spec.get('settings', {}))
+            current = cameras.get(key)
+            if current is not None and any(not _same(current[1].get(k), data[k])
+                                           for k in CAMERA_INIT_KEYS if k in data):
+                # Другое устройство -- пересоздаем камеру вместе с детекторами.
+                plan.delete_cameras.append(current[0])
+                current = None
+            if current is None:
+                plan.create_cameras.append(spec)
+                plan.create_detectors.extend((key, spec, d) for d in spec.get('detectors', []))
+                if spec.get('archive') is not None:
+                    plan.bindings.append((key, spec))
+                continue
+
+            camera = current[0]
+            plan.cameras[key] = camera
+            changes = _changes(current[1], data, skip=CAMERA_INIT_KEYS)
+            if changes:
+                plan.update_cameras.append((camera, changes))
+            if self.rebind and spec.get('archive') is not None:
+                plan.bindings.append((key, spec))
+            self._plan_detectors(plan, key, spec, detectors.get(key, {}))
+        if self.prune:
+            plan.delete_cameras.extend(camera for key, (camera, _) in sorted(cameras.items())
+                                       if key not in wanted_cameras)
+        return plan
+
+    def _plan_detectors(self, plan, key, spec, current):
+        wanted = set()
+        for detector_spec in spec.get('detectors', []):
+            name = detector_spec['name']
+            wanted.add(name)
+            settings = dict(detector_spec.get('settings', {}), DisplayName=name)
+            existing = current.get(name)
+            if existing is not None and any(not _same(existing[1].get(k), settings[k])
+                                            for k in DETECTOR_INIT_KEYS if k in settings):
+                plan.delete_detectors.append(existing[0])
+                existing = None
+            if existing is None:
+                plan.create_detectors.append((key, spec, detector_spec))
+                continue
+            changes = _changes(existing[1], settings, skip=DETECTOR_INIT_KEYS)
+            if changes:
+                plan.update_detectors.append((existing[0], changes))
+        if self.prune:
+            plan.delete_detectors.extend(detector for name, (detector, _) in sorted(current.items())
+                                         if name not in wanted)
+
+    def apply(self, plan):
+        """
+        Выполняет план в одном :meth:`RsgHttpApi.batch`. Ошибки отдельных операций не прерывают
+        остальные и собираются в результате.
+
+        :return type: :class:`SyncResult`
+        """
+        result = SyncResult(plan)
+        api = self.api
+        with api.batch():
+            self._create_archives(plan, result)
+            for archive, changes in plan.update_archives:
+                self._call(result, 'update {}'.format(archive), api.update_archive, archive,
+                           changes)
+            for camera in plan.delete_cameras:
+                self._call(result, 'delete {}'.format(camera), api.delete_camera, camera)
+            self._create_cameras(plan, result)
+            for camera, changes in plan.update_cameras:
+                self._call(result, 'update {}'.format(camera), api.update_camera, camera, changes)
+            for detector in plan.delete_detectors:
+                self._call(result, 'delete {}'.format(detector), api.delete_detector, detector)
+            self._create_detectors(plan, result)
+            self._update_detectors(plan, result)
+            for key, spec in plan.bindings:
+                camera = result.cameras.get(key)
+                archive = result.archives.get(spec['archive'])
+                if camera is None or archive is None:
+                    result.fail('bind {!r} to {!r}'.format(key, spec['archive']),
+                                Exception('Camera or archive is missing'))
+                    continue
+                self._call(result, 'bind {} to {}'.format(camera, archive),
+                           api.bind_camera_to_archive, camera, archive,
+                           permanent_write=spec.get('permanent_write', False))
+            for archive in plan.delete_archives:
+                self._call(result, 'delete {}'.format(archive), api.delete_archive, archive)
+        logger.info('Configuration synced: {} ({} errors).'.format(
+            plan.summary(), len(result.errors)))
+        return result
+
+    def sync(self, desired):
+        """
+        :meth:`plan` и :meth:`apply`.
+        """
+        return self.apply(self.plan(desired))
+
+    @staticmethod
+    def _call(result, what, function, *args, **kwargs):
+        """
+        Выполняет операцию, ее ошибка записывается в `result`.
+
+        :param what: Описание операции или, для массовых операций, список описаний объектов:
+                     если не удался весь вызов, ошибка записывается для каждого.
+        :return: Результат `function` или None при ошибке.
+        """
+        whats = what if isinstance(what, list) else [what]
+        try:
+            return function(*args, **kwargs)
+        except (ServerError, requests.exceptions.RequestException) as e:
+            error = e
+        except Exception as e:
+            # Не ошибка сервера, а, скорее, ошибка в описании или в коде: нужен traceback.
+            logger.exception('Unexpected error: {}'.format(', '.join(whats)))
+            error = e
+        for what in whats:
+            result.fail(what, error)
+        return None
+
+    def _update_detectors(self, plan, result):
+        # Детекторы с одинаковыми изменениями обновляются одним вызовом.
+        groups = {}
+        for detector, changes in plan.update_detectors:
+            key = json.dumps(changes, sort_keys=True)
+            groups.setdefault(key, (changes, []))[1].append(detector)
+        for key in sorted(groups):
+            changes, detectors = groups[key]
+            updated = self._call(result, ['update {}'.format(d) for d in detectors],
+                                 self.api.update_detectors, detectors, changes)
+            if updated is not None:
+                for i, error in updated.errors.items():
+                    result.fail('update {}'.format(detectors[i]), error)
+
+    def _create_archives(self, plan, result):
+        if not plan.create_archives:
+            return
+        created = self._call(
+            result, ['create archive {!r}'.format(spec['name']) for spec in plan.create_archives],
+            self.api.create_archives_bulk, [{
+                'archive_file': spec['file'],
+                'name': spec['name'],
+                'size': spec.get('size', 5),
+                'should_format': spec.get('format', True),
+                'color': spec.get('color', 'Red'),
+            } for spec in plan.create_archives])
+        if created is None:
+            return
+        for i, spec in enumerate(plan.create_archives):
+            if created.created[i] is not None:
+                result.archives[spec['name']] = created.created[i]
+            if i in created.errors:
+                result.fail('create archive {!r}'.format(spec['name']), created.errors[i])
+
+    def _create_cameras(self, plan, result):
+        if not plan.create_cameras:
+            return
+        data_list = [dict(VIRTUAL_CAMERA, DisplayName=spec['name'], **spec.get('settings', {}))
+                     for spec in plan.create_cameras]
+        created = self._call(
+            result, ['create camera {!r}'.format(spec['name']) for spec in plan.create_cameras],
+            self.api.create_cameras_bulk, data_list)
+        if created is None:
+            return
+        for i, spec in enumerate(plan.create_cameras):
+            if created.created[i] is not None:
+                result.cameras[spec['name']] = created.created[i]
+            if i in created.errors:
+                result.fail('create camera {!r}'.format(spec['name']), created.errors[i])
+
+    def _create_detectors(self, plan, result):
+        items = []
+        names = []
+        for key, _, detector_spec in plan.create_detectors:
+            camera = result.cameras.get(key)
+            if camera is None:
+                result.fail('create detector {!r} on {!r}'.format(detector_spec['name'], key),
+                            Exception('Camera is missing'))
+                continue
+            items.append((dict(detector_spec.get('settings', {}),
+                               DisplayName=detector_spec['name']), camera))
+            names.append((key, detector_spec['name']))
+        if not items:
+            return
+        created = self._call(
+            result, ['create detector {!r} on {!r}'.format(name, key) for key, name in names],
+            self.api.create_detectors_bulk, items)
+        if created is None:
+            return
+        for i, error in created.errors.items():
+            result.fail('create detector {!r} on {!r}'.format(names[i][1], names[i][0]), error)
@@ -8,10 +8,23 @@ from decimal import Decimal
 import os
 import os.path
 import subprocess
-from collections import OrderedDict
+import threading
+from collections import OrderedDict, namedtuple
 import time
 import arrow
 import inspect
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    from os import scandir
+except ImportError:
+    try:
+        # Python 2: optional scandir backport.
+        from scandir import scandir
+    except ImportError:
+        scandir = None
 
 logger = logging.getLogger(__name__)
 
@@ -38,6 +51,127 @@ DEFAULT_CONFIG = OrderedDict([
     ('LOGS_CLIENT',   os.path.join(LOC_DIR, 'Logs')),
 ])
 
+ScanResult = namedtuple('ScanResult', ['size', 'files', 'matched', 'errors'])
+
+
+def _listdir_entries(path):
+    # Fallback when scandir is not available: (path, name, is directory, is symlink).
+    for name in os.listdir(path):
+        full = os.path.join(path, name)
+        yield full, name, os.path.isdir(full), os.path.islink(full)
+
+
+def _scan_dir(path, suffixes, dirs, totals):
+    """
+    Lists one directory: subdirectories are appended to `dirs`, file sizes, file count and
+    files ending with `suffixes` are accumulated in `totals` ([size, files, matched, errors]).
+    """
+    try:
+        if scandir is None:
+            for full, name, is_dir, is_link in _listdir_entries(path):
+                if is_dir:
+                    # Like os.walk: symlinks to directories are neither followed nor counted.
+                    if not is_link:
+                        dirs.append(full)
+                    continue
+                try:
+                    totals[0] += os.path.getsize(full)
+                except OSError as e:
+                    logger.warning('{}: {}'.format(type(e).__name__, e))
+                    totals[3] += 1
+                    continue
+                totals[1] += 1
+                if suffixes and name.endswith(suffixes):
+                    totals[2].append(full)
+            return
+        it = scandir(path)
+        try:
+            for entry in it:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        dirs.append(entry.path)
+                        continue
+                    if entry.is_symlink() and entry.is_dir():
+                        # Like os.walk: symlinks to directories are neither followed nor counted.
+                        continue
+                    # On Windows the size comes from the directory listing, no extra stat call.
+                    totals[0] += entry.stat().st_size
+                except OSError as e:
+                    # In case, for instance, when a file has already been removed
+                    # since scandir has listed folder contents.
+                    logger.warning('{}: {}'.format(type(e).__name__, e))
+                    totals[3] += 1
+                    continue
+                totals[1] += 1
+                if suffixes and entry.name.endswith(suffixes):
+                    totals[2].append(entry.path)
+        finally:
+            close = getattr(it, 'close', None)
+            if close is not None:
+                close()
+    except OSError as e:
+        # Like os.walk: unreadable directories are skipped.
+        logger.debug('Can\'t list {}: {}'.format(path, e))
+        totals[3] += 1
+
+
+def scan_tree(paths, suffixes=(), max_workers=4):
+    """
+    Total size and file count of the directory trees `paths` plus the files ending with
+    `suffixes`, in a single pass. Subtrees are listed by `max_workers` threads.
+
+    :param paths: Directory or list of directories; missing ones are skipped.
+    :param suffixes: File name suffixes to collect, e.g. `('.dmp',)`.
+    :return type: :class:`ScanResult` (size in bytes)
+    """
+    if not isinstance(paths, (list, tuple)):
+        paths = [paths]
+    suffixes = tuple(suffixes)
+    if max_workers <= 1:
+        dirs = list(paths)
+        totals = [0, 0, [], 0]
+        while dirs:
+            _scan_dir(dirs.pop(), suffixes, dirs, totals)
+        return ScanResult(*totals)
+
+    pending = queue.Queue()
+    for path in paths:
+        pending.put(path)
+    results = []
+
+    def worker():
+        totals = [0, 0, [], 0]
+        found = []
+        while True:
+            path = pending.get()
+            if path is None:
+                pending.task_done()
+                break
+            try:
+                _scan_dir(path, suffixes, found, totals)
+                for subdir in found:
+                    pending.put(subdir)
+            except Exception as e:
+                # A dead worker would leave pending.join() waiting forever.
+                logger.warning('Can\'t scan {}: {}: {}'.format(path, type(e).__name__, e))
+                totals[3] += 1
+            finally:
+                del found[:]
+                pending.task_done()
+        results.append(totals)
+
+    threads = [threading.Thread(target=worker, name='scan_tree') for _ in range(max_workers)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    pending.join()
+    for _ in threads:
+        pending.put(None)
+    for thread in threads:
+        thread.join()
+    return ScanResult(sum(t[0] for t in results), sum(t[1] for t in results),
+                      [path for t in results for path in t[2]], sum(t[3] for t in results))
+
 
 class Manager(object):
     def __init__(self, config=None):
@@ -178,38 +312,26 @@ class Manager(object):
         return ram_usage / B_IN_MB
 
     @staticmethod
-    def calc_folder_size(path):
-        total_size = 0
+    def scan_folder(path, suffixes=(), max_workers=4):
         try:
-            for dirpath, dirnames, filenames in os.walk(path):
-                for f in filenames:
-                    fp = os.path.join(dirpath, f)
-                    try:
-                        total_size += os.path.getsize(fp)
-                    except OSError as e:
-                        # In case, for instance, when
-                        # a file has already been removed since
-                        # os.walk has listed folder contents.
-                        logger.warning('{}: {}'.format(type(e).__name__, e))
+            return scan_tree(path, suffixes=suffixes, max_workers=max_workers)
         except Exception:
-            logger.exception('Could not get folder size.')
-        return float(total_size / B_IN_MB)
+            logger.exception('Could not scan {}.'.format(path))
+            return ScanResult(0, 0, [], 1)
+
+    @classmethod
+    def calc_folder_size(cls, path):
+        return float(cls.scan_folder(path).size) / B_IN_MB
 
     def vmda_size(self):
         return self.calc_folder_size(self.config['VMDA'])
 
+    def scan_logs(self):
+        return self.scan_folder([self.config['LOGS_CLIENT'], self.config['LOGS_SERVER']],
+                                suffixes=('.dmp',))
+
     def get_all_dmp_files(self):
-        fi = []
-        try:
-            for folder in (self.config['LOGS_CLIENT'], self.config['LOGS_SERVER']):
-                for dirpath, dirnames, filenames in os.walk(folder):
-                    for f in filenames:
-                        fp = os.path.join(dirpath, f)
-                        if os.path.basename(fp).endswith('.dmp'):
-                            fi.append(fp)
-        except Exception:
-            logger.exception('Could not list all .dmp files.')
-        return fi
+        return self.scan_logs().matched
 
     def config_size(self, local=True, shared=True):
         assert local or shared
@@ -233,3 +355,54 @@ class Manager(object):
                         shutil.rmtree(path)
                 except Exception:
                     pass
+
+
+if __name__ == '__main__':
+    # Benchmark: python -m <package>.environment_manager --files 1000000
+    # (run from outside the package folder, its calendar.py shadows the standard one).
+    # LOCALAPPDATA, ALLUSERSPROFILE and ProgramFiles must be set for the module to import.
+    import argparse
+    import tempfile
+    import timeit
+
+    parser = argparse.ArgumentParser(description='scan_tree vs os.walk on a synthetic tree.')
+    parser.add_argument('--files', type=int, default=100000)
+    parser.add_argument('--dirs', type=int, default=100)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='scan_tree_bench_')
+    try:
+        per_dir = max(args.files // args.dirs, 1)
+        for d in range(args.dirs):
+            folder = os.path.join(root, 'd{:05d}'.format(d))
+            os.mkdir(folder)
+            for f in range(per_dir):
+                # Sparse files: the size is set without writing data.
+                with open(os.path.join(folder, 'f{:07d}{}'.format(
+                        f, '.dmp' if f % 100 == 0 else '.log')), 'wb') as fd:
+                    fd.truncate(1024)
+
+        def walk():
+            size = 0
+            files = 0
+            for dirpath, _, filenames in os.walk(root):
+                for name in filenames:
+                    size += os.path.getsize(os.path.join(dirpath, name))
+                    files += 1
+            return size, files
+
+        expected = walk()
+        print('{} files in {} directories, best of {}:'.format(expected[1], args.dirs,
+                                                               args.repeat))
+        print('  os.walk + getsize:          {:8.3f} s'.format(
+            min(timeit.repeat(walk, number=1, repeat=args.repeat))))
+        for workers in args.workers:
+            result = scan_tree(root, suffixes=('.dmp',), max_workers=workers)
+            assert (result.size, result.files) == expected
+            print('  scan_tree, max_workers={:<3}  {:8.3f} s'.format(workers, min(timeit.repeat(
+                lambda: scan_tree(root, suffixes=('.dmp',), max_workers=workers),
+                number=1, repeat=args.repeat))))
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,735 @@
+# -*- coding: utf-8 -*-
+"""
+Заглушка сервера AxxonNext для нагрузочных и регрессионных замеров без настоящей ноды.
+
+Поднимается в том же процессе и отвечает на маршруты RSG и Web API, которые используют
+:class:`RsgHttpApi` и :class:`WebHttpApi`: `/rsg/ipint`, `/rsg/archive`, `/rsg/detector`,
+`/rsg/binding`, `/rsg` (flush), `/archive/contents/intervals`, `/export/archive`,
+`/statistics/hardware`, `/hosts`. Конфигурация хранится в памяти, содержимое архивов и файлы
+экспорта генерируются.
+
+    with FakeAxxonServer(cameras=100, latency=0.005) as server:
+        api = RsgHttpApi(server.addr, port=server.port)
+        ...
+
+Бенчмарки: `python -m <пакет>.fake_axxon_server --sizes 10 100 1000 10000`.
+"""
+
+import json
+import logging
+import random
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from bisect import bisect_left, bisect_right
+
+import requests
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, unquote, urlsplit
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib import unquote
+    from urlparse import parse_qs, urlsplit
+
+from .archive_intervals import IntervalSet
+from .http_api import (Camera, ExportJobManager, ExportJobState, RsgHttpApi, WebHttpApi,
+                       ms_to_arrow)
+from .timestamp_codec import MS_IN_SECOND, arrow_to_ms, ms_to_ts, ts_to_ms
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SIZES = (10, 100, 1000, 10000)
+
+
+class _NotFound(Exception):
+    pass
+
+
+class FakeDomain(object):
+    """
+    Конфигурация одной ноды: камеры, архивы, детекторы, привязки, задачи импорта и экспорта.
+    """
+
+    def __init__(self, node, intervals, record_length, record_gap, export_size,
+                 export_duration, cpu_load):
+        self.node = node
+        self.intervals = intervals
+        self.record_length = record_length
+        self.record_gap = record_gap
+        self.export_size = export_size
+        self.export_duration = export_duration
+        self.cpu_load = cpu_load
+        self.lock = threading.Lock()
+        self.cameras = {}
+        self.archives = {}
+        self.detectors = {}
+        self.bindings = []
+        self.replications = {}
+        self.exports = {}
+        self._next_id = {'DeviceIpint': 1, 'MultimediaStorage': 1, 'AVDetector': 1}
+        self._unflushed = False
+        self._archive = None
+        self._archive_end = int(time.time()) * MS_IN_SECOND
+
+    def _new_id(self, kind):
+        n = self._next_id[kind]
+        self._next_id[kind] += 1
+        return n
+
+    def add_camera(self, settings=None):
+        with self.lock:
+            n = self._new_id('DeviceIpint')
+            camera_id = 'hosts/{}/DeviceIpint.{}/SourceEndpoint.video:0:0'.format(self.node, n)
+            data = {'Id': camera_id, 'DisplayId': str(n), 'DisplayName': 'Camera {}'.format(n),
+                    'Vendor': 'AxxonSoft', 'Model': 'Virtual'}
+            data.update(settings or {})
+            self.cameras[camera_id] = data
+            self.detectors[camera_id] = {}
+            self._unflushed = True
+            return camera_id
+
+    def add_archive(self, settings=None):
+        with self.lock:
+            settings = dict(settings or {})
+            # Как и RSG, отдаем в `Name` полный id архива, построенный из заданного имени.
+            name = settings.pop('Name', None) or self._new_id('MultimediaStorage')
+            archive_id = 'hosts/{}/MultimediaStorage.{}'.format(self.node, name)
+            data = {'Name': archive_id, 'Color': 'Red', 'Volumes': ''}
+            data.update(settings)
+            self.archives[archive_id] = data
+            self._unflushed = True
+            return archive_id
+
+    def add_detector(self, camera_id, settings=None):
+        with self.lock:
+            if camera_id not in self.cameras:
+                raise _NotFound(camera_id)
+            n = self._new_id('AVDetector')
+            detector_id = 'hosts/{}/AVDetector.{}/EventSupplier'.format(self.node, n)
+            data = {'DisplayName': 'Detector {}'.format(n), 'DetectorModule': 'SceneDescription',
+                    'DetectorType': 'MotionDetection', 'Enabled': True, 'Period': 1000,
+                    'Sensitivity': 50, 'MinObjectSize': 10, 'MaxObjectSize': 80}
+            data.update(settings or {})
+            self.detectors[camera_id][detector_id] = data
+            self._unflushed = True
+            return detector_id
+
+    def populate(self, cameras=0, archives=0, detectors_per_camera=0):
+        for _ in range(archives):
+            self.add_archive()
+        for _ in range(cameras):
+            camera_id = self.add_camera()
+            for _ in range(detectors_per_camera):
+                self.add_detector(camera_id)
+        self._unflushed = False
+
+    def find_camera(self, id_):
+        """
+        Камера по полному id или по его началу `hosts/NODE/DeviceIpint.N`.
+        """
+        if id_ in self.cameras:
+            return id_
+        camera_id = '/'.join(id_.split('/')[:3]) + '/SourceEndpoint.video:0:0'
+        if camera_id in self.cameras:
+            return camera_id
+        raise _NotFound(id_)
+
+    def archive(self):
+        """
+        Содержимое архива камеры: `intervals` записей по `record_length` мс с разрывами по
+        `record_gap` мс, заканчивающихся в момент запуска сервера.
+        """
+        if self._archive is None:
+            step = self.record_length + self.record_gap
+            begins = [self._archive_end - self.record_length - i * step
+                      for i in range(self.intervals)]
+            self._archive = IntervalSet(begins, [b + self.record_length for b in begins])
+        return self._archive
+
+
+class FakeAxxonServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, addr='127.0.0.1', port=0, node='FAKE-NODE', prefix=None, latency=0.0,
+                 jitter=0.0, cameras=0, archives=0, detectors_per_camera=0, intervals=100,
+                 record_length=10 * 60 * MS_IN_SECOND, record_gap=5 * 60 * MS_IN_SECOND,
+                 export_size=64 * 1024, export_duration=0.0, cpu_load=0.1):
+        """
+        :param int port: 0 -- любой свободный порт (см. атрибут `port`).
+        :param str prefix: Префикс путей Web API, как в :class:`Connection`.
+        :param float latency: Задержка (сек.) перед каждым ответом.
+        :param float jitter: Случайная добавка к задержке (сек.), равномерно из `[0, jitter]`.
+        :param int cameras: Сколько камер (и архивов, и детекторов на камеру) создать заранее.
+        :param int intervals: Число записей в архиве каждой камеры.
+        :param int export_size: Размер файла экспорта (байт).
+        :param float export_duration: Сколько секунд сервер "выполняет" экспорт.
+        :param float cpu_load: Значение для `/statistics/hardware` (0..1).
+        """
+        HTTPServer.__init__(self, (addr, port), _Handler)
+        self.prefix = '/' + prefix.strip('/') if prefix else ''
+        self.latency = latency
+        self.jitter = jitter
+        self.domain = FakeDomain(node, intervals, record_length, record_gap, export_size,
+                                 export_duration, cpu_load)
+        self.domain.populate(cameras, archives, detectors_per_camera)
+        self.requests = 0
+        self._requests_lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def addr(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='FakeAxxonServer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    def rsg_api(self, **kwargs):
+        return RsgHttpApi(self.addr, port=self.port, **kwargs)
+
+    def web_api(self, **kwargs):
+        kwargs.setdefault('prefix', self.prefix.strip('/') or None)
+        return WebHttpApi(self.addr, port=self.port, **kwargs)
+
+    def handle_error(self, request, client_address):
+        # Клиент вправе закрыть соединение, не дочитав ответ (например, потоковый разбор).
+        logger.debug('Error processing request from {}'.format(client_address), exc_info=True)
+
+    def count_request(self):
+        with self._requests_lock:
+            self.requests += 1
+
+
+def _rsg(data=None, result='Success', message=None):
+    j = {'Result': result, 'Data': data if data is not None else []}
+    if message is not None:
+        j['Message'] = message
+    return 200, j
+
+
+def _ts_to_ms(ts):
+    if ts == 'past':
+        return 0
+    if ts == 'future':
+        return 2 ** 53
+    return ts_to_ms(ts)
+
+
+def _param(query, name):
+    """
+    Значение параметра запроса без кавычек (`get_info` передает `id="..."`).
+    """
+    value = query.get(name, [None])[0]
+    if value is not None and len(value) > 1 and value[0] == value[-1] == '"':
+        value = value[1:-1]
+    return value
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Заголовки и тело уходят отдельными send(); с алгоритмом Нейгла и отложенным ACK клиента
+    # каждый ответ keep-alive задерживался бы на ~40 мс.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logger.debug(format, *args)
+
+    def do_GET(self):
+        self._handle('GET')
+
+    def do_POST(self):
+        self._handle('POST')
+
+    def do_PUT(self):
+        self._handle('PUT')
+
+    def do_DELETE(self):
+        self._handle('DELETE')
+
+    def _handle(self, method):
+        server = self.server
+        server.count_request()
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        try:
+            body = json.loads(body.decode('utf-8')) if body else {}
+        except ValueError:
+            body = {}
+        url = urlsplit(self.path)
+        path = unquote(url.path)
+        query = parse_qs(url.query)
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+        try:
+            if path.startswith('/rsg'):
+                status, payload = self._rsg(method, path, query, body)
+            else:
+                if server.prefix and path.startswith(server.prefix + '/'):
+                    path = path[len(server.prefix):]
+                status, payload = self._web(method, path, query, body)
+        except _NotFound as e:
+            status, payload = 404, {'error': 'Not found: {}'.format(e)}
+        except Exception as e:
+            logger.exception('{} {}'.format(method, self.path))
+            status, payload = 500, {'error': str(e)}
+        if isinstance(payload, tuple):
+            self._send(status, *payload)
+        else:
+            self._send(status, json.dumps(payload).encode('utf-8'))
+
+    def _send(self, status, content, headers=None):
+        self.send_response(status)
+        headers = dict(headers or {})
+        headers.setdefault('Content-Type', 'application/json')
+        headers['Content-Length'] = str(len(content))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    #
+    # RSG
+    #
+
+    def _rsg(self, method, path, query, body):
+        domain = self.server.domain
+        id_ = _param(query, 'id')
+        if path == '/rsg' and method == 'POST':
+            if body.get('action') == 'flush':
+                with domain.lock:
+                    unflushed, domain._unflushed = domain._unflushed, False
+                if not unflushed:
+                    return _rsg(result='Error',
+                                message='Nothing to flush, no operations were performed')
+            return _rsg()
+        if path == '/rsg/ipint':
+            return self._rsg_objects(method, id_, body, domain.cameras, domain.add_camera,
+                                     "Can't find objects to delete")
+        if path == '/rsg/archive':
+            return self._rsg_objects(method, id_, body, domain.archives, domain.add_archive,
+                                     "Can't find objects to delete")
+        if path == '/rsg/detector':
+            return self._rsg_detectors(method, query, id_, body)
+        if path == '/rsg/vmda/data' and method == 'DELETE':
+            return _rsg()
+        if path == '/rsg/binding' and method == 'POST':
+            with domain.lock:
+                domain.bindings.append({'id': id_, 'pid': _param(query, 'pid'), 'data': body})
+                domain._unflushed = True
+            return _rsg()
+        if path == '/rsg/binding/replication':
+            if method == 'POST':
+                token = str(uuid.uuid4())
+                with domain.lock:
+                    domain.replications[token] = time.time()
+                return _rsg({'Token': token})
+            started = domain.replications.get(id_)
+            if started is None:
+                raise _NotFound(id_)
+            duration = domain.export_duration
+            progress = 100 if not duration else min(100, int(100 * (time.time() - started) /
+                                                             duration))
+            return _rsg({'Progress': progress})
+        raise _NotFound(path)
+
+    def _rsg_objects(self, method, id_, body, objects, add, not_found_message):
+        domain = self.server.domain
+        if method == 'GET':
+            with domain.lock:
+                if id_ is None:
+                    return _rsg(list(objects.values()))
+                return _rsg([objects[id_]] if id_ in objects else [])
+        if method == 'POST':
+            add(body)
+            return _rsg()
+        if method == 'PUT':
+            with domain.lock:
+                if id_ not in objects:
+                    return _rsg(result='Error', message='Object {} not found'.format(id_))
+                objects[id_].update(body)
+                domain._unflushed = True
+            return _rsg()
+        if method == 'DELETE':
+            with domain.lock:
+                if id_ == '.':
+                    ids = list(objects)
+                else:
+                    ids = [id_] if id_ in objects else []
+                if not ids:
+                    return _rsg(result='Error', message=not_found_message)
+                for i in ids:
+                    del objects[i]
+                    domain.detectors.pop(i, None)
+                domain._unflushed = True
+            return _rsg()
+        raise _NotFound(method)
+
+    def _rsg_detectors(self, method, query, id_, body):
+        domain = self.server.domain
+        camera_id = detector_id = None
+        if id_ not in (None, '.'):
+            camera_id, _, detector_id = id_.partition('|')
+            detector_id = detector_id or None
+        if method == 'GET':
+            data = []
+            with domain.lock:
+                for cam, detectors in domain.detectors.items():
+                    if camera_id is not None and cam != camera_id:
+                        continue
+                    children = [{'Id': det, 'Settings': settings}
+                                for det, settings in detectors.items()
+                                if detector_id is None or det == detector_id]
+                    if children:
+                        data.append({'Id': cam, 'Children': children})
+            return _rsg(data)
+        if method == 'POST':
+            with domain.lock:
+                camera_id = domain.find_camera(_param(query, 'pid'))
+            domain.add_detector(camera_id, body)
+            return _rsg()
+        if method == 'PUT':
+            with domain.lock:
+                detectors = domain.detectors.get(camera_id, {})
+                if detector_id not in detectors:
+                    return _rsg(result='Error', message='Detector {} not found'.format(id_))
+                detectors[detector_id].update(body)
+                domain._unflushed = True
+            return _rsg()
+        if method == 'DELETE':
+            with domain.lock:
+                removed = 0
+                for cam, detectors in domain.detectors.items():
+                    if camera_id is not None and cam != camera_id:
+                        continue
+                    for det in list(detectors):
+                        if detector_id is None or det == detector_id:
+                            del detectors[det]
+                            removed += 1
+                if not removed:
+                    return _rsg(result='Error', message="Can't find detectors to remove")
+                domain._unflushed = True
+            return _rsg()
+        raise _NotFound(method)
+
+    #
+    # Web API
+    #
+
+    def _web(self, method, path, query, body):
+        domain = self.server.domain
+        if path == '/hosts' and method == 'GET':
+            return 200, [domain.node]
+        if path == '/statistics/hardware' and method == 'GET':
+            total = '{:.1f}'.format(domain.cpu_load * 100).replace('.', ',')
+            return 200, [{'name': domain.node, 'totalCPU': total}]
+        if path.startswith('/archive/contents/intervals/') and method == 'GET':
+            return self._intervals(path, query)
+        if path.startswith('/export/archive/') and method == 'POST':
+            return self._start_export(path, body)
+        if path.startswith('/export/'):
+            return self._export_job(method, path, query)
+        raise _NotFound(path)
+
+    def _intervals(self, path, query):
+        """
+        `/archive/contents/intervals/<VIDEOSOURCEID>/<END>/<BEGIN>`: если END позже BEGIN,
+        интервалы идут от новых к старым, иначе -- от старых к новым.
+        """
+        domain = self.server.domain
+        source, first, second = path[len('/archive/contents/intervals/'):].rsplit('/', 2)
+        with domain.lock:
+            domain.find_camera('hosts/' + source)
+
+        first_ms, second_ms = _ts_to_ms(first), _ts_to_ms(second)
+        newer_first = first_ms >= second_ms
+        # Интервалы на краях отрезка отдаются целиком, как это делает сервер.
+        archive = domain.archive()
+        lo = bisect_left(archive.ends, min(first_ms, second_ms))
+        hi = bisect_right(archive.begins, max(first_ms, second_ms))
+        intervals = IntervalSet(archive.begins[lo:hi], archive.ends[lo:hi])
+        scale = query.get('scale')
+        if scale:
+            intervals = intervals.merge_by_scale(int(scale[0]))
+        pairs = list(intervals)
+        if newer_first:
+            pairs.reverse()
+        limit = query.get('limit')
+        more = False
+        if limit and len(pairs) > int(limit[0]):
+            pairs = pairs[:int(limit[0])]
+            more = True
+        return 200, {'intervals': [{'begin': ms_to_ts(b), 'end': ms_to_ts(e)} for b, e in pairs],
+                     'more': more}
+
+    def _start_export(self, path, body):
+        domain = self.server.domain
+        source, begin, end = path[len('/export/archive/'):].rsplit('/', 2)
+        with domain.lock:
+            domain.find_camera('hosts/' + source)
+        format_ = body.get('format', 'mkv')
+        job_uuid = uuid.uuid4()
+        job_id = '/export/{}'.format(job_uuid)
+        with domain.lock:
+            domain.exports[job_id] = {
+                'started': time.time(),
+                'files': ['{}_{}_{}_{}.{}'.format(source.split('/')[1], begin, end,
+                                                  job_uuid.hex[:8], format_)],
+            }
+        return 201, (b'', {'Location': job_id})
+
+    def _export_job(self, method, path, query):
+        domain = self.server.domain
+        parts = path.split('/')
+        job_id, action = '/'.join(parts[:3]), '/'.join(parts[3:])
+        with domain.lock:
+            job = domain.exports.get(job_id)
+        if job is None:
+            raise _NotFound(job_id)
+        if method == 'DELETE' and not action:
+            with domain.lock:
+                domain.exports.pop(job_id, None)
+            return 204, (b'', {})
+        # Прогресс экспорта в Web API -- доля от 0 до 1.
+        duration = domain.export_duration
+        progress = 1.0 if not duration else min(1.0, (time.time() - job['started']) / duration)
+        if action == 'status':
+            status = {'state': (ExportJobState.DONE if progress >= 1.0 else
+                                ExportJobState.IN_PROGRESS).value,
+                      'progress': progress}
+            if progress >= 1.0:
+                status['files'] = job['files']
+            return 200, status
+        if action == 'file':
+            name = _param(query, 'name')
+            if name not in job['files'] or progress < 1.0:
+                raise _NotFound(name)
+            return self._file(domain.export_size)
+        raise _NotFound(path)
+
+    def _file(self, size):
+        offset = 0
+        range_ = self.headers.get('Range')
+        if range_ and range_.startswith('bytes=') and range_.endswith('-'):
+            offset = int(range_[len('bytes='):-1])
+            if offset >= size:
+                return 416, (b'', {'Content-Range': 'bytes */{}'.format(size)})
+        content = (b'\x00\x01\x02\x03' * (size // 4 + 1))[offset:size]
+        headers = {'Content-Type': 'application/octet-stream'}
+        if offset:
+            headers['Content-Range'] = 'bytes {}-{}/{}'.format(offset, size - 1, size)
+            return 206, (content, headers)
+        return 200, (content, headers)
+
+
+#
+# Бенчмарки
+#
+
+def _timed(server, f):
+    requests_before = server.requests
+    start = time.time()
+    result = f()
+    seconds = time.time() - start
+    return result, seconds, server.requests - requests_before
+
+
+def bench_calls(n=2000, latency=0.0):
+    """
+    Накладные расходы клиента: вызовов в секунду для коротких запросов RSG и Web API.
+    """
+    results = []
+    with FakeAxxonServer(cameras=10, latency=latency) as server:
+        rsg = server.rsg_api()
+        web = server.web_api()
+        for name, call in (('rsg get_cameras', rsg.get_cameras),
+                           ('web get_cpu_load', web.get_cpu_load)):
+            _, seconds, requests_ = _timed(server, lambda: [call() for _ in range(n)])
+            results.append({'benchmark': name, 'size': n, 'seconds': seconds,
+                            'requests': requests_, 'per_second': n / seconds})
+        rsg.close()
+        web.close()
+    return results
+
+
+def bench_overhead(n=2000, latency=0.0):
+    """
+    Накладные расходы одного запроса до и после кэширования настроек в `Connection`:
+    `requests.Session.request` с проверкой ответа (как делал прежний `Connection.prepare`)
+    против :meth:`Connection.get`.
+    """
+    results = []
+    with FakeAxxonServer(cameras=10, latency=latency) as server:
+        for api, path in ((server.rsg_api(), '/rsg/ipint'),
+                          (server.web_api(), '/statistics/hardware')):
+            url = api.base_url + path
+
+            def session_request():
+                r = requests.Session.request(api, 'GET', url)
+                api.check_for_error(r)
+                return r
+
+            for name, call in (('session', session_request),
+                               ('connection', lambda: api.get(path))):
+                _, seconds, requests_ = _timed(server, lambda: [call() for _ in range(n)])
+                results.append({'benchmark': '{} {}'.format(type(api).__name__[:3].lower(), name),
+                                'size': n, 'seconds': seconds, 'requests': requests_,
+                                'per_second': n / seconds})
+            api.close()
+    return results
+
+
+def bench_provisioning(size, latency=0.0):
+    """
+    Создание `size` камер с одним детектором на каждой через bulk-методы в одном `batch()`.
+    """
+    with FakeAxxonServer(latency=latency) as server:
+        api = server.rsg_api()
+
+        def provision():
+            with api.batch():
+                cameras = api.create_cameras_bulk(
+                    [{'Vendor': 'AxxonSoft', 'Model': 'Virtual'}] * size)
+                api.create_detectors_bulk(
+                    [({'DetectorModule': 'SceneDescription', 'DetectorType': 'MotionDetection'},
+                      camera) for _, camera in cameras.iter_created()])
+            return cameras
+
+        cameras, seconds, requests_ = _timed(server, provision)
+        assert cameras.ok and len(server.domain.cameras) == size
+        listing, list_seconds, _ = _timed(server, api.get_detectors)
+        assert len(listing) == size
+        api.close()
+    return [{'benchmark': 'provisioning', 'size': size, 'seconds': seconds,
+             'requests': requests_, 'per_second': size / seconds},
+            {'benchmark': 'list detectors', 'size': size, 'seconds': list_seconds,
+             'requests': 1, 'per_second': size / list_seconds}]
+
+
+def bench_interval_scan(size, latency=0.0, max_workers=8):
+    """
+    `scan_arch_intervals` по `size` камерам (по 100 записей в архиве, страницы по 50).
+    """
+    with FakeAxxonServer(cameras=size, latency=latency) as server:
+        api = server.web_api()
+        cameras = [Camera(id_) for id_ in server.domain.cameras]
+
+        def scan():
+            return [r for r in api.scan_arch_intervals(cameras, limit=50, max_workers=max_workers,
+                                                       as_interval_set=True)]
+
+        results, seconds, requests_ = _timed(server, scan)
+        assert all(r.error is None and len(r.intervals) == server.domain.intervals
+                   for r in results)
+        api.close()
+    return [{'benchmark': 'interval scan', 'size': size, 'seconds': seconds,
+             'requests': requests_, 'per_second': size / seconds}]
+
+
+def bench_exports(size, latency=0.0, max_downloads=4, export_duration=0.0):
+    """
+    `size` экспортов через :class:`ExportJobManager` с опросом статуса и скачиванием файлов.
+
+    :param float export_duration: Сколько секунд сервер готовит каждый экспорт; с ненулевым
+                                  значением замеряется и адаптивный опрос статуса.
+    """
+    save_dir = tempfile.mkdtemp()
+    try:
+        with FakeAxxonServer(cameras=1, latency=latency,
+                             export_duration=export_duration) as server:
+            api = server.web_api()
+            end = ms_to_arrow(server.domain.archive().end)
+            begin = ms_to_arrow(arrow_to_ms(end) - 60 * MS_IN_SECOND)
+
+            def export():
+                manager = ExportJobManager(api, min_interval=0.01, max_downloads=max_downloads)
+                try:
+                    jobs = [manager.submit(1, begin, end, 'mkv', save_dir=save_dir)
+                            for _ in range(size)]
+                    return [job.result() for job in jobs]
+                finally:
+                    manager.close()
+
+            _, seconds, requests_ = _timed(server, export)
+            api.close()
+    finally:
+        shutil.rmtree(save_dir, ignore_errors=True)
+    name = 'exports' if not export_duration else 'exports {:g}s'.format(export_duration)
+    return [{'benchmark': name, 'size': size, 'seconds': seconds,
+             'requests': requests_, 'per_second': size / seconds}]
+
+
+def bench_slow_exports(size, latency=0.0):
+    """
+    :func:`bench_exports` с экспортом, который сервер готовит 2 секунды.
+    """
+    return bench_exports(size, latency=latency, export_duration=2.0)
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, latency=0.0, benchmarks=None):
+    """
+    Прогоняет бенчмарки для каждого размера из `sizes` и выводит таблицу.
+
+    :param benchmarks: Имена из `provisioning`, `scan`, `exports`, `slow-exports`, `calls`,
+                       `overhead`; по умолчанию -- все.
+    :return: Список словарей с результатами.
+    """
+    benchmarks = benchmarks or ('calls', 'overhead', 'provisioning', 'scan', 'exports',
+                                'slow-exports')
+    scaling = [('provisioning', bench_provisioning), ('scan', bench_interval_scan),
+               ('exports', bench_exports), ('slow-exports', bench_slow_exports)]
+    results = []
+    if 'calls' in benchmarks:
+        results.extend(bench_calls(latency=latency))
+    if 'overhead' in benchmarks:
+        results.extend(bench_overhead(latency=latency))
+    for name, bench in scaling:
+        if name in benchmarks:
+            for size in sizes:
+                results.extend(bench(size, latency=latency))
+    print('{:<18} {:>7} {:>10} {:>9} {:>12} {:>10}'.format(
+        'benchmark', 'size', 'seconds', 'requests', 'objects/s', 'calls/s'))
+    for r in results:
+        print('{:<18} {:>7} {:>10.3f} {:>9} {:>12.1f} {:>10.1f}'.format(
+            r['benchmark'], r['size'], r['seconds'], r['requests'], r['per_second'],
+            r['requests'] / r['seconds']))
+    return results
+
+
+if __name__ == '__main__':
+    # Запуск: python -m <пакет>.fake_axxon_server (из каталога пакета здешний calendar.py
+    # подменит стандартный).
+    import argparse
+
+    parser = argparse.ArgumentParser(description='AxxonNext client benchmarks on a fake server.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    parser.add_argument('--latency', type=float, default=0.0, help='Server latency, seconds.')
+    parser.add_argument('--only', nargs='+', choices=['calls', 'overhead', 'provisioning', 'scan',
+                                                    'exports', 'slow-exports'])
+    args = parser.parse_args()
+    run_benchmarks(args.sizes, latency=args.latency, benchmarks=args.only)
@@ -1,26 +1,46 @@
 # -*- coding: utf-8 -*-
 
+import atexit
+import hashlib
 import json
 import logging
 import os.path
 import platform
 import time
+import warnings
+import weakref
 from datetime import datetime
 from decimal import Decimal
 import threading
-from functools import wraps
+from collections import namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
 from contextlib import contextmanager
 from enum import Enum
+from functools import partial, wraps
 from operator import itemgetter
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 import arrow
 import requests
-from sqlalchemy import (create_engine, Column, Integer,
+try:
+    # Необязательная зависимость (ijson >= 3.1): потоковый разбор больших ответов RSG.
+    import ijson
+except ImportError:
+    ijson = None
+from sqlalchemy import (create_engine, event, inspect, text, Column, Integer,
                         String, DateTime, Float)
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy.orm import scoped_session, sessionmaker
+
+from .archive_intervals import IntervalSet
+from .http_metrics import route_template
+from .timestamp_codec import arrow_to_ms, ms_to_arrow, ms_to_ts, ts_to_ms, ts_to_ms_bulk
 
 ARCHIVE_EXTENSION = '.afs'
+B_IN_MB = 1024 * 1024
 
 logger = logging.getLogger(__name__)
 Base = declarative_base()
@@ -55,6 +75,9 @@ class ExportJobState(Enum):
 
 TIMESTAMP_TOKEN = 'YYYYMMDDTHHmmss.SSS'
 
+ExportDownload = namedtuple('ExportDownload', ['path', 'size', 'seconds', 'mb_per_s'])
+ArchIntervalsScanResult = namedtuple('ArchIntervalsScanResult', ['camera', 'intervals', 'error'])
+
 
 #
 # Helpers:
@@ -74,16 +97,57 @@ def check_timestamp(time_stamp):
 
 def arrow_to_ts(arrow_):
     """ timestamp будет получен для UTC """
-    return arrow_.to('utc').format('YYYYMMDDTHHmmss.SSS')
+    return ms_to_ts(arrow_to_ms(arrow_))
 
 def ts_to_arrow(time_stamp):
     """ timestamp трактуется как время по UTC """
-    return arrow.get(time_stamp, ['YYYYMMDDTHHmmss.SSS', 'YYYYMMDDTHHmmss'], tzinfo='utc')
+    return ms_to_arrow(ts_to_ms(time_stamp))
+
+def intervals_to_arrow(intervals):
+    """
+    Интервалы Web API (словари со строками `begin`/`end`) -> словари с :class:`Arrow`.
+    """
+    begins = ts_to_ms_bulk([i['begin'] for i in intervals])
+    ends = ts_to_ms_bulk([i['end'] for i in intervals])
+    return [{'begin': ms_to_arrow(b), 'end': ms_to_arrow(e)} for b, e in zip(begins, ends)]
+
+def older_page_end(page, fresh, end_ts):
+    """
+    Конец отрезка для следующей страницы интервалов (страницы идут от новых к старым) или None,
+    если продвинуться дальше нельзя.
+
+    Интервал, пересекающий границу отрезка, сервер отдает и на следующей странице. Если на
+    странице нет ничего нового (например, при `limit=1`), граница сдвигается на 1 мс раньше
+    начала самого раннего интервала страницы.
+
+    :param page: Интервалы страницы (словари со строками Web API).
+    :param fresh: Интервалы страницы, которых не было на предыдущей.
+    :param str end_ts: Текущий конец отрезка ('future' или отметка Web API).
+    """
+    # Отметки формата TIMESTAMP_TOKEN сравниваются как строки.
+    oldest = min(i['begin'] for i in page)
+    if not fresh:
+        oldest = ms_to_ts(ts_to_ms(oldest) - 1)
+    if end_ts != 'future' and oldest >= end_ts:
+        return None
+    return oldest
+
+def replace_file(src, dst):
+    """
+    Атомарно переименовывает `src` в `dst`, заменяя существующий `dst`.
+    """
+    try:
+        os.replace(src, dst)
+    except AttributeError:
+        # Python 2: на Windows os.rename не перезаписывает существующий файл.
+        if platform.system() == 'Windows' and os.path.exists(dst):
+            os.remove(dst)
+        os.rename(src, dst)
 
 def add_int_to_dict(dict_, key, val):
     if val is not None:
         try:
-            dict_['key'] = int(val)
+            dict_[key] = int(val)
         except ValueError:
             raise Exception('Wrong value of {} = {}'.format(key, val))
 
@@ -98,10 +162,226 @@ class RSGRequestRecord(Base):
     id = Column(Integer, primary_key=True)
     method = Column(String, nullable=False)
     url = Column(String, nullable=False)
+    # Шаблон маршрута (см. :func:`route_template`); в журналах старых версий -- NULL.
+    route = Column(String, index=True)
     body = Column(String, nullable=False, default='')
-    utc_start = Column(DateTime, nullable=False)
+    utc_start = Column(DateTime, nullable=False, index=True)
     delta = Column(Float, nullable=False)
-    status_code = Column(Integer, nullable=False)
+    status_code = Column(Integer, nullable=False, index=True)
+
+
+# Слабые ссылки на незакрытые писатели журнала: при выходе из процесса они закрываются.
+_log_writer_refs = set()
+
+
+def _stop_log_writer(queue_, ref):
+    """
+    Останавливает поток писателя, на который больше никто не ссылается.
+    """
+    _log_writer_refs.discard(ref)
+    queue_.put(RSGRequestLogWriter._STOP)
+
+
+@atexit.register
+def _close_log_writers():
+    for ref in list(_log_writer_refs):
+        writer = ref()
+        if writer is not None:
+            writer.close()
+
+
+class RSGRequestLogWriter(object):
+    """
+    Фоновая запись журнала RSG-запросов (:class:`RSGRequestRecord`) в SQLite.
+
+    Записи складываются в очередь и пишутся отдельным потоком пачками: одна транзакция на
+    `batch_size` записей или на `flush_interval` секунд, смотря что наступит раньше. Так время
+    HTTP-запроса не зависит от fsync базы. При :meth:`close` очередь гарантированно дописывается.
+    Поток не ссылается на писателя: если писатель не закрыт явно, поток дописывает очередь и
+    завершается, когда писатель удаляется сборщиком мусора, или при выходе из процесса.
+    """
+
+    _STOP = object()
+
+    def __init__(self, log_db, flush_interval=1.0, batch_size=500):
+        """
+        :param str log_db: Путь к файлу SQLite-базы.
+        :param float flush_interval: Максимальное время (сек.) жизни записи в очереди до записи в базу.
+        :param int batch_size: Максимальное число записей в одной транзакции.
+        """
+        full_path = os.path.abspath(os.path.normpath(log_db))
+        self.engine = create_engine('sqlite:///{}'.format(full_path))
+        event.listen(self.engine, 'connect', self._set_sqlite_pragmas)
+        Base.metadata.create_all(bind=self.engine)
+        self.migrate(self.engine)
+
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = queue.Queue()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='RSGRequestLogWriter',
+                                        args=(self.engine, self._queue, flush_interval, batch_size))
+        self._thread.daemon = True
+        self._thread.start()
+        self._ref = weakref.ref(self, partial(_stop_log_writer, self._queue))
+        _log_writer_refs.add(self._ref)
+
+    @staticmethod
+    def migrate(engine):
+        """
+        Доводит схему журнала, созданного старой версией, до текущей: добавляет столбец `route`
+        и индексы (`create_all` не меняет существующие таблицы).
+        """
+        table = RSGRequestRecord.__table__
+        columns = set(c['name'] for c in inspect(engine).get_columns(table.name))
+        if 'route' not in columns:
+            with engine.begin() as conn:
+                conn.execute(text('ALTER TABLE {} ADD COLUMN route VARCHAR'.format(table.name)))
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+    @staticmethod
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+        cursor.close()
+
+    def write(self, data):
+        """
+        :param dict data: Значения полей :class:`RSGRequestRecord`.
+        """
+        if self._closed:
+            logger.error('RSG request log writer is closed, record dropped: {}'.format(data))
+            return
+        self._queue.put(data)
+
+    def close(self, timeout=None):
+        """
+        Дописывает в базу все накопленные записи и останавливает поток.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        _log_writer_refs.discard(self._ref)
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    @classmethod
+    def _run(cls, engine, queue_, flush_interval, batch_size):
+        stop = False
+        while not stop:
+            batch = []
+            try:
+                item = queue_.get(timeout=flush_interval)
+            except queue.Empty:
+                continue
+            deadline = time.time() + flush_interval
+            while True:
+                if item is cls._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    break
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = queue_.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if stop:
+                # Дописываем все, что успели положить в очередь до вызова close().
+                while True:
+                    try:
+                        item = queue_.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not cls._STOP:
+                        batch.append(item)
+            cls._write_batch(engine, batch)
+
+    @staticmethod
+    def _write_batch(engine, batch):
+        if not batch:
+            return
+        try:
+            with engine.begin() as conn:
+                conn.execute(RSGRequestRecord.__table__.insert(), batch)
+        except Exception as e:
+            logger.error('Error working with DB: {}'.format(e))
+
+
+def _attach(frame, value):
+    container, key = frame
+    if isinstance(container, list):
+        container.append(value)
+    else:
+        container[key] = value
+
+
+def iter_json_items(events, prefix, paths=None, header=None):
+    """
+    Элементы массива `prefix` JSON-документа, собранные по событиям `ijson.parse`, по одному
+    по мере разбора.
+
+    :param str prefix: Путь к массиву в формате ijson, например `Data`.
+    :param paths: Какие ключи оставить в элементах: пути через точку относительно элемента,
+                  элементы вложенных массивов обозначаются `item` (`Children.item.Id`). None --
+                  элементы целиком.
+    :param dict header: Словарь, в который записываются скалярные значения верхнего уровня с
+                        ключами, уже присутствующими в нем (например, `Result`).
+    """
+    wanted = None
+    if paths is not None:
+        wanted = set()
+        for path in paths:
+            parts = path.split('.')
+            wanted.update('.'.join(parts[:i]) for i in range(1, len(parts) + 1))
+    item_prefix = prefix + '.item'
+    cut = len(item_prefix) + 1
+    stack = []
+    for p, event, value in events:
+        if p == item_prefix:
+            rel = ''
+        elif p.startswith(item_prefix) and p[cut - 1:cut] == '.':
+            rel = p[cut:]
+            if wanted is not None and rel not in wanted:
+                continue
+        else:
+            if header is not None and p in header and event not in ('map_key', 'start_map',
+                                                                    'start_array'):
+                header[p] = value
+            continue
+
+        if event == 'map_key':
+            stack[-1][1] = value
+        elif event in ('start_map', 'start_array'):
+            container = {} if event == 'start_map' else []
+            if stack:
+                _attach(stack[-1], container)
+            stack.append([container, None])
+        elif event in ('end_map', 'end_array'):
+            container = stack.pop()[0]
+            if not stack:
+                yield container
+        elif stack:
+            _attach(stack[-1], value)
+        else:
+            yield value
+
+
+def adaptive_poll_interval(progress, elapsed, min_interval, max_interval):
+    """
+    Интервал до следующего опроса долгой серверной задачи -- половина оценки оставшегося
+    времени по прогрессу (0..1) и прошедшему времени, в пределах `[min_interval, max_interval]`.
+    """
+    if progress > 0:
+        interval = (1.0 - progress) / progress * elapsed / 2.0
+    else:
+        interval = min_interval
+    return min(max(interval, min_interval), max_interval)
 
 
 def pretty_dict(d):
@@ -110,22 +390,58 @@ def pretty_dict(d):
 
 class ServerError(RuntimeError):
     def __init__(self, *args, **kwargs):
+        """
+        :param json_response: Разобранный JSON ответа сервера.
+        :param response: Ответ сервера (`requests.Response`).
+        :param render: Функция без аргументов, возвращающая текст ошибки. Вызывается только при
+                       первом обращении к тексту, если `args` не переданы.
+        """
         self.json_response = kwargs.pop('json_response', None)
+        self.response = kwargs.pop('response', None)
+        self._render = kwargs.pop('render', None)
         super(ServerError, self).__init__(*args, **kwargs)
 
+    def _render_message(self):
+        if self._render is not None:
+            render, self._render = self._render, None
+            if not self.args:
+                self.args = (render(),)
+
+    def __str__(self):
+        self._render_message()
+        return super(ServerError, self).__str__()
+
+    def __repr__(self):
+        self._render_message()
+        return super(ServerError, self).__repr__()
+
+    @property
+    def status_code(self):
+        return None if self.response is None else self.response.status_code
+
 
 class RSGServerError(ServerError):
     pass
 
 
+# Имена нод, общие для всех объектов (см. AxxonObject.node).
+_node_names = {}
+
+
 class AxxonObject(object):
     """
     :propery id: Это полное URI объекта, которое выводится в RSG как `id`. К примеру:
                  `"Id": "hosts/AXXON-NODE-NAME/DeviceIpint.3/SourceEndpoint.video:0:0"`.
+
+    id разбирается на составляющие один раз, при первом обращении к ним, поэтому менять id после
+    создания объекта нельзя. Хэш объекта -- хэш id (строки кэшируют свой хэш).
     """
 
+    __slots__ = ('id', '_parsed')
+
     def __init__(self, id):
         self.id = id
+        self._parsed = None
 
     def __str__(self):
         return '<{} {}>'.format(type(self).__name__, self.label)
@@ -134,13 +450,27 @@ class AxxonObject(object):
         return '{}({!r})'.format(type(self).__name__, self.id)
 
     def __hash__(self):
-        return hash('{}{!r}'.format(type(self).__name__, self.id))
+        return hash(self.id)
 
     def __eq__(self, other):
-        return hash(self) == hash(other)
+        if not isinstance(other, AxxonObject):
+            return NotImplemented
+        return self.id == other.id and type(self).__name__ == type(other).__name__
 
     def __ne__(self, other):
-        return not self.__eq__(other)
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def _parse(self):
+        """
+        :return: Имя ноды и номер объекта (`3` для `DeviceIpint.3`).
+        """
+        if self._parsed is None:
+            parts = self.id.split('/', 3)
+            node = _node_names.setdefault(parts[1], parts[1]) if len(parts) > 1 else None
+            number = parts[2].split('.')[1] if len(parts) > 2 and '.' in parts[2] else None
+            self._parsed = (node, number)
+        return self._parsed
 
     @property
     def label(self):
@@ -148,10 +478,14 @@ class AxxonObject(object):
 
     @property
     def node(self):
-        return self.id.split('/')[1]
+        """
+        Имя ноды. У всех объектов одной ноды это один и тот же объект строки.
+        """
+        return self._parse()[0]
 
 
 class Camera(AxxonObject):
+    __slots__ = ('_video_source_id',)
 
     @classmethod
     def from_display_id(cls, node, display_id, channel=0, stream=0):
@@ -174,15 +508,19 @@ class Camera(AxxonObject):
         Возвращает только VideoSourceID. К примеру: `AXXON-NODE-NAME/DeviceIpint.3/SourceEndpoint.video:0:0`.
         :return type: str
         """
-        return '/'.join(self.id.split('/')[1:])
+        try:
+            return self._video_source_id
+        except AttributeError:
+            self._video_source_id = self.id.partition('/')[2]
+            return self._video_source_id
 
     @property
     def label(self):
-        return self.id.split('/')[2].split('.')[1]
+        return self._parse()[1]
 
     @property
     def display_id(self):
-        return int(self.id.split('/')[2].split('.')[1])
+        return int(self._parse()[1])
 
     @property
     def source_endpoint_id(self):
@@ -194,13 +532,34 @@ class Camera(AxxonObject):
 
 
 class Archive(AxxonObject):
+    __slots__ = ()
+
     @property
     def label(self):
-        return self.id.split('/')[2].split('.')[1]
+        return self._parse()[1]
+
+    @property
+    def name(self):
+        """
+        Имя архива (`Name` при создании): часть id после `MultimediaStorage.`, может содержать точки.
+        """
+        return self.id.split('/')[2].partition('.')[2]
 
 
 class Detector(AxxonObject):
-    def __init__(self, id, camera, name=None):
+    """
+    :ivar str module: `DetectorModule` (например, `LprDetector`), если известен.
+    :ivar str detector_type: `DetectorType`, если известен.
+    """
+
+    __slots__ = ('endpoint', 'camera', 'name', 'module', 'detector_type')
+
+    # Ключи элемента `Children` ответа RSG, нужные для создания объекта (см. from_rsg).
+    RSG_KEYS = ('Id', 'Settings.DisplayName', 'Settings.DetectorModule', 'Settings.DetectorType')
+
+    def __init__(self, id, camera, name=None, module=None, detector_type=None):
+        self.module = module
+        self.detector_type = detector_type
         self.endpoint = None
         if id.endswith('EventSupplier'):
             pass
@@ -213,10 +572,19 @@ class Detector(AxxonObject):
         self.camera = camera
         self.name = name
 
+    @classmethod
+    def from_rsg(cls, data, camera):
+        """
+        :param dict data: Элемент `Children` ответа RSG на `/rsg/detector`.
+        """
+        settings = data['Settings']
+        return cls(data['Id'], camera, name=settings['DisplayName'],
+                   module=settings.get('DetectorModule'),
+                   detector_type=settings.get('DetectorType'))
+
     @property
     def label(self):
-        n = self.id.split('/')[2].split('.')[1]
-        return '{} "{}" for Camera {}'.format(n, self.name, self.camera.label)
+        return '{} "{}" for Camera {}'.format(self._parse()[1], self.name, self.camera.label)
 
     def get_id_for_search(self, vmda=False):
         parts = self.id.split('/')
@@ -227,11 +595,159 @@ class Detector(AxxonObject):
         return '/'.join(cut)
 
 
+class BulkCreateError(RuntimeError):
+    pass
+
+
+class BulkCreateResult(object):
+    """
+    Результат массового создания объектов (см. `RsgHttpApi.create_*_bulk`).
+
+    :ivar list created: Созданные объекты в порядке подачи описаний. На месте несозданных -- None.
+    :ivar dict errors: Номер описания -> исключение. Если объект создан, но не донастроен, он
+                       остается в `created` и одновременно попадает в `errors`.
+    """
+
+    def __init__(self, size):
+        self.created = [None] * size
+        self.errors = {}
+
+    def __len__(self):
+        return len(self.created)
+
+    def __iter__(self):
+        return iter(self.created)
+
+    @property
+    def ok(self):
+        return not self.errors
+
+    def iter_created(self):
+        for i, obj in enumerate(self.created):
+            if obj is not None:
+                yield i, obj
+
+    def fail(self, index, error):
+        self.errors[index] = error
+
+
+class ObjectInventory(object):
+    """
+    Клиентский кэш списков объектов RSG (камер, архивов, детекторов) с индексами по id,
+    display_id и ноде. Для детекторов display_id -- это номер их камеры; кроме того, детекторы
+    индексируются по id камеры (`camera`), модулю (`module`), типу (`type`) и имени (`name`).
+
+    Запись устаревает через `ttl` секунд после загрузки или сбрасывается явно через
+    :meth:`invalidate` (это делают изменяющие методы :class:`RsgHttpApi`).
+    """
+
+    INDICES = ('id', 'display_id', 'node', 'camera', 'module', 'type', 'name')
+
+    def __init__(self, ttl=60.0):
+        """
+        :param float ttl: Время жизни закэшированного списка (сек.). None -- без ограничения.
+        """
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = {}
+        # Счетчик сбросов: список, загруженный до сброса, в кэш не попадает.
+        self._generation = 0
+
+    @staticmethod
+    def _index_keys(obj):
+        keys = {'id': obj.id, 'node': obj.node}
+        if isinstance(obj, Camera):
+            keys['display_id'] = obj.display_id
+        elif isinstance(obj, Detector):
+            keys.update({'display_id': obj.camera.display_id, 'camera': obj.camera.id,
+                         'module': obj.module, 'type': obj.detector_type, 'name': obj.name})
+        return keys
+
+    def _build_entry(self, objects):
+        indices = {name: {} for name in self.INDICES}
+        for obj in objects:
+            for name, key in self._index_keys(obj).items():
+                if key is not None:
+                    indices[name].setdefault(key, []).append(obj)
+        return time.time(), objects, indices
+
+    def _entry(self, name, fetch):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and (self.ttl is None or time.time() - entry[0] < self.ttl):
+                self.hits += 1
+                return entry
+            self.misses += 1
+            generation = self._generation
+        entry = self._build_entry(fetch())
+        with self._lock:
+            if self._generation == generation:
+                self._entries[name] = entry
+        return entry
+
+    def objects(self, name, fetch):
+        """
+        :param str name: Имя класса объектов: 'Camera', 'Archive' или 'Detector'.
+        :param fetch: Функция, запрашивающая список объектов с сервера (при промахе кэша).
+        """
+        return list(self._entry(name, fetch)[1])
+
+    def lookup(self, name, fetch, index, key):
+        """
+        :param str index: Один из :attr:`INDICES`.
+        :return: Список объектов класса `name`, у которых значение `index` равно `key`.
+        """
+        return list(self._entry(name, fetch)[2][index].get(key, []))
+
+    def find(self, name, fetch, criteria):
+        """
+        Пересечение :meth:`lookup` по нескольким индексам: `find('Detector', fetch,
+        {'module': 'LprDetector', 'camera': camera.id})`. Критерии со значением None не
+        учитываются. Перебирается только самый короткий из подходящих списков индекса.
+        """
+        criteria = {index: key for index, key in criteria.items() if key is not None}
+        _, objects, indices = self._entry(name, fetch)
+        if not criteria:
+            return list(objects)
+        smallest = min(criteria, key=lambda index: len(indices[index].get(criteria[index], ())))
+        result = []
+        for obj in indices[smallest].get(criteria[smallest], ()):
+            keys = self._index_keys(obj)
+            if all(keys.get(index) == key for index, key in criteria.items()):
+                result.append(obj)
+        return result
+
+    def invalidate(self, *names):
+        """
+        Сбрасывает кэш для перечисленных классов объектов (для всех, если не указаны).
+        """
+        with self._lock:
+            self._generation += 1
+            if names:
+                for name in names:
+                    self._entries.pop(name, None)
+            else:
+                self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'cached': sorted(self._entries)}
+
+
 class Connection(requests.Session):
-    def __init__(self, addr='localhost', port=None, auth=('root', 'root'), prefix=None):
+    def __init__(self, addr='localhost', port=None, auth=('root', 'root'), prefix=None,
+                 instrumentation=None, resilience=None, capture=None):
         """
         :param str prefix: Префик путей к Web-ресурсам: http://<addr>[:port][/prefix]/... Если None
                            или пустая строка, то считается, что префикса нет.
+        :param instrumentation: Сборщик статистики запросов, например :class:`RequestMetrics`.
+        :param resilience: Таймауты, повторы и предохранитель, например :class:`ResiliencePolicy`.
+                           По умолчанию запросы выполняются один раз и без таймаута.
+        :param capture: Запись запросов и ответов для воспроизведения, например
+                        :class:`RequestRecorder`.
         """
         super(Connection, self).__init__()
         assert port is not None
@@ -239,52 +755,192 @@ class Connection(requests.Session):
         self.addr = addr
         self.port = port
         self.prefix = prefix
+        self.instrumentation = instrumentation
+        self.resilience = resilience
+        # Настройки пула соединений установленного адаптера (см. _ensure_pool_size).
+        self.pool_connections = requests.adapters.DEFAULT_POOLSIZE
+        self.pool_maxsize = requests.adapters.DEFAULT_POOLSIZE
+        self.pool_block = requests.adapters.DEFAULT_POOLBLOCK
+        if resilience is not None:
+            resilience.mount(self)
+            self.pool_connections = resilience.pool_connections
+            self.pool_maxsize = resilience.pool_maxsize
+            self.pool_block = resilience.pool_block
+        self.capture = capture
+        self._pipeline_key = None
+        self._pipeline_cache = None
 
     @staticmethod
     def check_for_error(r):
         raise Exception('Mehtod Connection.check_for_error(...) must be overridden')
 
     def prepare(self, f):
+        """
+        Устаревший способ сделать запрос: `self.prepare(requests.Session.get)(self, path)`.
+        Оставлен для совместимости, запрос выполняется так же, как :meth:`get` и т.п.
+        """
+        warnings.warn('Connection.prepare() is deprecated, use get/post/put/delete instead',
+                      DeprecationWarning, stacklevel=2)
+        method = f.__name__.upper()
+
         @wraps(f)
         def tmp(self, path, **kwargs):
-            assert path.startswith('/')
-            r = f(self, self.base_url + path, **kwargs)
-            self.check_for_error(r)
-            return r
+            return self._request(method, path, kwargs)
         return tmp
 
+    # Аргументы requests.Session.request, которые идут в requests.Request и в Session.send.
+    _REQUEST_ARGS = ('params', 'data', 'headers', 'cookies', 'files', 'auth', 'hooks', 'json')
+    _SEND_ARGS = ('proxies', 'stream', 'verify', 'cert')
+
+    def _pipeline(self):
+        """
+        Базовый URL и настройки отправки (прокси, verify и т.п.) из окружения. Они вычисляются
+        один раз на адрес сервера: `requests.Session.request` перечитывает переменные окружения
+        на каждый запрос, и это основная часть его накладных расходов.
+        """
+        key = (self.addr, self.port, self.prefix)
+        if self._pipeline_key != key:
+            base_url = 'http://{}:{}'.format(self.addr, self.port)
+            if self.prefix:
+                base_url += '/{}'.format(self.prefix)
+            settings = self.merge_environment_settings(base_url, {}, None, None, None)
+            self._pipeline_cache = base_url, settings
+            self._pipeline_key = key
+        return self._pipeline_cache
+
+    def reset_pipeline(self):
+        """
+        Заставляет заново вычислить настройки из :meth:`_pipeline` (например, после изменения
+        `proxies`, `verify` или переменных окружения).
+        """
+        self._pipeline_key = None
+
+    def _request(self, method, path, kwargs):
+        if self.resilience is not None:
+            return self.resilience.call(self, method, path, kwargs)
+        return self._send(method, path, kwargs)
+
+    def check_stream_for_error(self, r):
+        """
+        Проверка ответа на запрос с `stream=True`, тело которого еще не прочитано.
+        """
+        self.check_for_error(r)
+
+    def _send(self, method, path, kwargs):
+        """
+        Одна попытка запроса: хуки, отправка, проверка ответа и статистика.
+        """
+        assert path.startswith('/')
+        self.before_request(method, path, kwargs)
+        start = time.time()
+        r = None
+        try:
+            r = self._dispatch(method, path, kwargs)
+            self.after_request(r, start)
+            if kwargs.get('stream'):
+                self.check_stream_for_error(r)
+            else:
+                self.check_for_error(r)
+        except Exception as e:
+            self._instrument(method, path, kwargs, r, start, error=True)
+            if self.capture is not None:
+                self.capture.record(method, path, kwargs, r, start, error=e)
+            raise
+        self._instrument(method, path, kwargs, r, start)
+        if self.capture is not None:
+            self.capture.record(method, path, kwargs, r, start)
+        return r
+
+    def _dispatch(self, method, path, kwargs):
+        """
+        То же, что `requests.Session.request`, но с закэшированными настройками окружения.
+        """
+        base_url, settings = self._pipeline()
+        request_kwargs = {k: kwargs[k] for k in self._REQUEST_ARGS if k in kwargs}
+        request = requests.Request(method, base_url + path, **request_kwargs)
+        prepared = self.prepare_request(request)
+
+        overrides = [k for k in self._SEND_ARGS if kwargs.get(k) is not None]
+        if overrides:
+            settings = dict(settings)
+            for k in overrides:
+                if k == 'proxies':
+                    settings[k] = dict(settings[k], **kwargs[k])
+                else:
+                    settings[k] = kwargs[k]
+        return self.send(prepared, timeout=kwargs.get('timeout'),
+                         allow_redirects=kwargs.get('allow_redirects', True), **settings)
+
+    def before_request(self, method, path, kwargs):
+        pass
+
+    def after_request(self, r, start):
+        """
+        Вызывается для каждого полученного ответа до проверки его на ошибки.
+
+        :param float start: Время начала запроса (`time.time()`).
+        """
+        pass
+
+    def _instrument(self, method, path, kwargs, r, start, error=False):
+        if self.instrumentation is None:
+            return
+        seconds = time.time() - start
+        if r is None:
+            self.instrumentation.record(method, path, seconds, error=True)
+            return
+        body = r.request.body
+        if kwargs.get('stream'):
+            # Тело потокового ответа еще не прочитано, читать его здесь нельзя.
+            bytes_in = int(r.headers.get('Content-Length', 0))
+        else:
+            bytes_in = len(r.content or b'')
+        self.instrumentation.record(method, path, seconds, status_code=r.status_code,
+                                    bytes_out=len(body) if body else 0, bytes_in=bytes_in,
+                                    error=error)
+
+    def _ensure_pool_size(self, size):
+        """
+        Пул соединений requests по умолчанию держит 10 соединений на хост; при большем числе
+        потоков лишние соединения открываются и тут же закрываются.
+        """
+        if self.pool_maxsize < size:
+            self.pool_maxsize = size
+            adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_connections,
+                                                    pool_maxsize=size, pool_block=self.pool_block)
+            self.mount('http://', adapter)
+            self.mount('https://', adapter)
+
     @property
     def base_url(self):
-        base_url = 'http://{}:{}'.format(self.addr, self.port)
-        if self.prefix:
-            base_url += '/{}'.format(self.prefix)
-        return base_url
+        return self._pipeline()[0]
 
     def get(self, path, **kwargs):
-        return self.prepare(requests.Session.get)(self, path, **kwargs)
+        return self._request('GET', path, kwargs)
 
     def post(self, path, **kwargs):
-        return self.prepare(requests.Session.post)(self, path, **kwargs)
+        return self._request('POST', path, kwargs)
 
     def put(self, path, **kwargs):
-        return self.prepare(requests.Session.put)(self, path, **kwargs)
+        return self._request('PUT', path, kwargs)
 
     def delete(self, path, **kwargs):
-        return self.prepare(requests.Session.delete)(self, path, **kwargs)
+        return self._request('DELETE', path, kwargs)
 
 
 class WebHttpApi(Connection):
 
     @staticmethod
     def check_for_error(r):
-        try:
-            r.raise_for_status()
-        except requests.exceptions.HTTPError:
+        if r.status_code < 400:
+            return
+
+        def render():
             try:
                 j = r.json()
             except ValueError:
                 j = {}
-            msg = (
+            return (
                 '\nStatus code: {}\nHeaders: {}\n'
                 'Text: {}\nContent: {}\n'
                 'JSON: {}\n'.format(r.status_code,
@@ -293,15 +949,43 @@ class WebHttpApi(Connection):
                                     r.content,
                                     pretty_dict(j))
             )
-            raise ServerError(msg)
+        raise ServerError(response=r, render=render)
 
-    def get_nodes(self):
-        return self.get('/hosts').json()
+    def __init__(self, *args, **kwargs):
+        super(WebHttpApi, self).__init__(*args, **kwargs)
+        self._nodes = None
+
+    def get_nodes(self, cached=False):
+        """
+        :param bool cached: Вернуть список, полученный при предыдущем запросе (если он был).
+        """
+        if not cached or self._nodes is None:
+            self._nodes = self.get('/hosts').json()
+        return list(self._nodes)
+
+    def _single_node(self):
+        nodes = self.get_nodes(cached=True)
+        if len(nodes) != 1:
+            raise Exception('Cann\'t choose node name automatically: get_nodes() returns {}'.format(
+                nodes))
+        return nodes[0]
 
     def get_cpu_load(self):
         j = self.get('/statistics/hardware').json()
         return float(j[0]['totalCPU'].replace(',', '.')) / 100
 
+    def _get_arch_intervals_page(self, cam, begin_time, end_time, params):
+        """
+        Один Web-запрос интервалов. Отметки времени -- строки Web API (или 'past'/'future').
+
+        :return: Список интервалов в виде строк Web API и флаг more.
+        """
+        r = self.get(
+            '/archive/contents/intervals/{}/{}/{}'.format(cam.video_source_id, end_time, begin_time),
+            params=params)
+        data = r.json()
+        return data['intervals'], data['more']
+
     def get_arch_intervals(self, display_id, node=None, channel=0, stream=0,
                            begin_time=None, end_time=None, limit=None, scale=None,
                            sort_order=TimeSortOrder.NEWER_FIRST):
@@ -337,11 +1021,7 @@ class WebHttpApi(Connection):
         :return type: two items tuple
         """
         if node is None:
-            nodes = self.get_nodes()
-            if len(nodes) != 1:
-                raise Exception('Cann\'t choose node name automatically: get_nodes() returns {}'.format(
-                    nodes))
-            node = nodes[0]
+            node = self._single_node()
 
         params = {}
         add_int_to_dict(params, 'limit', limit)
@@ -357,44 +1037,124 @@ class WebHttpApi(Connection):
         else:
             begin_time = arrow_to_ts(begin_time)
 
-        cam = Camera.from_display_id(node, display_id)
-        r = self.get(
-            '/archive/contents/intervals/{}/{}/{}'.format(cam.video_source_id, end_time, begin_time),
-            params=params)
-        data = r.json()
-        data['intervals'] = [
-            {'begin': ts_to_arrow(i['begin']), 'end': ts_to_arrow(i['end'])}
-            for i in data['intervals']
-        ]
-        return (sorted(data['intervals'], key=itemgetter('begin'),
-                       reverse=(sort_order is TimeSortOrder.NEWER_FIRST)),
-                data['more'])
+        cam = Camera.from_display_id(node, display_id, channel=channel, stream=stream)
+        intervals, more = self._get_arch_intervals_page(cam, begin_time, end_time, params)
+        intervals = sorted(intervals, key=itemgetter('begin'),
+                           reverse=(sort_order is TimeSortOrder.NEWER_FIRST))
+        return intervals_to_arrow(intervals), more
 
-    def export_video(self, display_id, begin_time, end_time,
-                     format_, save_dir, node=None, timeout=None):
+    def get_all_arch_intervals(self, camera, begin_time=None, end_time=None,
+                               limit=None, scale=None):
         """
-        https://doc.axxonsoft.com/confluence/pages/viewpage.action?pageId=133530728
+        Как :meth:`get_arch_intervals`, но для объекта :class:`Camera` и со всеми страницами
+        ответа: пока сервер выставляет флаг more, запрашиваются интервалы старше самого раннего
+        из уже полученных.
 
-        :param str begin_time: Время начала экспорта (в Web API используется UTC).
-        :param str end_time: Время конца экспорта (в Web API используется UTC).
-        :param str save_dir: Директория, куда будут складываться файлы.
+        :return: Интервалы в виде словарей со строками Web API, от новых к старым.
+        :return type: list
         """
-        class logger:
-            @staticmethod
-            def debug(a):
-                print a
+        params = {}
+        add_int_to_dict(params, 'limit', limit)
+        add_int_to_dict(params, 'scale', scale)
+        begin_ts = 'past' if begin_time is None else arrow_to_ts(begin_time)
+        end_ts = 'future' if end_time is None else arrow_to_ts(end_time)
 
+        result = []
+        seen = set()
+        while True:
+            page, more = self._get_arch_intervals_page(camera, begin_ts, end_ts, params)
+            fresh = [i for i in page if (i['begin'], i['end']) not in seen]
+            result.extend(fresh)
+            if not more or not page:
+                break
+            end_ts = older_page_end(page, fresh, end_ts)
+            if end_ts is None:
+                break
+            seen = set((i['begin'], i['end']) for i in page)
+        result.sort(key=itemgetter('begin'), reverse=True)
+        return result
+
+    def get_arch_interval_set(self, camera, begin_time=None, end_time=None,
+                              limit=None, scale=None):
+        """
+        Все интервалы архива камеры (см. :meth:`get_all_arch_intervals`) в виде
+        :class:`IntervalSet`.
+        """
+        return IntervalSet.from_web_api(self.get_all_arch_intervals(
+            camera, begin_time=begin_time, end_time=end_time, limit=limit, scale=scale))
+
+    def scan_arch_intervals(self, cameras, begin_time=None, end_time=None, nodes=None,
+                            streams=(0,), limit=None, scale=None, max_workers=8,
+                            as_interval_set=False):
+        """
+        Параллельно получает интервалы архива для многих камер (со всеми страницами ответа, см.
+        :meth:`get_all_arch_intervals`). Это генератор: результаты отдаются по мере готовности.
+
+        :param cameras: Объекты :class:`Camera` или DisplayId. DisplayId запрашивается на каждой
+                        из нод `nodes` для каждого потока из `streams`.
+        :param list nodes: Имена нод. По умолчанию -- закэшированный результат get_nodes().
+        :param int max_workers: Максимальное число одновременных Web-запросов.
+        :param bool as_interval_set: Отдавать интервалы в виде :class:`IntervalSet`.
+        :return: Генератор :class:`ArchIntervalsScanResult`. Интервалы -- словари с
+                 :class:`Arrow`, от новых к старым (или :class:`IntervalSet`). Ошибка запроса для
+                 одной камеры не прерывает сканирование, а попадает в поле `error`.
+        """
+        targets = []
+        for cam in cameras:
+            if isinstance(cam, Camera):
+                targets.append(cam)
+                continue
+            if nodes is None:
+                nodes = self.get_nodes(cached=True)
+            for node in nodes:
+                for stream in streams:
+                    targets.append(Camera.from_display_id(node, cam, stream=stream))
+
+        def scan(cam):
+            intervals = self.get_all_arch_intervals(cam, begin_time=begin_time, end_time=end_time,
+                                                    limit=limit, scale=scale)
+            if as_interval_set:
+                return IntervalSet.from_web_api(intervals)
+            return intervals_to_arrow(intervals)
+
+        self._ensure_pool_size(max_workers)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        futures = {}
+        try:
+            futures = {executor.submit(scan, cam): cam for cam in targets}
+            for future in as_completed(futures):
+                cam = futures[future]
+                try:
+                    yield ArchIntervalsScanResult(cam, future.result(), None)
+                except (ServerError, requests.exceptions.RequestException) as e:
+                    logger.error('Can\'t get archive intervals for {}: {}'.format(cam, e))
+                    yield ArchIntervalsScanResult(cam, IntervalSet() if as_interval_set else [], e)
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def start_export(self, display_id, begin_time, end_time, format_, node=None):
+        """
+        Создает задачу экспорта.
+        https://doc.axxonsoft.com/confluence/pages/viewpage.action?pageId=133530728
+
+        :param begin_time: Время начала экспорта (в Web API используется UTC).
+        :param begin_time type: :class:`Arrow`
+        :param end_time: Время конца экспорта (в Web API используется UTC).
+        :param end_time type: :class:`Arrow`
+        :return: Путь задачи экспорта (job_id) для :meth:`get_export_status` и
+                 :meth:`cancel_export`.
+        :return type: str
+        """
         format_ = str(format_).lower()
         if format_ not in ['mkv', 'avi', 'exe', 'jpg', 'pdf']:
             raise Exception('Unsupported export format_ = {}'.format(format_))
         payload = {'format': format_}
         begin_time = arrow_to_ts(begin_time)
         end_time = arrow_to_ts(end_time)
-
-        if not os.path.isdir(save_dir):
-            os.remove(save_dir)
-        if not os.path.exists(save_dir):
-            os.makedirs(save_dir)
+        if node is None:
+            node = self._single_node()
 
         cam = Camera.from_display_id(node, display_id)
         r = self.post(
@@ -402,94 +1162,425 @@ class WebHttpApi(Connection):
             data=json.dumps(payload))
         job_id = r.headers['Location']
         logger.debug('Export job_id = \'{}\' from url = \'{}\''.format(job_id, r.url))
+        return job_id
 
-        if timeout is not None:
-            raise Exception('TODO')
-        sleep = 1
-        acc_sleep = 0
-        while True:
-            # TODO: сделать таймуат завершения процедуры. С кореектной прворкой отмены экспорта!
-            r = self.get('{}/status'.format(job_id))
-            resp_dict = r.json()
-            if resp_dict.get('state', None) != ExportJobState.IN_PROGRESS.value:
+    def get_export_status(self, job_id):
+        return self.get('{}/status'.format(job_id)).json()
+
+    def cancel_export(self, job_id):
+        self.delete(job_id)
+
+    @staticmethod
+    def _prepare_save_dir(save_dir):
+        if os.path.exists(save_dir) and not os.path.isdir(save_dir):
+            os.remove(save_dir)
+        if not os.path.exists(save_dir):
+            os.makedirs(save_dir)
+
+    def export_video(self, display_id, begin_time, end_time,
+                     format_, save_dir, node=None, timeout=None):
+        """
+        Экспорт с ожиданием завершения и скачиванием файлов. Для многих одновременных экспортов
+        см. :class:`ExportJobManager`.
+
+        :param str save_dir: Директория, куда будут складываться файлы.
+        :param float timeout: Максимальное время (сек.) ожидания экспорта на сервере. По его
+                              истечении экспорт отменяется и выбрасывается :class:`ExportJobError`.
+        :return: Пути к скачанным файлам.
+        """
+        manager = ExportJobManager(self)
+        try:
+            job = manager.submit(display_id, begin_time, end_time, format_,
+                                 save_dir=save_dir, node=node, timeout=timeout)
+            return job.result()
+        finally:
+            manager.close()
+
+    def download_export_files(self, job_id, files, save_dir, max_workers=4, retries=3):
+        """
+        Параллельно скачивает файлы завершенного экспорта.
+
+        Каждый файл пишется во временный `<имя>.<признак задачи>.part` и атомарно
+        переименовывается после завершения. При обрыве соединения или ошибке соединения скачивание
+        продолжается с места обрыва (HTTP Range), так же подхватывается `.part`, оставшийся от
+        предыдущего запуска для той же задачи экспорта.
+
+        :param str job_id: Путь задачи экспорта (заголовок Location ответа на ее создание).
+        :param list files: Имена файлов экспорта.
+        :param int retries: Число повторных попыток на файл после обрыва.
+        :return: Список :class:`ExportDownload` в порядке `files`.
+        """
+        self._ensure_pool_size(max_workers)
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = [executor.submit(self._download_export_file, job_id, file_name,
+                                       save_dir, retries)
+                       for file_name in files]
+            return [f.result() for f in futures]
+        finally:
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def part_path(job_id, path):
+        """
+        Временный файл скачивания `path`. В его имени -- признак задачи экспорта, чтобы не
+        продолжить файл, оставшийся от другого экспорта с тем же именем файла.
+        """
+        return '{}.{}.part'.format(path, hashlib.md5(job_id.encode('utf-8')).hexdigest()[:12])
+
+    @staticmethod
+    def _resumed_at(r, offset):
+        """
+        Продолжает ли ответ на запрос с `Range: bytes=<offset>-` файл ровно с `offset`.
+        """
+        if r.status_code != 206:
+            return False
+        content_range = r.headers.get('Content-Range', '')
+        return content_range.startswith('bytes {}-'.format(offset))
+
+    def _download_export_file(self, job_id, file_name, save_dir, retries):
+        path = os.path.join(save_dir, file_name)
+        part_path = self.part_path(job_id, path)
+        url = '{}/file?name={}'.format(job_id, file_name)
+        downloaded = 0
+        start = time.time()
+        for attempt in range(retries + 1):
+            offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+            headers = {'Range': 'bytes={}-'.format(offset)} if offset else {}
+            try:
+                r = self.get(url, stream=True, headers=headers)
+            except ServerError as e:
+                if not offset:
+                    raise
+                # Например, 416 -- сервер не принял Range. Начинаем файл заново.
+                logger.warning('Can\'t resume \'{}\' from {} bytes, restarting: {}'.format(
+                    file_name, offset, e))
+                os.remove(part_path)
+                continue
+            except requests.exceptions.RequestException as e:
+                if attempt == retries:
+                    raise
+                logger.warning('Can\'t request \'{}\' (attempt {}): {}'.format(
+                    file_name, attempt + 1, e))
+                continue
+            if offset and not self._resumed_at(r, offset):
+                if r.status_code == 206:
+                    # Часть файла не с того места: дописывать ее нельзя.
+                    logger.warning('\'{}\' resumed at {!r} instead of {} bytes, restarting'.format(
+                        file_name, r.headers.get('Content-Range'), offset))
+                    r.close()
+                    os.remove(part_path)
+                    continue
+                # Сервер отдал файл целиком.
+                offset = 0
+            expected = r.headers.get('Content-Length')
+            if expected is not None:
+                expected = offset + int(expected)
+            try:
+                with open(part_path, 'ab' if offset else 'wb') as fd:
+                    for chunk in r.iter_content(chunk_size=1024*1024):
+                        fd.write(chunk)
+                        downloaded += len(chunk)
+            except requests.exceptions.RequestException as e:
+                if attempt == retries:
+                    raise
+                logger.warning('Download of \'{}\' interrupted (attempt {}): {}'.format(
+                    file_name, attempt + 1, e))
+                continue
+            size = os.path.getsize(part_path)
+            if expected is None or size >= expected:
                 break
+            if attempt == retries:
+                raise Exception('File \'{}\' is incomplete: {} of {} bytes'.format(
+                    file_name, size, expected))
+            logger.warning('Download of \'{}\' stopped at {} of {} bytes (attempt {})'.format(
+                file_name, size, expected, attempt + 1))
+        else:
+            raise Exception('Can\'t download \'{}\''.format(file_name))
+        replace_file(part_path, path)
+
+        seconds = time.time() - start
+        mb_per_s = float(downloaded) / B_IN_MB / seconds if seconds > 0 else 0.0
+        logger.info('Export file \'{}\' saved: {:.1f} MB in {:.1f} s ({:.1f} MB/s)'.format(
+            path, float(size) / B_IN_MB, seconds, mb_per_s))
+        return ExportDownload(path, size, seconds, mb_per_s)
+
+
+class ExportJobError(RuntimeError):
+    pass
+
+
+class ExportJob(object):
+    """
+    Задача экспорта, которую опрашивает :class:`ExportJobManager`. Результат задачи -- список путей
+    к скачанным файлам (или имен файлов на сервере, если `save_dir` не задан).
+
+    :ivar float progress: Последний полученный от сервера прогресс (0..1).
+    :ivar dict status: Последний ответ сервера на запрос статуса.
+    """
+
+    def __init__(self, manager, job_id, save_dir, timeout):
+        self.manager = manager
+        self.job_id = job_id
+        self.save_dir = save_dir
+        self.started = time.time()
+        self.deadline = None if timeout is None else self.started + timeout
+        self.next_poll = self.started
+        self.progress = 0.0
+        self.status = None
+        self.future = Future()
+
+    def __repr__(self):
+        return '{}({!r})'.format(type(self).__name__, self.job_id)
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def add_done_callback(self, fn):
+        """
+        :param fn: Вызывается с объектом задачи, когда она завершится (в т.ч. с ошибкой).
+        """
+        self.future.add_done_callback(lambda future: fn(self))
+
+    def cancel(self):
+        return self.manager.cancel(self)
+
+
+class ExportJobManager(object):
+    """
+    Запускает много экспортов одновременно и опрашивает их статус из одного потока-планировщика.
+    Интервал опроса каждой задачи подстраивается под оценку оставшегося времени по `progress`.
+    Файлы готовых экспортов скачиваются пулом из `max_downloads` потоков.
+
+        manager = ExportJobManager(api)
+        jobs = [manager.submit(i, begin, end, 'mkv', save_dir=d) for i in display_ids]
+        for job in jobs:
+            files = job.result()
+        manager.close()
+    """
+
+    def __init__(self, api, min_interval=1.0, max_interval=30.0, max_downloads=4):
+        """
+        :param api: :class:`WebHttpApi`
+        :param float min_interval: Минимальный интервал (сек.) между опросами одной задачи.
+        :param float max_interval: Максимальный интервал (сек.) между опросами одной задачи.
+        """
+        self.api = api
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._jobs = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._downloads = ThreadPoolExecutor(max_workers=max_downloads)
+        self._thread = threading.Thread(target=self._run, name='ExportJobManager')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, display_id, begin_time, end_time, format_, save_dir=None,
+               node=None, timeout=None, callback=None):
+        """
+        Создает задачу экспорта (см. :meth:`WebHttpApi.start_export`) и ставит ее на опрос.
+
+        :param str save_dir: Куда скачать файлы. Если None, файлы не скачиваются.
+        :param float timeout: Максимальное время (сек.) экспорта на сервере, после которого он
+                              отменяется.
+        :param callback: См. :meth:`ExportJob.add_done_callback`.
+        :return type: :class:`ExportJob`
+        """
+        if self._closed:
+            raise ExportJobError('ExportJobManager is closed')
+        if save_dir is not None:
+            self.api._prepare_save_dir(save_dir)
+        job_id = self.api.start_export(display_id, begin_time, end_time, format_, node=node)
+        job = ExportJob(self, job_id, save_dir, timeout)
+        if callback is not None:
+            job.add_done_callback(callback)
+        with self._lock:
+            self._jobs.append(job)
+        self._wakeup.set()
+        return job
+
+    def cancel(self, job):
+        """
+        Отменяет экспорт на сервере. :meth:`ExportJob.result` после этого выбросит
+        `CancelledError`.
+        """
+        with self._lock:
+            if job not in self._jobs:
+                return False
+            self._jobs.remove(job)
+        self._cancel_on_server(job)
+        return job.future.cancel()
+
+    def close(self, cancel=False):
+        """
+        Останавливает планировщик. Незавершенные задачи отменяются, если `cancel` истинно, иначе
+        вызов ждет их завершения.
+        """
+        if cancel:
+            with self._lock:
+                jobs = list(self._jobs)
+            for job in jobs:
+                self.cancel(job)
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        self._downloads.shutdown(wait=True)
+
+    def _cancel_on_server(self, job):
+        try:
+            self.api.cancel_export(job.job_id)
+        except (ServerError, requests.exceptions.RequestException) as e:
+            logger.warning('Can\'t cancel export job_id = \'{}\': {}'.format(job.job_id, e))
+
+    def _next_interval(self, job):
+        return adaptive_poll_interval(job.progress, time.time() - job.started,
+                                      self.min_interval, self.max_interval)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                jobs = list(self._jobs)
+            if not jobs and self._closed:
+                return
+            now = time.time()
+            for job in jobs:
+                if job.next_poll <= now:
+                    try:
+                        self._poll(job)
+                    except Exception as e:
+                        logger.exception('Error polling export job_id = \'{}\''.format(job.job_id))
+                        if self._finish(job):
+                            job.future.set_exception(e)
+            with self._lock:
+                wakeups = [job.next_poll for job in self._jobs]
+            timeout = max(min(wakeups) - time.time(), 0) if wakeups else None
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def _finish(self, job):
+        with self._lock:
+            if job not in self._jobs:
+                return False
+            self._jobs.remove(job)
+        return job.future.set_running_or_notify_cancel()
+
+    def _poll(self, job):
+        try:
+            status = self.api.get_export_status(job.job_id)
+        except (ServerError, requests.exceptions.RequestException) as e:
+            if self._finish(job):
+                job.future.set_exception(e)
+            return
+        job.status = status
+        state = status.get('state', None)
+        if state == ExportJobState.IN_PROGRESS.value:
             try:
-                p = float(resp_dict['progress'])
-                sleep = (1.0-p)/p * acc_sleep / 2.0
-            except:
+                job.progress = float(status['progress'])
+            except (KeyError, TypeError, ValueError):
                 pass
-            finally:
-                if sleep < 1 or sleep > 30:
-                    sleep = 1
-            logger.debug('Export state of job_id = \'{}\': progress = {}; next sleep = {}; acc_sleep = {}'.format(job_id, resp_dict['progress'], sleep, acc_sleep))
-            time.sleep(sleep)
-            acc_sleep += sleep
-
-        if resp_dict['state'] is not ExportJobState.DONE.value:
-            raise Exception('Error during export: \"{error}\" (code={state}).'
-                            ' Progress: {progress}.'.format(**resp_dict))
-        files = resp_dict['files']
-        logger.debug('Export job_id = \'{}\' has been finished: files = {}'.format(job_id, files))
-
-        file_pathes = []
-        for file_name in files:
-            r = self.get('{}/file?name={}'.format(job_id, file_name), stream=True)
-            file_pathes.append(os.path.join(save_dir, file_name))
-            with open(file_pathes[-1], 'wb') as fd:
-                for chunk in r.iter_content(chunk_size=1024*1024):
-                    fd.write(chunk)
-
-        logger.debug('Export job_id = \'{}\' files have been saved to {}'.format(job_id, file_pathes))
-        return file_pathes
+            if job.deadline is not None and time.time() > job.deadline:
+                self._cancel_on_server(job)
+                if self._finish(job):
+                    job.future.set_exception(ExportJobError(
+                        'Export job_id = \'{}\' timed out at progress {}'.format(
+                            job.job_id, job.progress)))
+                return
+            job.next_poll = time.time() + self._next_interval(job)
+            if job.deadline is not None:
+                job.next_poll = min(job.next_poll, job.deadline)
+            logger.debug('Export state of job_id = \'{}\': progress = {}; next poll in {:.1f} s'.format(
+                job.job_id, job.progress, job.next_poll - time.time()))
+            return
+
+        if not self._finish(job):
+            return
+        if state != ExportJobState.DONE.value:
+            job.future.set_exception(ExportJobError(
+                'Error during export: \"{}\" (code={}). Progress: {}.'.format(
+                    status.get('error'), state, status.get('progress'))))
+            return
+        files = status['files']
+        logger.debug('Export job_id = \'{}\' has been finished: files = {}'.format(job.job_id, files))
+        if job.save_dir is None:
+            job.future.set_result(files)
+        else:
+            self._downloads.submit(self._download, job, files)
+
+    def _download(self, job, files):
+        try:
+            downloads = self.api.download_export_files(job.job_id, files, job.save_dir)
+        except Exception as e:
+            job.future.set_exception(e)
+        else:
+            file_pathes = [d.path for d in downloads]
+            logger.debug('Export job_id = \'{}\' files have been saved to {}'.format(
+                job.job_id, file_pathes))
+            job.future.set_result(file_pathes)
 
 
 class RsgHttpApi(Connection):
     def __init__(self, *args, **kwargs):
+        """
+        :param str log_db: Путь к SQLite-базе журнала запросов. Если None, журнал не ведется.
+        :param float log_flush_interval: См. :class:`RSGRequestLogWriter`.
+        :param int log_batch_size: См. :class:`RSGRequestLogWriter`.
+        :param float cache_ttl: Если задан, списки объектов кэшируются на это время (сек.), см.
+                                :class:`ObjectInventory`.
+        """
         log_db = kwargs.pop('log_db', None)
+        log_flush_interval = kwargs.pop('log_flush_interval', 1.0)
+        log_batch_size = kwargs.pop('log_batch_size', 500)
+        cache_ttl = kwargs.pop('cache_ttl', None)
         super(RsgHttpApi, self).__init__(*args, **kwargs)
         if log_db is not None:
-            full_path = os.path.abspath(os.path.normpath(log_db))
-            engine = create_engine('sqlite:///{}'.format(full_path))
-            Base.metadata.create_all(bind=engine)
-            Session = sessionmaker(bind=engine)
-            self.db_session = scoped_session(Session)
+            self.log_writer = RSGRequestLogWriter(log_db,
+                                                  flush_interval=log_flush_interval,
+                                                  batch_size=log_batch_size)
+            # Сессия для чтения журнала; записи пишет только self.log_writer.
+            self.db_session = scoped_session(sessionmaker(bind=self.log_writer.engine))
         else:
+            self.log_writer = None
             self.db_session = None
 
+        self.inventory = ObjectInventory(cache_ttl) if cache_ttl is not None else None
+        # Для поиска новых объектов нужны актуальные списки, поэтому здесь кэш не используется.
         self.objects_functions = {
-            'Camera': self.get_cameras,
-            'Archive': self.get_archives,
-            'Detector': self.get_detectors,
+            'Camera': self._fetch_cameras,
+            'Archive': self._fetch_archives,
+            'Detector': self._fetch_detectors,
         }
         self.objects = self.objects_functions.keys()
 
         self.locks = {name: threading.Lock() for name in self.objects}
 
-
-    def prepare(self, f):
-        @wraps(f)
-        def tmp(self, path, **kwargs):
-            logger.debug('{} {}'.format(path, kwargs))
-            assert path.startswith('/')
-            start = datetime.utcnow()
-            r = f(self, self.base_url + path, **kwargs)
-            if self.db_session is not None:
-                try:
-                    data = {
-                        'method': r.request.method,
-                        'url': r.request.url,
-                        'body': r.request.body,
-                        'utc_start': start,
-                        'delta': r.elapsed.total_seconds(),
-                        'status_code': r.status_code,
-                    }
-                    self.db_session.add(RSGRequestRecord(**data))
-                    self.db_session.commit()
-                except Exception as e:
-                    logger.error('Error working with DB: {}'.format(e))
-            self.check_for_error(r)
-            return r
-        return tmp
+        # Вложенность batch() и отложенный flush -- свои у каждого потока.
+        self._batch_state = threading.local()
+
+    def before_request(self, method, path, kwargs):
+        logger.debug('{} {}'.format(path, kwargs))
+
+    def after_request(self, r, start):
+        if self.log_writer is not None:
+            self.log_writer.write({
+                'method': r.request.method,
+                'url': r.request.url,
+                'route': route_template(r.request.path_url),
+                'body': r.request.body or '',
+                'utc_start': datetime.utcfromtimestamp(start),
+                'delta': r.elapsed.total_seconds(),
+                'status_code': r.status_code,
+            })
+
+    def close(self):
+        if self.log_writer is not None:
+            self.log_writer.close()
+            self.db_session.remove()
+        super(RsgHttpApi, self).close()
 
     @contextmanager
     def get_new_object(self, object_class):
@@ -506,27 +1597,58 @@ class RsgHttpApi(Connection):
             objects_before = function()
             yield a
             objects_after = function()
+        self._invalidate(name)
         objects_new = list(set(objects_after) - set(objects_before))
         assert len(objects_new) == 1
         a.created_object = objects_new[0]
 
+    def _invalidate(self, *names):
+        if self.inventory is not None:
+            self.inventory.invalidate(*names)
+
     @staticmethod
     def check_for_error(r):
-        j = r.json()
+        try:
+            j = r.json()
+        except ValueError:
+            j = None
+        if not isinstance(j, dict) or 'Result' not in j:
+            # Например, страница ошибки прокси или веб-сервера вместо ответа RSG.
+            def render():
+                return '\nStatus Code: {}\nHeaders: {}\nText: {}\n'.format(
+                    r.status_code, pretty_dict(dict(r.headers)), r.text)
+            raise RSGServerError(json_response=j, response=r, render=render)
+        RsgHttpApi._check_result(r, j)
+
+    @staticmethod
+    def check_stream_for_error(r):
+        """
+        Поле `Result` потокового ответа проверяется после его разбора (см. :meth:`_iter_data`),
+        здесь -- только код ответа.
+        """
+        if r.status_code >= 400:
+            def render():
+                return '\nStatus Code: {}\nHeaders: {}\n'.format(r.status_code,
+                                                                pretty_dict(dict(r.headers)))
+            raise RSGServerError(response=r, render=render)
+
+    @staticmethod
+    def _check_result(r, j):
         ignored_messages = [
             "Can't find objects to delete",
             "Can't find detectors to remove",
             "Nothing to flush, no operations were performed",
         ]
         if (j['Result'] != 'Success' and
-                j['Message'] not in ignored_messages):
-            msg = (
-                '\nStatus Code: {}\nHeaders: {}\n'
-                'Server json response: {}'.format(r.status_code,
-                                                  pretty_dict(dict(r.headers)),
-                                                  pretty_dict(j))
-            )
-            raise RSGServerError(msg, json_response=j)
+                j.get('Message') not in ignored_messages):
+            def render():
+                return (
+                    '\nStatus Code: {}\nHeaders: {}\n'
+                    'Server json response: {}'.format(r.status_code,
+                                                      pretty_dict(dict(r.headers)),
+                                                      pretty_dict(j))
+                )
+            raise RSGServerError(json_response=j, response=r, render=render)
 
     @staticmethod
     def fix_drive_letter_case(path):
@@ -537,10 +1659,82 @@ class RsgHttpApi(Connection):
             fixed_path = norm
         return fixed_path
 
-    def create_camera(self, data):
+    @staticmethod
+    def _creation_order_key(obj):
+        """
+        RSG нумерует новые объекты по возрастанию (`DeviceIpint.3`, `AVDetector.12`, ...), поэтому
+        номер из id задает порядок создания. У архивов в id имя, а не номер, поэтому они
+        сопоставляются по имени (см. :meth:`create_archives_bulk`).
+        """
+        n = obj.id.split('/')[2].split('.')[-1]
+        return (0, int(n), obj.id) if n.isdigit() else (1, 0, obj.id)
+
+    def _create_bulk(self, object_class, items, post_item, group_key=None):
+        """
+        Создает сразу много объектов класса `object_class`: список объектов запрашивается один раз
+        до и один раз после всех POST-запросов, а новые объекты сопоставляются с запросами по
+        порядку создания (см. :meth:`_creation_order_key`).
+
+        :param items: Описания создаваемых объектов (в порядке подачи).
+        :param post_item: Функция, делающая POST для одного описания.
+        :param group_key: Функции ключа группы для описания и для созданного объекта. Порядок
+                          создания сопоставляется внутри каждой группы (к примеру, детекторы
+                          сопоставляются в пределах своей камеры).
+        :param group_key type: two items tuple или None
+        :return: :class:`BulkCreateResult`. Если в группе новых объектов не столько, сколько
+                 отправлено описаний, все описания группы получают :class:`BulkCreateError`.
+        """
+        result = BulkCreateResult(len(items))
+        name = object_class.__name__
+        function = self.objects_functions[name]
+        submitted = []
+        with self.locks[name]:
+            objects_before = function()
+            for i, item in enumerate(items):
+                try:
+                    post_item(item)
+                except (ServerError, requests.exceptions.RequestException) as e:
+                    logger.error('Can\'t create {} #{}: {}'.format(name, i, e))
+                    result.errors[i] = e
+                else:
+                    submitted.append(i)
+            objects_after = function()
+        self._invalidate(name)
+        objects_new = list(set(objects_after) - set(objects_before))
+
+        item_key, object_key = group_key or (lambda item: None, lambda obj: None)
+        groups = {}
+        for i in submitted:
+            groups.setdefault(item_key(items[i]), []).append(i)
+        created = {}
+        for obj in objects_new:
+            created.setdefault(object_key(obj), []).append(obj)
+        for k, indices in groups.items():
+            objects = created.pop(k, [])
+            if len(objects) != len(indices):
+                error = BulkCreateError(
+                    'Can\'t match created {} objects to requests: {} requested, new objects '
+                    'are {}'.format(name, len(indices), objects))
+                logger.error(error)
+                for i in indices:
+                    result.fail(i, error)
+                continue
+            for i, obj in zip(indices, sorted(objects, key=self._creation_order_key)):
+                result.created[i] = obj
+        if created:
+            logger.warning('New {} objects not matched to requests: {}'.format(
+                name, [obj for objects in created.values() for obj in objects]))
+        return result
+
+    @staticmethod
+    def _split_camera_data(data):
         INI_KEYS = ('Vendor', 'Model')
         ini_data = {k: data[k] for k in INI_KEYS if k in data}
         upd_data = {k: data[k] for k in data if k not in INI_KEYS}
+        return ini_data, upd_data
+
+    def create_camera(self, data):
+        ini_data, upd_data = self._split_camera_data(data)
         with self.get_new_object(Camera) as a:
             self.post('/rsg/ipint', json=ini_data)
         camera = a.created_object
@@ -558,22 +1752,32 @@ class RsgHttpApi(Connection):
             data['vstream-virtual/folder'] = self.fix_drive_letter_case(video_clips_folder)
         return self.create_camera(data)
 
-    def create_archive(self, archive_file, size=5,
-                       should_format=True, color='Red'):
+    @classmethod
+    def _archive_data(cls, archive_file, size=5, should_format=True, color='Red', name=None):
         # archive_size is in GB.
         if not should_format:
             size = 0
-        path = self.fix_drive_letter_case(archive_file)
+        path = cls.fix_drive_letter_case(archive_file)
         volume = '{}|{}|{}'.format(
             path, size, ('true' if should_format else 'false'))
-        name = os.path.basename(path)
-        if name.endswith(ARCHIVE_EXTENSION):
-            name = name[:-len(ARCHIVE_EXTENSION)]
-        data = {
+        if name is None:
+            name = os.path.basename(path)
+            if name.endswith(ARCHIVE_EXTENSION):
+                name = name[:-len(ARCHIVE_EXTENSION)]
+        return {
             'Volumes': volume,
             'Name': name,
             'Color': color,
         }
+
+    def create_archive(self, archive_file, size=5,
+                       should_format=True, color='Red', name=None):
+        """
+        :param str name: Имя архива (см. :attr:`Archive.name`). По умолчанию -- имя файла
+                         `archive_file` без расширения.
+        """
+        data = self._archive_data(archive_file, size=size,
+                                  should_format=should_format, color=color, name=name)
         with self.get_new_object(Archive) as a:
             self.post('/rsg/archive', json=data)
         arch = a.created_object
@@ -582,15 +1786,20 @@ class RsgHttpApi(Connection):
         logger.debug(pretty_dict(self.get_info(arch)))
         return arch
 
+    @staticmethod
+    def _split_detector_data(data):
+        INI_KEYS = ('DetectorModule', 'DetectorType')
+        ini_data = {k: data[k] for k in INI_KEYS if k in data}
+        upd_data = {k: data[k] for k in data if k not in INI_KEYS}
+        return ini_data, upd_data
+
     def create_detector(self, data, camera):
         """
         :returns str: Строка вида "hosts/SERVER/AVDetector.1/EventSupplier". При этом, короткая
                       команда `prepareImport` возвращает строку вида
                       "hosts/SERVER/AVDetector.1/SourceEndpoint.vmda"! Важно это помнить.
         """
-        INI_KEYS = ('DetectorModule', 'DetectorType')
-        ini_data = {k: data[k] for k in INI_KEYS if k in data}
-        upd_data = {k: data[k] for k in data if k not in INI_KEYS}
+        ini_data, upd_data = self._split_detector_data(data)
         with self.get_new_object(Detector) as a:
             self.post('/rsg/detector', json=ini_data, params={'pid': camera.source_endpoint_id})
         detector = a.created_object
@@ -601,40 +1810,247 @@ class RsgHttpApi(Connection):
         logger.debug(pretty_dict(self.get_info(detector)))
         return detector
 
+    def create_cameras_bulk(self, data_list):
+        """
+        Массовый аналог :meth:`create_camera`: два запроса списка камер на всю пачку и один
+        `flush()` в конце.
+
+        :param list data_list: Список словарей `data`, как для :meth:`create_camera`.
+        :return type: :class:`BulkCreateResult`
+        """
+        split = [self._split_camera_data(data) for data in data_list]
+        result = self._create_bulk(
+            Camera, split, lambda item: self.post('/rsg/ipint', json=item[0]))
+        for i, camera in result.iter_created():
+            try:
+                self.put('/rsg/ipint', json=split[i][1], params={'id': camera.id})
+            except (ServerError, requests.exceptions.RequestException) as e:
+                logger.error('Can\'t set up {}: {}'.format(camera, e))
+                result.fail(i, e)
+        self.flush()
+        logger.info('{} cameras created ({} failed).'.format(
+            len(result.created) - len(result.errors), len(result.errors)))
+        return result
+
+    def create_archives_bulk(self, archives):
+        """
+        Массовый аналог :meth:`create_archive`.
+
+        :param list archives: Элементы -- путь к файлу архива или словарь аргументов
+                              :meth:`create_archive`.
+        :return type: :class:`BulkCreateResult`
+        """
+        data_list = [self._archive_data(**(a if isinstance(a, dict) else {'archive_file': a}))
+                     for a in archives]
+        result = self._create_bulk(
+            Archive, data_list, lambda data: self.post('/rsg/archive', json=data),
+            group_key=(itemgetter('Name'), lambda archive: archive.name))
+        self.flush()
+        logger.info('{} archives created ({} failed).'.format(
+            len(result.created) - len(result.errors), len(result.errors)))
+        return result
+
+    def create_detectors_bulk(self, items):
+        """
+        Массовый аналог :meth:`create_detector`.
+
+        :param list items: Пары `(data, camera)`, как аргументы :meth:`create_detector`.
+        :return type: :class:`BulkCreateResult`
+        """
+        def camera_key(camera):
+            return camera.node, camera.display_id
+
+        split = [self._split_detector_data(data) + (camera,) for data, camera in items]
+        result = self._create_bulk(
+            Detector, split,
+            lambda item: self.post('/rsg/detector', json=item[0],
+                                   params={'pid': item[2].source_endpoint_id}),
+            group_key=(lambda item: camera_key(item[2]),
+                       lambda detector: camera_key(detector.camera)))
+        for i, detector in result.iter_created():
+            camera = split[i][2]
+            upd_id = '{0}|{1}'.format(camera.id, detector.id)
+            try:
+                self.put('/rsg/detector', json=split[i][1], params={'id': upd_id})
+            except (ServerError, requests.exceptions.RequestException) as e:
+                logger.error('Can\'t set up {}: {}'.format(detector, e))
+                result.fail(i, e)
+        self.flush()
+        logger.info('{} detectors created ({} failed).'.format(
+            len(result.created) - len(result.errors), len(result.errors)))
+        return result
+
     def update_detector(self, detector, data):
         upd_id = '{0}|{1}'.format(detector.camera.id, detector.id)
         self.put('/rsg/detector', json=data, params={'id': upd_id})
+        self._invalidate('Detector')
         self.flush()
         logger.info('{} updated.'.format(detector))
         logger.debug(pretty_dict(self.get_info(detector)))
 
+    def update_camera(self, camera, data):
+        self.put('/rsg/ipint', json=data, params={'id': camera.id})
+        self._invalidate('Camera')
+        self.flush()
+        logger.info('{} updated.'.format(camera))
+
+    def update_archive(self, archive, data):
+        self.put('/rsg/archive', json=data, params={'id': archive.id})
+        self._invalidate('Archive')
+        self.flush()
+        logger.info('{} updated.'.format(archive))
+
+    def find_detectors(self, camera=None, module=None, detector_type=None, name=None):
+        """
+        Детекторы, подходящие под все заданные условия.
+
+        С включенным кэшем (`cache_ttl`) поиск идет по индексам :class:`ObjectInventory`. Без
+        кэша запрашиваются детекторы только камеры `camera` (если она задана) или все, остальные
+        условия проверяются на клиенте.
+
+        :param camera: :class:`Camera`.
+        :param str module: `DetectorModule`, например `LprDetector`, `TvaFaceDetector`,
+                           `SituationDetector`.
+        :param str detector_type: `DetectorType`.
+        :param str name: Отображаемое имя детектора.
+        """
+        if self.inventory is not None:
+            return self.inventory.find('Detector', self._fetch_detectors, {
+                'camera': camera.id if camera is not None else None,
+                'module': module,
+                'type': detector_type,
+                'name': name,
+            })
+        return [d for d in self.iter_detectors(camera=camera)
+                if (module is None or d.module == module) and
+                (detector_type is None or d.detector_type == detector_type) and
+                (name is None or d.name == name)]
+
+    def update_detectors(self, filter, data):
+        """
+        Применяет настройки `data` ко многим детекторам: все PUT-запросы делаются в одном
+        :meth:`batch`, с одним flush в конце.
+
+        :param filter: Словарь условий :meth:`find_detectors` (`{'module': 'LprDetector'}`),
+                       функция `Detector -> bool` или список детекторов.
+        :param dict data: Настройки, как для :meth:`update_detector`.
+        :return: :class:`BulkCreateResult`, где `created` -- обновленные детекторы, а `errors` --
+                 ошибки по номерам детекторов.
+        """
+        if isinstance(filter, dict):
+            detectors = self.find_detectors(**filter)
+        elif callable(filter):
+            detectors = [d for d in self.get_detectors() if filter(d)]
+        else:
+            detectors = list(filter)
+        result = BulkCreateResult(len(detectors))
+        with self.batch():
+            for i, detector in enumerate(detectors):
+                upd_id = '{0}|{1}'.format(detector.camera.id, detector.id)
+                try:
+                    self.put('/rsg/detector', json=data, params={'id': upd_id})
+                except (ServerError, requests.exceptions.RequestException) as e:
+                    logger.error('Can\'t update {}: {}'.format(detector, e))
+                    result.fail(i, e)
+                else:
+                    result.created[i] = detector
+            self.flush()
+        self._invalidate('Detector')
+        logger.info('{} detectors updated ({} failed).'.format(
+            len(detectors) - len(result.errors), len(result.errors)))
+        return result
+
     def get_camera(self, display_id):
-        cameras = [c for c in self.get_cameras() if c.display_id == int(display_id)]
+        if self.inventory is not None:
+            cameras = self.inventory.lookup('Camera', self._fetch_cameras,
+                                            'display_id', int(display_id))
+        else:
+            cameras = [c for c in self.get_cameras() if c.display_id == int(display_id)]
         assert len(cameras) == 1
         return cameras[0]
 
     get_camera_by_id = get_camera
 
     def get_cameras(self):
-        _list = self.get('/rsg/ipint').json()['Data']
-        return [Camera(item['Id']) for item in _list]
+        if self.inventory is not None:
+            return self.inventory.objects('Camera', self._fetch_cameras)
+        return self._fetch_cameras()
 
     def get_archives(self):
-        _list = self.get('/rsg/archive').json()['Data']
-        return [Archive(item['Name']) for item in _list]
+        if self.inventory is not None:
+            return self.inventory.objects('Archive', self._fetch_archives)
+        return self._fetch_archives()
 
     def get_detectors(self):
-        detectors = []
-        for c in self.get('/rsg/detector').json()['Data']:
-            camera = Camera(c['Id'])
+        if self.inventory is not None:
+            return self.inventory.objects('Detector', self._fetch_detectors)
+        return self._fetch_detectors()
+
+    def _iter_data(self, path, keys=None, params=None):
+        """
+        Элементы `Data` ответа RSG на GET-запрос `path`. Если установлен ijson, ответ разбирается
+        потоково: элементы отдаются по мере получения, и в них остаются только ключи `keys` (см.
+        :func:`iter_json_items`). Без ijson ответ разбирается целиком.
+        """
+        if ijson is None:
+            for item in self.get(path, params=params).json()['Data']:
+                yield item
+            return
+        r = self.get(path, params=params, stream=True)
+        header = {'Result': None, 'Message': None}
+        try:
+            r.raw.decode_content = True
+            events = ijson.parse(r.raw, use_float=True)
+            for item in iter_json_items(events, 'Data', keys, header):
+                yield item
+        finally:
+            r.close()
+        self._check_result(r, header)
+
+    def iter_cameras(self):
+        """
+        Генератор камер без кэша: отдает камеры по мере разбора ответа, не держа в памяти весь
+        список (если установлен ijson).
+        """
+        for item in self._iter_data('/rsg/ipint', ('Id',)):
+            yield Camera(item['Id'])
+
+    def iter_archives(self):
+        for item in self._iter_data('/rsg/archive', ('Name',)):
+            yield Archive(item['Name'])
+
+    def iter_detectors(self, camera=None):
+        """
+        Как :meth:`iter_cameras`. Детекторы отдаются по камерам: RSG группирует их по камерам.
+
+        :param camera: Только детекторы этой камеры (фильтр на стороне сервера).
+        """
+        keys = ('Id',) + tuple('Children.item.' + key for key in Detector.RSG_KEYS)
+        params = {'id': camera.id} if camera is not None else None
+        for c in self._iter_data('/rsg/detector', keys, params=params):
+            cam = Camera(c['Id'])
             for ch in c['Children']:
-                id = ch['Id']
-                name = ch['Settings']['DisplayName']
-                detectors.append(Detector(id, camera, name=name))
-        return detectors
+                yield Detector.from_rsg(ch, cam)
+
+    def iter_items(self, path):
+        """
+        Элементы `Data` ответа RSG на `path` (`/rsg/ipint`, `/rsg/archive`, `/rsg/detector`) со
+        всеми настройками, без кэша.
+        """
+        return self._iter_data(path)
+
+    def _fetch_cameras(self):
+        return list(self.iter_cameras())
+
+    def _fetch_archives(self):
+        return list(self.iter_archives())
+
+    def _fetch_detectors(self):
+        return list(self.iter_detectors())
 
     def delete_vmda_data(self, camera):
         self.delete('/rsg/vmda/data', params={'id': camera.id})
+        self._invalidate('Detector')
         self.flush()
         logger.info('VMDA data for {} deleted.'.format(camera))
 
@@ -642,27 +2058,95 @@ class RsgHttpApi(Connection):
         if remove_vmda_data:
             self.delete_vmda_data(camera)
         self.delete('/rsg/ipint', params={'id': camera.id})
+        self._invalidate('Camera', 'Detector')
         self.flush()
         logger.info('{} deleted.'.format(camera))
 
+    def delete_archive(self, archive):
+        self.delete('/rsg/archive', params={'id': archive.id})
+        self._invalidate('Archive')
+        self.flush()
+        logger.info('{} deleted.'.format(archive))
+
+    def delete_detector(self, detector):
+        del_id = '{0}|{1}'.format(detector.camera.id, detector.id)
+        self.delete('/rsg/detector', params={'id': del_id})
+        self._invalidate('Detector')
+        self.flush()
+        logger.info('{} deleted.'.format(detector))
+
     def delete_all_cameras(self):
         self.delete('/rsg/ipint', params={'id': '.'})
+        self._invalidate('Camera', 'Detector')
         self.flush()
         logger.info("All cameras deleted.")
 
     def delete_all_archives(self):
         self.delete('/rsg/archive', params={'id': '.'})
+        self._invalidate('Archive')
         self.flush()
         logger.info("All archives deleted.")
 
     def delete_all_detectors(self):
         self.delete('/rsg/detector', params={'id': '.'})
+        self._invalidate('Detector')
         self.flush()
         logger.info("All detectors deleted.")
 
+    def _batch(self):
+        state = self._batch_state
+        if not hasattr(state, 'depth'):
+            state.depth = 0
+            state.flush_pending = False
+        return state
+
     def flush(self):
+        """
+        Фиксирует изменения конфигурации на сервере. Внутри :meth:`batch` только помечает, что
+        flush нужен, а сам запрос делается при выходе из блока или в :meth:`checkpoint`.
+        """
+        state = self._batch()
+        if state.depth:
+            state.flush_pending = True
+            return
         self.post('/rsg', json={'action': 'flush'})
 
+    def checkpoint(self):
+        """
+        Внутри :meth:`batch` немедленно делает отложенный flush (если он нужен).
+        """
+        state = self._batch()
+        pending, state.flush_pending = state.flush_pending, False
+        if pending:
+            self.post('/rsg', json={'action': 'flush'})
+
+    @contextmanager
+    def batch(self):
+        """
+        Откладывает flush всех изменяющих методов до выхода из блока:
+
+            with api.batch():
+                for i in range(500):
+                    api.create_virtual_camera()
+
+        Блоки могут быть вложенными, flush делается при выходе из самого внешнего (в том числе по
+        исключению -- отката изменений в RSG нет, а сделанные запросы уже применены). Id новых
+        объектов читаются из списков объектов, которые видят изменения и до flush. Методы, которым
+        нужна зафиксированная конфигурация (:meth:`start_import`), сами вызывают
+        :meth:`checkpoint`.
+
+        Блок откладывает flush только в потоке, который в него вошел: другие потоки, работающие с
+        тем же объектом, делают flush как обычно (и тем самым фиксируют и изменения блока).
+        """
+        state = self._batch()
+        state.depth += 1
+        try:
+            yield self
+        finally:
+            state.depth -= 1
+            if not state.depth:
+                self.checkpoint()
+
     def bind_camera_to_archive(self, camera, archive, permanent_write=False,
                                replication=False):
         params = {
@@ -676,6 +2160,7 @@ class RsgHttpApi(Connection):
         if replication:
             data['SourceArchive'] = camera.embedded_storage_id
         self.post('/rsg/binding', json=data, params=params)
+        self._invalidate('Camera', 'Archive')
         self.flush()
         word = 'permanent write' if permanent_write else 'on-demand'
         if replication:
@@ -692,6 +2177,8 @@ class RsgHttpApi(Connection):
             'BeginTime': int(begin_time),
             'EndTime': int(end_time),
         }
+        # Репликация читает привязку камеры к архиву из зафиксированной конфигурации.
+        self.checkpoint()
         j = self.post('/rsg/binding/replication', json=data).json()
         self.flush()
         return j['Data']['Token']
@@ -714,13 +2201,16 @@ class RsgHttpApi(Connection):
         return float(j['Data']['Progress']) / 100
 
     def print_cameras_info(self):
-        logger.info(pretty_dict(self.get('/rsg/ipint').json()['Data']))
+        for item in self._iter_data('/rsg/ipint'):
+            logger.info(pretty_dict(item))
 
     def print_archives_info(self):
-        logger.info(pretty_dict(self.get('/rsg/archive').json()['Data']))
+        for item in self._iter_data('/rsg/archive'):
+            logger.info(pretty_dict(item))
 
     def print_detectors_info(self):
-        logger.info(pretty_dict(self.get('/rsg/detector').json()['Data']))
+        for item in self._iter_data('/rsg/detector'):
+            logger.info(pretty_dict(item))
 
 # data = {
 #     'Action': 'prepareImport',
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+Сбор статистики HTTP-запросов: гистограммы задержек, объемы данных, коды ответов и ошибки в
+разрезе метода и шаблона пути (без id объектов и отметок времени).
+
+    metrics = RequestMetrics()
+    api = RsgHttpApi(addr, port=8000, instrumentation=metrics)
+    ...
+    print(metrics.to_prometheus())
+"""
+
+import re
+import threading
+from bisect import bisect_left
+
+# Верхние границы корзин гистограммы задержек (сек.).
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_ROUTE_RULES = [
+    (re.compile(r'^(/archive/contents/intervals)/.+/([^/]+)/([^/]+)$'), r'\1/{source}/{end}/{begin}'),
+    (re.compile(r'^(/export/archive)/.+/([^/]+)/([^/]+)$'), r'\1/{source}/{begin}/{end}'),
+    (re.compile(r'/\d{8}T\d{6}(\.\d+)?(?=/|$)'), '/{ts}'),
+    (re.compile(r'/[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}'),
+     '/{uuid}'),
+    (re.compile(r'\.\d+(?=/|$)'), '.{n}'),
+    (re.compile(r'/\d+(?=/|$)'), '/{n}'),
+]
+
+
+def route_template(path):
+    """
+    Путь запроса -> шаблон маршрута: параметры запроса отбрасываются, а id, номера и отметки
+    времени в пути заменяются подстановками. Например,
+    `/archive/contents/intervals/NODE/DeviceIpint.3/SourceEndpoint.video:0:0/future/past` ->
+    `/archive/contents/intervals/{source}/{end}/{begin}`.
+    """
+    route = path.split('?', 1)[0]
+    for pattern, repl in _ROUTE_RULES:
+        route = pattern.sub(repl, route)
+    return route
+
+
+class LatencyHistogram(object):
+    """
+    Гистограмма с фиксированными корзинами: O(1) памяти, квантили оцениваются интерполяцией
+    внутри корзины.
+    """
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'min', 'max')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        assert self.buckets == other.buckets
+        for i, c in enumerate(other.counts):
+            self.counts[i] += c
+        self.count += other.count
+        self.sum += other.sum
+        for value in (other.min, other.max):
+            if value is not None:
+                self.min = value if self.min is None else min(self.min, value)
+                self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """
+        :param float q: 0..1
+        """
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, c in enumerate(self.counts):
+            if c and seen + c >= rank:
+                lower = self.buckets[i - 1] if i > 0 else self.min
+                upper = self.buckets[i] if i < len(self.buckets) else self.max
+                lower = max(lower, self.min)
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * (rank - seen) / c
+            seen += c
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'p99': self.quantile(0.99),
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+Inf'], self.counts)),
+        }
+
+
+class _RouteStats(object):
+    __slots__ = ('latency', 'bytes_in', 'bytes_out', 'status_codes', 'errors')
+
+    def __init__(self, buckets):
+        self.latency = LatencyHistogram(buckets)
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.status_codes = {}
+        self.errors = 0
+
+
+class RequestMetrics(object):
+    """
+    Потокобезопасный накопитель статистики запросов. Подключается к :class:`Connection` через
+    параметр `instrumentation`; годится любой объект с таким же методом :meth:`record`.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._stats = {}
+        self._counters = {}
+
+    def record(self, method, path, seconds, status_code=None, bytes_out=0, bytes_in=0,
+               error=False):
+        """
+        :param str path: Путь запроса; сводится к шаблону функцией :func:`route_template`.
+        :param int status_code: Код ответа или None, если ответа нет (ошибка соединения).
+        :param bool error: Запрос завершился исключением (сетевым или ошибкой сервера).
+        """
+        key = (method, route_template(path))
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _RouteStats(self.buckets)
+            stats.latency.add(seconds)
+            stats.bytes_out += bytes_out
+            stats.bytes_in += bytes_in
+            stats.status_codes[status_code] = stats.status_codes.get(status_code, 0) + 1
+            if error:
+                stats.errors += 1
+
+    def increment(self, name, node=None, value=1):
+        """
+        Прочие счетчики (например, повторы и срабатывания предохранителя из
+        :class:`ResiliencePolicy`).
+        """
+        key = (name, node)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def counters(self):
+        """
+        :return: `{имя: {узел: значение}}`.
+        """
+        with self._lock:
+            result = {}
+            for (name, node), value in self._counters.items():
+                result.setdefault(name, {})[node] = value
+            return result
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+            self._counters = {}
+
+    def snapshot(self):
+        """
+        :return: `{'GET /rsg/ipint': {...}, ...}`.
+        """
+        with self._lock:
+            routes = {}
+            for (method, route), stats in self._stats.items():
+                data = stats.latency.snapshot()
+                data.update({
+                    'bytes_in': stats.bytes_in,
+                    'bytes_out': stats.bytes_out,
+                    'status_codes': dict(stats.status_codes),
+                    'errors': stats.errors,
+                })
+                routes['{} {}'.format(method, route)] = data
+            return routes
+
+    def to_prometheus(self, prefix='axxon_http'):
+        """
+        Текстовый формат Prometheus (exposition format 0.0.4).
+        """
+        lines = []
+
+        def header(name, type_, help_):
+            lines.append('# HELP {}_{} {}'.format(prefix, name, help_))
+            lines.append('# TYPE {}_{} {}'.format(prefix, name, type_))
+
+        def labels(**kwargs):
+            return ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                            for k, v in sorted(kwargs.items()))
+
+        with self._lock:
+            items = sorted(self._stats.items())
+            counters = sorted(self._counters.items(), key=lambda i: (i[0][0], str(i[0][1])))
+
+            header('request_duration_seconds', 'histogram', 'Request latency.')
+            for (method, route), stats in items:
+                h = stats.latency
+                cumulative = 0
+                for le, c in zip([repr(float(b)) for b in h.buckets] + ['+Inf'], h.counts):
+                    cumulative += c
+                    lines.append('{}_request_duration_seconds_bucket{{{}}} {}'.format(
+                        prefix, labels(method=method, route=route, le=le), cumulative))
+                lines.append('{}_request_duration_seconds_sum{{{}}} {}'.format(
+                    prefix, labels(method=method, route=route), repr(h.sum)))
+                lines.append('{}_request_duration_seconds_count{{{}}} {}'.format(
+                    prefix, labels(method=method, route=route), h.count))
+
+            for name, attr, help_ in (('request_bytes_total', 'bytes_out', 'Request body bytes.'),
+                                      ('response_bytes_total', 'bytes_in', 'Response body bytes.'),
+                                      ('request_errors_total', 'errors', 'Failed requests.')):
+                header(name, 'counter', help_)
+                for (method, route), stats in items:
+                    lines.append('{}_{}{{{}}} {}'.format(
+                        prefix, name, labels(method=method, route=route), getattr(stats, attr)))
+
+            header('responses_total', 'counter', 'Responses by status code.')
+            for (method, route), stats in items:
+                for code, c in sorted(stats.status_codes.items(), key=lambda i: str(i[0])):
+                    lines.append('{}_responses_total{{{}}} {}'.format(
+                        prefix, labels(method=method, route=route,
+                                       code=code if code is not None else 'none'), c))
+
+            names = []
+            for (name, node), value in counters:
+                if name not in names:
+                    names.append(name)
+                    header('{}_total'.format(name), 'counter', 'Client counter.')
+                lines.append('{}_{}_total{{{}}} {}'.format(
+                    prefix, name, labels(node=node if node is not None else ''), value))
+        return '\n'.join(lines) + '\n'
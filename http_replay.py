@@ -0,0 +1,436 @@
+# -*- coding: utf-8 -*-
+"""
+Запись HTTP-запросов и ответов (параметр `capture` :class:`Connection`) и воспроизведение
+записанной сессии на другом сервере с отчетом о разнице времени ответа.
+
+    recorder = RequestRecorder('session.jsonl.gz')
+    api = RsgHttpApi(addr, port=8000, capture=recorder)
+    ...
+    recorder.close()
+
+    target = RsgHttpApi(other_addr, port=8000)
+    report = ReplayDriver(target, 'session.jsonl.gz', speed=4.0, concurrency=16).run()
+    print(report.format())
+
+Формат записи -- JSON lines в gzip, файл только дописывается (каждое открытие добавляет новый
+gzip-member, `gzip.open` читает их подряд).
+
+    python -m <package>.http_replay session.jsonl.gz --rsg host:8000 --speed 0
+"""
+
+import argparse
+import atexit
+import base64
+import gzip
+import heapq
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from .http_api import RsgHttpApi, WebHttpApi
+from .http_metrics import LatencyHistogram, route_template
+
+logger = logging.getLogger(__name__)
+
+
+def _encode_body(record, key, body):
+    """
+    Тело как текст (UTF-8) или, если это не текст, в base64 под ключом `<key>_b64`.
+    """
+    if body is None:
+        return
+    if not isinstance(body, bytes):
+        record[key] = body
+        return
+    try:
+        record[key] = body.decode('utf-8')
+    except UnicodeDecodeError:
+        record[key + '_b64'] = base64.b64encode(body).decode('ascii')
+
+
+def _decode_body(record, key):
+    if key + '_b64' in record:
+        return base64.b64decode(record[key + '_b64'])
+    body = record.get(key)
+    return body.encode('utf-8') if body is not None else None
+
+
+class RequestRecorder(object):
+    """
+    Запись пар запрос-ответ в файл. Подключается к :class:`Connection` через параметр `capture`;
+    один объект можно подключить к нескольким соединениям одного сервера.
+
+    Запись в файл (со сжатием) идет отдельным потоком, как в :class:`RSGRequestLogWriter`.
+    Тела потоковых ответов (`stream=True`) не записываются: на момент записи они не прочитаны.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path, record_responses=True, max_body=1024 * 1024, compresslevel=1):
+        """
+        :param str path: Файл записи; если он есть, записи добавляются в конец.
+        :param bool record_responses: Записывать тела ответов.
+        :param int max_body: Тела ответов длиннее (байт) не записываются.
+        :param int compresslevel: Уровень сжатия gzip.
+        """
+        self.path = path
+        self.record_responses = record_responses
+        self.max_body = max_body
+        self._fd = gzip.open(path, 'ab', compresslevel)
+        self._queue = queue.Queue()
+        self._closed = False
+        self.records = 0
+        self._thread = threading.Thread(target=self._run, name='RequestRecorder')
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.close)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def record(self, method, path, kwargs, r, start, error=None):
+        """
+        :param kwargs: Параметры запроса (`params`, `json`, `data`, `headers`, ...).
+        :param r: Ответ или None, если ответа нет.
+        :param error: Исключение, которым завершился запрос.
+        """
+        seconds = time.time() - start
+        if self._closed:
+            return
+        record = {
+            'time': start,
+            'seconds': seconds,
+            'method': method,
+            'path': path,
+        }
+        params = kwargs.get('params')
+        if params:
+            record['params'] = params if isinstance(params, dict) else list(params)
+        if kwargs.get('headers'):
+            record['headers'] = dict(kwargs['headers'])
+        if kwargs.get('json') is not None:
+            record['json'] = kwargs['json']
+        data = kwargs.get('data')
+        if isinstance(data, dict):
+            record['form'] = data
+        elif data is not None and not hasattr(data, 'read'):
+            _encode_body(record, 'data', data)
+        if kwargs.get('stream'):
+            record['stream'] = True
+        if r is not None:
+            record['status_code'] = r.status_code
+            if (self.record_responses and not kwargs.get('stream') and
+                    len(r.content or b'') <= self.max_body):
+                _encode_body(record, 'response', r.content)
+        if error is not None:
+            record['error'] = type(error).__name__
+        try:
+            line = json.dumps(record, separators=(',', ':'))
+        except (TypeError, ValueError) as e:
+            logger.error('Can\'t record {} {}: {}'.format(method, path, e))
+            return
+        self._queue.put(line)
+
+    def close(self, timeout=None):
+        """
+        Дописывает в файл все накопленные записи и закрывает его.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            lines = [self._queue.get()]
+            while True:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = lines[-1] is self._STOP
+            lines = [line for line in lines if line is not self._STOP]
+            if lines:
+                self._fd.write(('\n'.join(lines) + '\n').encode('utf-8'))
+                self.records += len(lines)
+            if stop:
+                self._fd.close()
+                return
+
+
+def iter_captured(path, reorder_window=1000):
+    """
+    Записи файла :class:`RequestRecorder` по возрастанию времени начала запроса.
+
+    Записи попадают в файл в порядке завершения запросов; порядок начала восстанавливается
+    в скользящем окне из `reorder_window` записей, т.е. файл целиком в память не читается.
+    """
+    heap = []
+    n = 0
+    with gzip.open(path, 'rb') as fd:
+        for line in fd:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line.decode('utf-8'))
+            heapq.heappush(heap, (record['time'], n, record))
+            n += 1
+            if len(heap) > reorder_window:
+                yield heapq.heappop(heap)[2]
+    while heap:
+        yield heapq.heappop(heap)[2]
+
+
+class _ReplayStats(object):
+    __slots__ = ('original', 'replay', 'status_mismatches', 'response_mismatches', 'errors')
+
+    def __init__(self):
+        self.original = LatencyHistogram()
+        self.replay = LatencyHistogram()
+        self.status_mismatches = 0
+        self.response_mismatches = 0
+        self.errors = 0
+
+
+class ReplayReport(object):
+    """
+    Сравнение воспроизведения с исходной записью по маршрутам (`'GET /rsg/ipint'`, см.
+    :func:`route_template`).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+        self.lag = LatencyHistogram()
+        self.started = None
+        self.finished = None
+        self.original_seconds = 0.0
+
+    def add(self, record, status_code, seconds, error=None, response_mismatch=False):
+        key = '{} {}'.format(record['method'], route_template(record['path']))
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = _ReplayStats()
+            stats.original.add(record['seconds'])
+            stats.replay.add(seconds)
+            if status_code != record.get('status_code'):
+                stats.status_mismatches += 1
+            if response_mismatch:
+                stats.response_mismatches += 1
+            if error is not None:
+                stats.errors += 1
+
+    def add_lag(self, seconds):
+        """
+        Насколько позже расписания отправлен запрос (при воспроизведении с темпом записи).
+        """
+        with self._lock:
+            self.lag.add(seconds)
+
+    @property
+    def requests(self):
+        with self._lock:
+            return sum(s.replay.count for s in self._stats.values())
+
+    def summary(self):
+        """
+        :return: Маршрут -> число запросов, квантили времени ответа в записи и при
+                 воспроизведении, их разность (`delta_p50` и т.д., воспроизведение минус запись),
+                 расхождения кодов ответа и тел, ошибки.
+        """
+        result = {}
+        with self._lock:
+            for key, s in self._stats.items():
+                data = {
+                    'count': s.replay.count,
+                    'status_mismatches': s.status_mismatches,
+                    'response_mismatches': s.response_mismatches,
+                    'errors': s.errors,
+                }
+                for q, name in ((0.5, 'p50'), (0.95, 'p95'), (0.99, 'p99')):
+                    original = s.original.quantile(q)
+                    replay = s.replay.quantile(q)
+                    data['original_' + name] = original
+                    data['replay_' + name] = replay
+                    data['delta_' + name] = replay - original
+                result[key] = data
+        return result
+
+    def totals(self):
+        wall = (self.finished or time.time()) - self.started if self.started else 0.0
+        requests_ = self.requests
+        return {
+            'requests': requests_,
+            'seconds': wall,
+            'original_seconds': self.original_seconds,
+            'rps': requests_ / wall if wall > 0 else 0.0,
+            'lag_p50': self.lag.quantile(0.5),
+            'lag_max': self.lag.max,
+        }
+
+    def format(self):
+        lines = ['{:<56} {:>7} {:>10} {:>10} {:>10} {:>10} {:>6} {:>6}'.format(
+            'endpoint', 'count', 'orig p50', 'repl p50', 'orig p95', 'repl p95', 'codes', 'errs')]
+        for key, s in sorted(self.summary().items()):
+            lines.append('{:<56} {:>7} {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms {:>8.1f}ms {:>6} {:>6}'.format(
+                key, s['count'], s['original_p50'] * 1000, s['replay_p50'] * 1000,
+                s['original_p95'] * 1000, s['replay_p95'] * 1000, s['status_mismatches'],
+                s['errors']))
+        t = self.totals()
+        lines.append('\n{} requests in {:.2f} s ({:.1f} rps), original session took {:.2f} s'.format(
+            t['requests'], t['seconds'], t['rps'], t['original_seconds']))
+        if t['lag_max'] is not None:
+            lines.append('schedule lag: p50 {:.1f} ms, max {:.1f} ms'.format(
+                t['lag_p50'] * 1000, t['lag_max'] * 1000))
+        return '\n'.join(lines)
+
+
+class ReplayDriver(object):
+    def __init__(self, connection, capture_path, speed=1.0, concurrency=8,
+                 compare_responses=False, reorder_window=1000):
+        """
+        :param connection: Соединение с целевым сервером (:class:`RsgHttpApi` или
+                           :class:`WebHttpApi`, того же типа, что и при записи).
+        :param str capture_path: Файл :class:`RequestRecorder`.
+        :param float speed: Темп воспроизведения относительно записи: 1 -- как в исходной сессии,
+                            N -- в N раз быстрее. None или 0 -- без пауз, с максимальной
+                            пропускной способностью.
+        :param int concurrency: Сколько запросов может выполняться одновременно.
+        :param bool compare_responses: Сравнивать тела ответов с записанными (ответы с другими
+                                       id объектов и отметками времени считаются расхождением).
+        """
+        self.connection = connection
+        self.capture_path = capture_path
+        self.speed = speed or None
+        self.concurrency = concurrency
+        self.compare_responses = compare_responses
+        self.reorder_window = reorder_window
+
+    @staticmethod
+    def _request_kwargs(record):
+        kwargs = {}
+        if 'params' in record:
+            kwargs['params'] = record['params']
+        if 'headers' in record:
+            kwargs['headers'] = record['headers']
+        if record.get('stream'):
+            kwargs['stream'] = True
+        if 'json' in record:
+            kwargs['json'] = record['json']
+        elif 'form' in record:
+            kwargs['data'] = record['form']
+        else:
+            data = _decode_body(record, 'data')
+            if data is not None:
+                kwargs['data'] = data
+        return kwargs
+
+    def _replay_one(self, record, report):
+        start = time.time()
+        r = error = None
+        try:
+            r = self.connection._request(record['method'], record['path'],
+                                         self._request_kwargs(record))
+        except Exception as e:
+            # Кроме ServerError и сетевых ошибок разбор ответа может завершиться чем угодно
+            # (например, KeyError на ответе RSG без `Result`); воспроизведение продолжается.
+            r, error = getattr(e, 'response', None), e
+        seconds = time.time() - start
+        if record.get('stream') and r is not None:
+            # Время потокового запроса, как и при записи, -- до получения заголовков. Тело
+            # читается, как в исходной сессии, но не хранится.
+            try:
+                for _ in r.iter_content(1024 * 1024):
+                    pass
+            except Exception as e:
+                error = error or e
+            finally:
+                r.close()
+        mismatch = False
+        if self.compare_responses and r is not None:
+            original = _decode_body(record, 'response')
+            mismatch = original is not None and original != r.content
+        report.add(record, r.status_code if r is not None else None, seconds, error, mismatch)
+
+    def run(self, limit=None):
+        """
+        Воспроизводит записанную сессию.
+
+        :param int limit: Воспроизвести только первые `limit` запросов.
+        :return type: :class:`ReplayReport`
+        """
+        report = ReplayReport()
+        ensure_pool_size = getattr(self.connection, '_ensure_pool_size', None)
+        if ensure_pool_size is not None:
+            ensure_pool_size(self.concurrency)
+        # Очередь исполнителя ограничена, чтобы не читать запись вперед расписания.
+        slots = threading.BoundedSemaphore(self.concurrency * 2)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        first = last = None
+        report.started = time.time()
+        try:
+            for n, record in enumerate(iter_captured(self.capture_path, self.reorder_window)):
+                if limit is not None and n >= limit:
+                    break
+                if first is None:
+                    first = record['time']
+                last = max(last or 0, record['time'] + record['seconds'])
+                if self.speed is not None:
+                    due = report.started + (record['time'] - first) / self.speed
+                    delay = due - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                slots.acquire()
+                if self.speed is not None:
+                    report.add_lag(max(time.time() - due, 0))
+                future = executor.submit(self._replay_one, record, report)
+                future.add_done_callback(lambda f: slots.release())
+        finally:
+            executor.shutdown(wait=True)
+        report.finished = time.time()
+        report.original_seconds = last - first if first is not None else 0.0
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a captured HTTP session.')
+    parser.add_argument('capture', help='file written by RequestRecorder')
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--rsg', metavar='HOST:PORT', help='replay against RSG')
+    target.add_argument('--web', metavar='HOST:PORT', help='replay against Web API')
+    parser.add_argument('--prefix', default=None, help='Web API prefix')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='pacing multiplier; 0 -- as fast as possible')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--compare-responses', action='store_true')
+    args = parser.parse_args(argv)
+
+    addr, port = (args.rsg or args.web).rsplit(':', 1)
+    if args.rsg:
+        connection = RsgHttpApi(addr, port=int(port))
+    else:
+        connection = WebHttpApi(addr, port=int(port), prefix=args.prefix)
+    driver = ReplayDriver(connection, args.capture, speed=args.speed,
+                          concurrency=args.concurrency, compare_responses=args.compare_responses)
+    try:
+        report = driver.run(limit=args.limit)
+    finally:
+        connection.close()
+    print(report.format())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,304 @@
+# -*- coding: utf-8 -*-
+"""
+Политики устойчивости HTTP-клиента: таймауты по маршрутам, повторы с экспоненциальной
+задержкой и случайным разбросом, предохранитель (circuit breaker) на каждый узел и
+настройки пула соединений.
+
+    policy = ResiliencePolicy(timeouts={'/archive/contents/intervals': 120},
+                              retry=RetryPolicy(max_attempts=4))
+    api = WebHttpApi(addr, port=80, resilience=policy)
+    ...
+    print(policy.counters())
+"""
+
+import logging
+import random
+import threading
+import time
+
+import requests
+
+from .http_metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+RETRY_STATUSES = frozenset([500, 502, 503, 504])
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """
+    Запрос не отправлялся: предохранитель узла разомкнут после серии ошибок.
+    """
+
+
+class RetryPolicy(object):
+    def __init__(self, max_attempts=3, backoff=0.2, max_backoff=10.0, methods=IDEMPOTENT_METHODS,
+                 statuses=RETRY_STATUSES):
+        """
+        :param int max_attempts: Всего попыток, включая первую. 1 -- без повторов.
+        :param float backoff: Базовая задержка (сек.); перед n-м повтором ждем случайное время
+                              из `[0, min(max_backoff, backoff * 2 ** (n - 1))]` ("full jitter").
+        :param methods: Методы, которые можно повторять при любой ошибке. Остальные (POST)
+                        повторяются, только если соединение не удалось установить и запрос
+                        заведомо не дошел до сервера.
+        :param statuses: Коды ответа, при которых запрос повторяется.
+        """
+        assert max_attempts >= 1
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.methods = frozenset(methods)
+        self.statuses = frozenset(statuses)
+
+    def delay(self, attempt, response=None):
+        """
+        :param int attempt: Номер неудавшейся попытки, начиная с 1.
+        :param response: Ответ сервера, если он был; учитывается заголовок `Retry-After`.
+        """
+        cap = min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        delay = random.uniform(0, cap)
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                delay = max(delay, min(float(retry_after), self.max_backoff))
+            except ValueError:
+                pass
+        return delay
+
+    def should_retry(self, method, error, status_code):
+        """
+        :param error: Исключение, которым завершилась попытка.
+        :param status_code: Код ответа или None, если ответа нет.
+        """
+        if isinstance(error, CircuitOpenError):
+            return False
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if method not in self.methods:
+            return False
+        if status_code is not None:
+            return status_code in self.statuses
+        return isinstance(error, (requests.exceptions.ConnectionError,
+                                  requests.exceptions.Timeout))
+
+
+class CircuitBreaker(object):
+    """
+    После `failure_threshold` ошибок подряд предохранитель размыкается, и запросы к узлу сразу
+    завершаются :class:`CircuitOpenError`. Через `reset_timeout` секунд пропускается один пробный
+    запрос: при успехе предохранитель замыкается, при ошибке -- снова размыкается.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = None
+        self._probe_in_flight = False
+
+    @property
+    def state(self):
+        with self._lock:
+            if self._state == self.OPEN and time.time() - self._opened_at >= self.reset_timeout:
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self):
+        """
+        :return: Можно ли отправлять запрос.
+        """
+        with self._lock:
+            if self._state == self.CLOSED:
+                return True
+            if self._probe_in_flight or time.time() - self._opened_at < self.reset_timeout:
+                return False
+            self._state = self.HALF_OPEN
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """
+        :return: True, если предохранитель только что разомкнулся.
+        """
+        with self._lock:
+            self._failures += 1
+            self._probe_in_flight = False
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                tripped = self._state != self.OPEN
+                self._state = self.OPEN
+                self._opened_at = time.time()
+                return tripped
+            return False
+
+
+class ResiliencePolicy(object):
+    """
+    Подключается к :class:`Connection` через параметр `resilience`. Один объект можно
+    использовать для нескольких соединений: предохранители и счетчики ведутся по узлам
+    (`адрес:порт`).
+
+    Счетчики: `attempts`, `retries`, `timeouts`, `connection_errors`, `server_errors`,
+    `rejected` (запрос не отправлен, предохранитель разомкнут), `trips` (размыкания).
+    Если у сборщика статистики соединения есть метод `increment` (как у
+    :class:`RequestMetrics`), счетчики передаются и ему.
+    """
+
+    COUNTERS = ('attempts', 'retries', 'timeouts', 'connection_errors', 'server_errors',
+                'rejected', 'trips')
+
+    def __init__(self, timeout=(5.0, 60.0), timeouts=None, retry=None, failure_threshold=5,
+                 reset_timeout=30.0, pool_connections=10, pool_maxsize=10, pool_block=False):
+        """
+        :param timeout: Таймаут по умолчанию: секунды или кортеж (соединение, чтение), как в
+                        requests. None -- ждать бесконечно.
+        :param dict timeouts: Таймауты по маршрутам: префикс пути или шаблон маршрута (см.
+                              :func:`route_template`) -> таймаут. Выбирается самый длинный
+                              подходящий префикс. Явный `timeout=` в вызове важнее.
+        :param RetryPolicy retry: По умолчанию -- `RetryPolicy()`.
+        :param int failure_threshold: Ошибок подряд до размыкания предохранителя; None -- без
+                                      предохранителя.
+        :param float reset_timeout: Через сколько секунд пробовать разомкнутый узел снова.
+        :param pool_connections: См. `requests.adapters.HTTPAdapter`.
+        :param pool_maxsize: См. `requests.adapters.HTTPAdapter`.
+        :param pool_block: См. `requests.adapters.HTTPAdapter`.
+        """
+        self.timeout = timeout
+        self.timeouts = sorted((timeouts or {}).items(), key=lambda i: len(i[0]), reverse=True)
+        self.retry = retry if retry is not None else RetryPolicy()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.pool_block = pool_block
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._counters = {}
+
+    def mount(self, session):
+        """
+        Устанавливает в `session` адаптер с настройками пула соединений.
+        """
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_connections,
+                                                pool_maxsize=self.pool_maxsize,
+                                                pool_block=self.pool_block)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+    def timeout_for(self, path):
+        if self.timeouts:
+            route = route_template(path)
+            for prefix, timeout in self.timeouts:
+                if path.startswith(prefix) or route.startswith(prefix):
+                    return timeout
+        return self.timeout
+
+    def breaker(self, node):
+        if self.failure_threshold is None:
+            return None
+        with self._lock:
+            breaker = self._breakers.get(node)
+            if breaker is None:
+                breaker = self._breakers[node] = CircuitBreaker(self.failure_threshold,
+                                                                self.reset_timeout)
+            return breaker
+
+    def _count(self, connection, node, name):
+        with self._lock:
+            key = (node, name)
+            self._counters[key] = self._counters.get(key, 0) + 1
+        increment = getattr(connection.instrumentation, 'increment', None)
+        if increment is not None:
+            increment(name, node=node)
+
+    def counters(self):
+        """
+        :return: `{узел: {счетчик: значение}}`.
+        """
+        with self._lock:
+            result = {}
+            for (node, name), value in self._counters.items():
+                result.setdefault(node, dict.fromkeys(self.COUNTERS, 0))[name] = value
+            return result
+
+    def states(self):
+        """
+        :return: `{узел: состояние предохранителя}`.
+        """
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {node: breaker.state for node, breaker in breakers}
+
+    def call(self, connection, method, path, kwargs):
+        """
+        Выполняет запрос через `connection._send` с учетом таймаутов, повторов и предохранителя.
+        """
+        node = '{}:{}'.format(connection.addr, connection.port)
+        if kwargs.get('timeout') is None:
+            kwargs = dict(kwargs, timeout=self.timeout_for(path))
+        breaker = self.breaker(node)
+        attempt = 0
+        while True:
+            attempt += 1
+            if breaker is not None and not breaker.allow():
+                self._count(connection, node, 'rejected')
+                raise CircuitOpenError('Circuit breaker for {} is open, {} {} is not sent'.format(
+                    node, method, path))
+            self._count(connection, node, 'attempts')
+            try:
+                r = connection._send(method, path, kwargs)
+            except Exception as e:
+                status_code = getattr(e, 'status_code', None)
+                if status_code is None:
+                    # Например, requests.HTTPError: код есть только у ответа.
+                    status_code = getattr(getattr(e, 'response', None), 'status_code', None)
+                failed = self._classify(connection, node, e, status_code)
+                if breaker is not None:
+                    if failed:
+                        if breaker.record_failure():
+                            self._count(connection, node, 'trips')
+                            logger.warning('Circuit breaker for {} is open after: {}'.format(
+                                node, type(e).__name__))
+                    else:
+                        breaker.record_success()
+                if attempt >= self.retry.max_attempts or not self.retry.should_retry(
+                        method, e, status_code):
+                    raise
+                delay = self.retry.delay(attempt, getattr(e, 'response', None))
+                self._count(connection, node, 'retries')
+                logger.debug('{} {} failed ({}), retry {} in {:.2f} s'.format(
+                    method, path, type(e).__name__, attempt, delay))
+                time.sleep(delay)
+                continue
+            if breaker is not None:
+                breaker.record_success()
+            return r
+
+    def _classify(self, connection, node, error, status_code):
+        """
+        Учитывает ошибку в счетчиках.
+
+        :return: Считать ли ее отказом узла (для предохранителя).
+        """
+        if isinstance(error, requests.exceptions.Timeout):
+            self._count(connection, node, 'timeouts')
+            return True
+        if isinstance(error, requests.exceptions.ConnectionError):
+            self._count(connection, node, 'connection_errors')
+            return True
+        if status_code is not None and status_code >= 500:
+            self._count(connection, node, 'server_errors')
+            return True
+        return False
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+Параллельный импорт (репликация) архива для многих пар камера-архив.
+
+    orchestrator = ImportOrchestrator(rsg_api, max_concurrent=16)
+    for camera in cameras:
+        orchestrator.submit(camera, archive, begin_time, end_time)
+    orchestrator.wait()
+    print(orchestrator.report())
+    orchestrator.close()
+
+Одновременно на сервере выполняется не больше `max_concurrent` репликаций, остальные ждут
+в очереди. Все токены опрашиваются из одного потока-планировщика; интервал опроса каждого
+подстраивается под оценку оставшегося времени (как в :class:`ExportJobManager`).
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, wait
+
+import requests
+
+from .http_api import ServerError, adaptive_poll_interval
+
+logger = logging.getLogger(__name__)
+
+
+class ImportTaskError(RuntimeError):
+    pass
+
+
+class ImportTask(object):
+    """
+    Репликация одной камеры в архив. Результат задачи -- токен репликации.
+
+    :ivar str state: `pending`, `running`, `done` или `failed`.
+    :ivar float progress: Последний полученный прогресс (0..1).
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, camera, archive, begin_time, end_time, timeout):
+        self.camera = camera
+        self.archive = archive
+        self.begin_time = begin_time
+        self.end_time = end_time
+        self.timeout = timeout
+        self.token = None
+        self.state = self.PENDING
+        self.progress = 0.0
+        self.started = None
+        self.finished = None
+        self.next_poll = None
+        self.poll_errors = 0
+        self.future = Future()
+
+    def __repr__(self):
+        return '{}({!r}, {!r})'.format(type(self).__name__, self.camera, self.token)
+
+    @property
+    def footage(self):
+        """
+        Длина импортируемого отрезка (в единицах `begin_time`/`end_time`).
+        """
+        return self.end_time - self.begin_time
+
+    @property
+    def elapsed(self):
+        if self.started is None:
+            return 0.0
+        return (self.finished or time.time()) - self.started
+
+    @property
+    def throughput(self):
+        """
+        Скорость импорта: единиц `begin_time`/`end_time` в секунду.
+        """
+        elapsed = self.elapsed
+        return self.footage * self.progress / elapsed if elapsed > 0 else 0.0
+
+    @property
+    def eta(self):
+        """
+        Оценка оставшегося времени (сек.) или None, пока прогресса нет.
+        """
+        if self.state == self.DONE:
+            return 0.0
+        if self.progress <= 0:
+            return None
+        return (1.0 - self.progress) / self.progress * self.elapsed
+
+    def done(self):
+        return self.future.done()
+
+    def result(self, timeout=None):
+        return self.future.result(timeout)
+
+    def add_done_callback(self, fn):
+        """
+        :param fn: Вызывается с объектом задачи, когда она завершится (в т.ч. с ошибкой).
+        """
+        self.future.add_done_callback(lambda future: fn(self))
+
+    def summary(self):
+        return {
+            'camera': str(self.camera),
+            'token': self.token,
+            'state': self.state,
+            'progress': self.progress,
+            'elapsed': self.elapsed,
+            'eta': self.eta,
+            'throughput': self.throughput,
+        }
+
+
+class ImportOrchestrator(object):
+    def __init__(self, api, max_concurrent=8, min_interval=1.0, max_interval=30.0,
+                 max_poll_errors=3):
+        """
+        :param api: :class:`RsgHttpApi`
+        :param int max_concurrent: Сколько репликаций может выполняться на сервере одновременно.
+        :param float min_interval: Минимальный интервал (сек.) между опросами одного токена.
+        :param float max_interval: Максимальный интервал (сек.) между опросами одного токена.
+        :param int max_poll_errors: Сколько ошибок опроса подряд допускается, прежде чем задача
+                                    считается неудавшейся (репликация на сервере при этом
+                                    продолжается).
+        """
+        self.api = api
+        self.max_concurrent = max_concurrent
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_poll_errors = max_poll_errors
+        self.tasks = []
+        self._pending = deque()
+        self._running = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._cancelled = False
+        self._started = None
+        self._thread = threading.Thread(target=self._run, name='ImportOrchestrator')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, camera, archive, begin_time, end_time, timeout=None, callback=None):
+        """
+        Ставит репликацию в очередь (см. :meth:`RsgHttpApi.start_import`).
+
+        :param float timeout: Максимальное время (сек.) от старта репликации до ее завершения.
+                              Отмены репликации в RSG нет, поэтому по истечении времени задача
+                              только помечается неудавшейся.
+        :param callback: См. :meth:`ImportTask.add_done_callback`.
+        :return type: :class:`ImportTask`
+        """
+        task = ImportTask(camera, archive, begin_time, end_time, timeout)
+        if callback is not None:
+            task.add_done_callback(callback)
+        with self._lock:
+            if self._closed:
+                raise ImportTaskError('ImportOrchestrator is closed')
+            self.tasks.append(task)
+            self._pending.append(task)
+        self._wakeup.set()
+        return task
+
+    def wait(self, timeout=None):
+        """
+        Ждет завершения всех поставленных задач.
+
+        :return: Списки завершенных и незавершенных задач.
+        """
+        with self._lock:
+            tasks = list(self.tasks)
+        futures = {task.future: task for task in tasks}
+        done, not_done = wait(list(futures), timeout=timeout)
+        return [futures[f] for f in done], [futures[f] for f in not_done]
+
+    def close(self, cancel=False):
+        """
+        Останавливает планировщик. Если `cancel` истинно, задачи из очереди отменяются, а уже
+        запущенные завершаются ошибкой :class:`ImportTaskError` (репликации на сервере
+        продолжаются, но больше не опрашиваются); иначе вызов ждет завершения всех задач.
+        """
+        if cancel:
+            with self._lock:
+                self._cancelled = True
+                pending, self._pending = list(self._pending), deque()
+            for task in pending:
+                # Без notify wait() не считает отмененный Future завершенным.
+                task.future.cancel()
+                task.future.set_running_or_notify_cancel()
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join()
+        if cancel:
+            # Запущенные задачи нельзя отменить через future.cancel(): завершаем их сами, иначе
+            # result() и wait() ждали бы их вечно.
+            with self._lock:
+                running, self._running = list(self._running), []
+            for task in running:
+                if not task.done():
+                    self._fail(task, ImportTaskError('Import {} is cancelled at progress {}'.format(
+                        task, task.progress)))
+
+    def report(self):
+        """
+        Сводка: число задач по состояниям, общий прогресс (взвешенный по длине отрезков), оценка
+        оставшегося времени, суммарная скорость и сводки задач (см. :meth:`ImportTask.summary`).
+        """
+        with self._lock:
+            tasks = list(self.tasks)
+        counts = dict.fromkeys([ImportTask.PENDING, ImportTask.RUNNING, ImportTask.DONE,
+                                ImportTask.FAILED], 0)
+        for task in tasks:
+            counts[task.state] += 1
+        total_footage = sum(task.footage for task in tasks)
+        progress = (sum(task.footage * task.progress for task in tasks) / float(total_footage)
+                    if total_footage else 0.0)
+        elapsed = time.time() - self._started if self._started is not None else 0.0
+        eta = (1.0 - progress) / progress * elapsed if progress > 0 else None
+        return {
+            'tasks': len(tasks),
+            'states': counts,
+            'progress': progress,
+            'elapsed': elapsed,
+            'eta': eta,
+            'throughput': sum(task.throughput for task in tasks
+                              if task.state == ImportTask.RUNNING),
+            'details': [task.summary() for task in tasks],
+        }
+
+    def _run(self):
+        try:
+            self._schedule()
+        except Exception as e:
+            # Без планировщика задачи никогда не завершатся: завершаем их ошибкой.
+            logger.exception('ImportOrchestrator scheduler failed')
+            with self._lock:
+                self._closed = True
+                tasks = list(self._pending) + list(self._running)
+                self._pending, self._running = deque(), []
+            for task in tasks:
+                if not task.done():
+                    self._fail(task, e)
+
+    def _schedule(self):
+        while True:
+            if self._cancelled:
+                return
+            self._start_pending()
+            with self._lock:
+                running = list(self._running)
+                idle = not running and not self._pending
+            if (idle and self._closed) or self._cancelled:
+                return
+            now = time.time()
+            for task in running:
+                if task.next_poll <= now:
+                    try:
+                        self._poll(task)
+                    except Exception as e:
+                        logger.exception('Error polling import {}'.format(task))
+                        self._finish(task)
+                        if not task.done():
+                            self._fail(task, e)
+            with self._lock:
+                wakeups = [task.next_poll for task in self._running]
+            if self._pending and len(wakeups) < self.max_concurrent:
+                continue
+            timeout = max(min(wakeups) - time.time(), 0) if wakeups else None
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def _start_pending(self):
+        while True:
+            with self._lock:
+                if (self._cancelled or not self._pending or
+                        len(self._running) >= self.max_concurrent):
+                    return
+                task = self._pending.popleft()
+            if not task.future.set_running_or_notify_cancel():
+                continue
+            try:
+                task.token = self.api.start_import(task.camera, task.archive,
+                                                   task.begin_time, task.end_time)
+            except (ServerError, requests.exceptions.RequestException) as e:
+                logger.error('Can\'t start import for {}: {}'.format(task.camera, e))
+                self._fail(task, e)
+                continue
+            except Exception as e:
+                logger.exception('Error starting import for {}'.format(task.camera))
+                self._fail(task, e)
+                continue
+            task.state = ImportTask.RUNNING
+            task.started = task.next_poll = time.time()
+            if self._started is None:
+                self._started = task.started
+            with self._lock:
+                self._running.append(task)
+
+    def _poll(self, task):
+        try:
+            progress = self.api.get_import_progress(task.token)
+        except (ServerError, requests.exceptions.RequestException) as e:
+            task.poll_errors += 1
+            logger.warning('Can\'t get import progress for {} ({} in a row): {}'.format(
+                task, task.poll_errors, e))
+            if task.poll_errors >= self.max_poll_errors:
+                self._finish(task)
+                self._fail(task, e)
+                return
+        else:
+            task.poll_errors = 0
+            # Неразборчивый ответ (например, None) -- ошибка задачи, а не планировщика.
+            task.progress = float(progress)
+
+        if task.progress >= 1.0:
+            self._finish(task)
+            task.state = ImportTask.DONE
+            logger.debug('Import {} has been finished in {:.1f} s'.format(task, task.elapsed))
+            task.future.set_result(task.token)
+            return
+        if task.timeout is not None and task.elapsed > task.timeout:
+            self._finish(task)
+            self._fail(task, ImportTaskError('Import {} timed out at progress {}'.format(
+                task, task.progress)))
+            return
+        task.next_poll = time.time() + adaptive_poll_interval(
+            task.progress, task.elapsed, self.min_interval, self.max_interval)
+        if task.timeout is not None:
+            task.next_poll = min(task.next_poll, task.started + task.timeout)
+
+    def _finish(self, task):
+        task.finished = time.time()
+        with self._lock:
+            if task in self._running:
+                self._running.remove(task)
+
+    def _fail(self, task, error):
+        task.state = ImportTask.FAILED
+        if task.finished is None:
+            task.finished = time.time()
+        task.future.set_exception(error)
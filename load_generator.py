@@ -0,0 +1,465 @@
+# -*- coding: utf-8 -*-
+"""
+Нагрузочные прогоны по декларативному сценарию: создание камер, детекторов и привязок к архивам
+через RSG из пула потоков с заданным темпом, замер пропускной способности и времени каждой
+операции и параллельный замер загрузки процессора сервера.
+
+Сценарий -- JSON (или YAML, если установлен PyYAML):
+
+    {
+        "name": "200 cameras, mixed detectors",
+        "cameras": 200,
+        "video_clips_folder": "D:/clips",
+        "detectors": {"situation": 1, "lpr": 0.5, "face": 0.25},
+        "archives": [{"file": "D:/archives/a1.afs", "size": 50}],
+        "permanent_write": true,
+        "ramp_up": 2.0,
+        "duration": 900,
+        "workers": 8,
+        "cpu_interval": 5.0,
+        "cleanup": true
+    }
+
+`detectors` -- сколько детекторов каждого вида создается на камеру; дробное число задает долю
+камер (0.25 -- на каждой четвертой). `ramp_up` -- сколько камер в секунду начинает создаваться
+(null -- все сразу). `duration` -- длительность прогона (сек.): после нее новые камеры,
+детекторы и привязки не создаются (уже отправленные запросы завершаются, пропущенное
+учитывается в отчете как `skipped`), а если камеры созданы раньше, до ее конца продолжается
+замер загрузки сервера.
+`archives` -- создаваемые архивы или строка "existing" (привязывать к имеющимся).
+
+    generator = LoadGenerator(rsg_api, LoadScenario.load('scenario.json'), web_api=web_api)
+    report = generator.run()
+    print(report.format())
+
+    python -m <package>.load_generator scenario.json --rsg host:8000 --web host:80 -o report.json
+"""
+
+import argparse
+import json
+import logging
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    # Необязательная зависимость: сценарии в YAML.
+    import yaml
+except ImportError:
+    yaml = None
+
+from .http_api import (FACE_DETECTION_DETECTOR, LICENSE_PLATES_RECOGNITION_DETECTOR,
+                       SITUATION_ANALYSIS_DETECTOR, RsgHttpApi, WebHttpApi)
+from .http_metrics import LatencyHistogram
+
+logger = logging.getLogger(__name__)
+
+DETECTORS = {
+    'situation': SITUATION_ANALYSIS_DETECTOR,
+    'lpr': LICENSE_PLATES_RECOGNITION_DETECTOR,
+    'face': FACE_DETECTION_DETECTOR,
+}
+
+# Операции RSG длятся от десятков миллисекунд до минут (flush при сотнях объектов).
+OPERATION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5, 10.0, 15.0,
+                     20.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class ScenarioError(ValueError):
+    pass
+
+
+class LoadScenario(object):
+    DEFAULTS = {
+        'name': 'load',
+        'cameras': 1,
+        'video_clips_folder': None,
+        'detectors': {},
+        'archives': [],
+        'permanent_write': True,
+        'ramp_up': None,
+        'duration': None,
+        'workers': 4,
+        'cpu_interval': 5.0,
+        'cleanup': False,
+    }
+
+    def __init__(self, **kwargs):
+        unknown = set(kwargs) - set(self.DEFAULTS)
+        if unknown:
+            raise ScenarioError('Unknown scenario keys: {}'.format(sorted(unknown)))
+        for key, default in self.DEFAULTS.items():
+            setattr(self, key, kwargs.get(key, default))
+
+        if int(self.cameras) < 0:
+            raise ScenarioError('cameras must be >= 0')
+        self.cameras = int(self.cameras)
+        for kind, per_camera in self.detectors.items():
+            if kind not in DETECTORS:
+                raise ScenarioError('Unknown detector kind {!r}, expected one of {}'.format(
+                    kind, sorted(DETECTORS)))
+            if per_camera < 0:
+                raise ScenarioError('Detector count for {!r} must be >= 0'.format(kind))
+        if self.archives != 'existing' and not isinstance(self.archives, list):
+            raise ScenarioError('archives must be a list or "existing"')
+        for key in ('ramp_up', 'duration', 'cpu_interval'):
+            value = getattr(self, key)
+            if value is not None and value <= 0:
+                raise ScenarioError('{} must be > 0'.format(key))
+
+    @classmethod
+    def load(cls, path):
+        """
+        Сценарий из JSON-файла или, если расширение `.yaml`/`.yml`, из YAML.
+        """
+        with open(path) as fd:
+            if path.endswith(('.yaml', '.yml')):
+                if yaml is None:
+                    raise ScenarioError('PyYAML is required to load {}'.format(path))
+                data = yaml.safe_load(fd)
+            else:
+                data = json.load(fd)
+        return cls(**data)
+
+    def to_dict(self):
+        return {key: getattr(self, key) for key in self.DEFAULTS}
+
+    @staticmethod
+    def detector_data(kind):
+        """
+        :param str kind: Ключ :data:`DETECTORS`.
+        """
+        return dict(DETECTORS[kind])
+
+    def detectors_for(self, index):
+        """
+        Виды детекторов для камеры номер `index`. Дробные количества распределяются по камерам
+        равномерно: при 0.25 детектор получает каждая четвертая камера.
+        """
+        result = []
+        for kind, per_camera in sorted(self.detectors.items()):
+            count = int(math.floor((index + 1) * per_camera) - math.floor(index * per_camera))
+            result.extend([kind] * count)
+        return result
+
+
+class _OperationStats(object):
+    __slots__ = ('latency', 'errors', 'first_start', 'last_end')
+
+    def __init__(self):
+        self.latency = LatencyHistogram(OPERATION_BUCKETS)
+        self.errors = 0
+        self.first_start = None
+        self.last_end = None
+
+
+class LoadReport(object):
+    """
+    Итоги прогона: по операциям (`create_camera`, `create_detector:lpr`,
+    `bind_camera_to_archive`, ...) -- число, ошибки, операций в секунду (за время от начала
+    первой до конца последней операции этого вида) и квантили времени; выборки загрузки
+    процессора сервера.
+    """
+
+    MAX_ERRORS = 50
+
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self._lock = threading.Lock()
+        self._operations = {}
+        self.cpu_samples = []
+        self.errors = []
+        self.created = {'cameras': 0, 'detectors': 0, 'archives': 0, 'bindings': 0}
+        # Не созданные из-за окончания `duration`.
+        self.skipped = {'cameras': 0, 'detectors': 0, 'bindings': 0}
+        self.started = None
+        self.finished = None
+
+    def add(self, operation, start, seconds, error=None):
+        with self._lock:
+            stats = self._operations.get(operation)
+            if stats is None:
+                stats = self._operations[operation] = _OperationStats()
+            stats.latency.add(seconds)
+            if stats.first_start is None or start < stats.first_start:
+                stats.first_start = start
+            end = start + seconds
+            if stats.last_end is None or end > stats.last_end:
+                stats.last_end = end
+            if error is not None:
+                stats.errors += 1
+                if len(self.errors) < self.MAX_ERRORS:
+                    self.errors.append('{}: {}'.format(operation, error))
+
+    def add_cpu_sample(self, t, load):
+        with self._lock:
+            self.cpu_samples.append((t, load))
+
+    def count(self, kind):
+        with self._lock:
+            self.created[kind] += 1
+
+    def skip(self, kind, count=1):
+        with self._lock:
+            self.skipped[kind] += count
+
+    def operations(self):
+        result = {}
+        with self._lock:
+            for name, s in self._operations.items():
+                window = s.last_end - s.first_start
+                result[name] = {
+                    'count': s.latency.count,
+                    'errors': s.errors,
+                    'ops_per_s': s.latency.count / window if window > 0 else None,
+                    'mean': s.latency.sum / s.latency.count,
+                    'p50': s.latency.quantile(0.5),
+                    'p95': s.latency.quantile(0.95),
+                    'p99': s.latency.quantile(0.99),
+                    'max': s.latency.max,
+                }
+        return result
+
+    def cpu(self):
+        with self._lock:
+            loads = sorted(load for _, load in self.cpu_samples)
+        if not loads:
+            return None
+        return {
+            'samples': len(loads),
+            'min': loads[0],
+            'mean': sum(loads) / len(loads),
+            'p95': loads[min(int(len(loads) * 0.95), len(loads) - 1)],
+            'max': loads[-1],
+        }
+
+    def to_dict(self):
+        with self._lock:
+            samples = [[t - self.started, load] for t, load in self.cpu_samples]
+        return {
+            'scenario': self.scenario.to_dict(),
+            'started': self.started,
+            'seconds': (self.finished or time.time()) - self.started,
+            'created': dict(self.created),
+            'skipped': dict(self.skipped),
+            'operations': self.operations(),
+            'cpu': self.cpu(),
+            'cpu_samples': samples,
+            'errors': list(self.errors),
+        }
+
+    def save(self, path):
+        with open(path, 'w') as fd:
+            json.dump(self.to_dict(), fd, indent=4, sort_keys=True)
+
+    def format(self):
+        data = self.to_dict()
+        lines = ['{}: {:.1f} s, created {}'.format(self.scenario.name, data['seconds'],
+                                                   data['created'])]
+        if any(data['skipped'].values()):
+            lines.append('skipped after duration: {}'.format(data['skipped']))
+        lines.append('{:<36} {:>7} {:>6} {:>8} {:>9} {:>9} {:>9}'.format(
+            'operation', 'count', 'errors', 'ops/s', 'p50, s', 'p95, s', 'max, s'))
+        for name, s in sorted(data['operations'].items()):
+            lines.append('{:<36} {:>7} {:>6} {:>8} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+                name, s['count'], s['errors'],
+                '{:.2f}'.format(s['ops_per_s']) if s['ops_per_s'] is not None else '-',
+                s['p50'], s['p95'], s['max']))
+        if data['cpu'] is not None:
+            lines.append('server CPU: mean {mean:.0%}, p95 {p95:.0%}, max {max:.0%} '
+                         '({samples} samples)'.format(**data['cpu']))
+        for error in data['errors'][:10]:
+            lines.append('error: {}'.format(error))
+        return '\n'.join(lines)
+
+
+class LoadGenerator(object):
+    def __init__(self, api, scenario, web_api=None):
+        """
+        :param api: :class:`RsgHttpApi`
+        :param scenario: :class:`LoadScenario` или словарь с его параметрами.
+        :param web_api: :class:`WebHttpApi` для замера загрузки процессора (`get_cpu_load`).
+                        Если None, загрузка не замеряется.
+        """
+        self.api = api
+        self.scenario = scenario if isinstance(scenario, LoadScenario) else LoadScenario(**scenario)
+        self.web_api = web_api
+        self.cameras = []
+        self.archives = []
+        self._stop = threading.Event()
+        self._cameras_lock = threading.Lock()
+
+    def _timed(self, report, operation, function, *args, **kwargs):
+        start = time.time()
+        try:
+            result = function(*args, **kwargs)
+        except Exception as e:
+            report.add(operation, start, time.time() - start, error=e)
+            raise
+        report.add(operation, start, time.time() - start)
+        return result
+
+    def _sample_cpu(self, report):
+        while True:
+            try:
+                report.add_cpu_sample(time.time(), self.web_api.get_cpu_load())
+            except Exception as e:
+                logger.warning('Can\'t get CPU load: {}'.format(e))
+            if self._stop.wait(self.scenario.cpu_interval):
+                return
+
+    def _prepare_archives(self, report):
+        if self.scenario.archives == 'existing':
+            self.archives = list(self.api.get_archives())
+            return
+        for spec in self.scenario.archives:
+            archive = self._timed(report, 'create_archive', self.api.create_archive,
+                                  spec['file'], size=spec.get('size', 5),
+                                  should_format=spec.get('format', True))
+            self.archives.append(archive)
+            report.count('archives')
+
+    def _expired(self, deadline):
+        return self._stop.is_set() or (deadline is not None and time.time() >= deadline)
+
+    def _camera_pipeline(self, index, report, deadline=None):
+        """
+        Камера, ее детекторы и привязка. После `deadline` следующие шаги не выполняются.
+        """
+        s = self.scenario
+        if self._expired(deadline):
+            report.skip('cameras')
+            return
+        try:
+            camera = self._timed(report, 'create_camera', self.api.create_virtual_camera,
+                                 s.video_clips_folder)
+        except Exception as e:
+            logger.error('Can\'t create camera #{}: {}'.format(index, e))
+            return
+        report.count('cameras')
+        with self._cameras_lock:
+            self.cameras.append(camera)
+        kinds = s.detectors_for(index)
+        for n, kind in enumerate(kinds):
+            if self._expired(deadline):
+                report.skip('detectors', len(kinds) - n)
+                break
+            try:
+                self._timed(report, 'create_detector:{}'.format(kind), self.api.create_detector,
+                            s.detector_data(kind), camera)
+                report.count('detectors')
+            except Exception as e:
+                logger.error('Can\'t create {} detector for {}: {}'.format(kind, camera, e))
+        if self.archives:
+            if self._expired(deadline):
+                report.skip('bindings')
+                return
+            archive = self.archives[index % len(self.archives)]
+            try:
+                self._timed(report, 'bind_camera_to_archive', self.api.bind_camera_to_archive,
+                            camera, archive, permanent_write=s.permanent_write)
+                report.count('bindings')
+            except Exception as e:
+                logger.error('Can\'t bind {} to {}: {}'.format(camera, archive, e))
+
+    def run(self):
+        """
+        Выполняет сценарий.
+
+        :return type: :class:`LoadReport`
+        """
+        s = self.scenario
+        report = LoadReport(s)
+        report.started = time.time()
+        self._stop.clear()
+        sampler = None
+        if self.web_api is not None:
+            sampler = threading.Thread(target=self._sample_cpu, args=(report,),
+                                       name='LoadGeneratorCpu')
+            sampler.daemon = True
+            sampler.start()
+
+        deadline = report.started + s.duration if s.duration is not None else None
+        executor = ThreadPoolExecutor(max_workers=s.workers)
+        try:
+            self._prepare_archives(report)
+            ramp_start = time.time()
+            futures = []
+            for index in range(s.cameras):
+                if s.ramp_up is not None:
+                    delay = ramp_start + index / float(s.ramp_up) - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                if deadline is not None and time.time() >= deadline:
+                    logger.info('Duration is over, {} of {} cameras scheduled'.format(
+                        index, s.cameras))
+                    report.skip('cameras', s.cameras - index)
+                    break
+                futures.append(executor.submit(self._camera_pipeline, index, report, deadline))
+            for future in futures:
+                future.result()
+            if deadline is not None and sampler is not None:
+                # Камеры созданы раньше срока: до конца прогона замеряем загрузку под ними.
+                self._stop.wait(max(deadline - time.time(), 0))
+        finally:
+            self._stop.set()
+            executor.shutdown(wait=True)
+            if sampler is not None:
+                sampler.join()
+            report.finished = time.time()
+            if s.cleanup:
+                self.cleanup(report)
+        return report
+
+    def cleanup(self, report=None):
+        """
+        Удаляет созданные прогоном камеры (вместе с детекторами) и архивы.
+        """
+        for camera in self.cameras:
+            try:
+                if report is not None:
+                    self._timed(report, 'cleanup:delete_camera', self.api.delete_camera, camera)
+                else:
+                    self.api.delete_camera(camera)
+            except Exception as e:
+                logger.error('Can\'t delete {}: {}'.format(camera, e))
+        self.cameras = []
+        if self.scenario.archives != 'existing':
+            for archive in self.archives:
+                try:
+                    self.api.delete_archive(archive)
+                except Exception as e:
+                    logger.error('Can\'t delete {}: {}'.format(archive, e))
+        self.archives = []
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run an RSG provisioning load scenario.')
+    parser.add_argument('scenario', help='JSON or YAML scenario file')
+    parser.add_argument('--rsg', metavar='HOST:PORT', required=True)
+    parser.add_argument('--web', metavar='HOST:PORT', help='Web API for CPU sampling')
+    parser.add_argument('--prefix', default=None, help='Web API prefix')
+    parser.add_argument('-o', '--output', help='write the JSON report here')
+    args = parser.parse_args(argv)
+
+    scenario = LoadScenario.load(args.scenario)
+    addr, port = args.rsg.rsplit(':', 1)
+    api = RsgHttpApi(addr, port=int(port))
+    web_api = None
+    if args.web:
+        addr, port = args.web.rsplit(':', 1)
+        web_api = WebHttpApi(addr, port=int(port), prefix=args.prefix)
+    try:
+        report = LoadGenerator(api, scenario, web_api=web_api).run()
+    finally:
+        api.close()
+        if web_api is not None:
+            web_api.close()
+    print(report.format())
+    if args.output:
+        report.save(args.output)
+
+
+if __name__ == '__main__':
+    main()
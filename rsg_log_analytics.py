@@ -0,0 +1,287 @@
+# -*- coding: utf-8 -*-
+"""
+Анализ журнала RSG-запросов (таблица :class:`RSGRequestRecord`, см. параметр `log_db`
+:class:`RsgHttpApi`): квантили времени ответа по маршрутам, число запросов в секунду по окнам
+времени, доли ошибок и самые медленные запросы.
+
+Таблица читается порциями по первичному ключу, поэтому память не зависит от размера журнала.
+Несколько файлов журнала (например, нескольких прогонов) анализируются вместе.
+
+    analyzer = RequestLogAnalyzer(['run1.db', 'run2.db'])
+    for route, stats in sorted(analyzer.endpoint_stats().items()):
+        print(route, stats['p95'], stats['error_rate'])
+
+    python -m <package>.rsg_log_analytics run1.db run2.db --window 60 --top 20
+"""
+
+import argparse
+import heapq
+import json
+import logging
+import os.path
+from collections import namedtuple
+from datetime import datetime
+
+try:
+    from urllib.parse import urlsplit
+except ImportError:
+    from urlparse import urlsplit
+
+import sqlalchemy
+from sqlalchemy import create_engine, func, inspect, literal_column, select
+
+from .http_api import RSGRequestLogWriter, RSGRequestRecord
+from .http_metrics import LatencyHistogram, route_template
+
+logger = logging.getLogger(__name__)
+
+# Длительности запросов RSG: от миллисекунд до минут (flush больших конфигураций).
+DELTA_BUCKETS = (0.001, 0.002, 0.005, 0.0075, 0.01, 0.015, 0.02, 0.03, 0.05, 0.075, 0.1, 0.15,
+                 0.2, 0.3, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0, 7.5, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+LoggedRequest = namedtuple('LoggedRequest', ['run', 'id', 'method', 'url', 'route', 'utc_start',
+                                             'delta', 'status_code'])
+
+_EPOCH_JULIAN_DAY = 2440587.5
+
+# SQLAlchemy до 1.4 принимает в select() список столбцов, 2.x -- только позиционные аргументы.
+_SELECT_VARARGS = tuple(int(x) for x in sqlalchemy.__version__.split('.')[:2]) >= (1, 4)
+
+
+def _select(columns):
+    return select(*columns) if _SELECT_VARARGS else select(columns)
+
+
+def _is_error(status_code):
+    return status_code >= 400
+
+
+class RequestLogAnalyzer(object):
+    def __init__(self, log_dbs, chunk_size=20000, migrate=False):
+        """
+        :param log_dbs: Путь к файлу журнала или список путей (по одному на прогон).
+        :param int chunk_size: Сколько строк читать из базы за один запрос.
+        :param bool migrate: Добавить в старые журналы столбец `route` и индексы (см.
+                             :meth:`RSGRequestLogWriter.migrate`). Без этого по старым журналам
+                             маршрут вычисляется из `url` при чтении, а фильтр по времени
+                             работает без индекса.
+        """
+        if not isinstance(log_dbs, (list, tuple)):
+            log_dbs = [log_dbs]
+        self.chunk_size = chunk_size
+        self.engines = []
+        for path in log_dbs:
+            full_path = os.path.abspath(os.path.normpath(path))
+            engine = create_engine('sqlite:///{}'.format(full_path))
+            if migrate:
+                RSGRequestLogWriter.migrate(engine)
+            self.engines.append((path, engine))
+        self._has_route = {}
+
+    def close(self):
+        for _, engine in self.engines:
+            engine.dispose()
+
+    def _columns(self, engine, columns):
+        """
+        Столбца `route` нет в журналах старых версий: вместо него выбирается NULL.
+        """
+        has_route = self._has_route.get(engine)
+        if has_route is None:
+            has_route = self._has_route[engine] = 'route' in set(
+                c['name'] for c in inspect(engine).get_columns(RSGRequestRecord.__tablename__))
+        route = RSGRequestRecord.__table__.c.route
+        return [literal_column('NULL') if c is route and not has_route else c for c in columns]
+
+    def _chunks(self, columns, begin=None, end=None):
+        """
+        Строки всех журналов порциями по `chunk_size` (постраничный обход по `id`).
+
+        :param columns: Выражения SQLAlchemy; первым в результат добавляется `id`.
+        :param datetime begin: Только запросы, начавшиеся не раньше `begin` (UTC).
+        :param datetime end: Только запросы, начавшиеся раньше `end` (UTC).
+        :return: Генератор пар (путь журнала, список строк).
+        """
+        table = RSGRequestRecord.__table__
+        for path, engine in self.engines:
+            cols = self._columns(engine, [table.c.id] + list(columns))
+            last_id = None
+            while True:
+                query = _select(cols)
+                if last_id is not None:
+                    query = query.where(table.c.id > last_id)
+                if begin is not None:
+                    query = query.where(table.c.utc_start >= begin)
+                if end is not None:
+                    query = query.where(table.c.utc_start < end)
+                query = query.order_by(table.c.id).limit(self.chunk_size)
+                with engine.connect() as conn:
+                    rows = conn.execute(query).fetchall()
+                if not rows:
+                    break
+                yield path, rows
+                last_id = rows[-1][0]
+                if len(rows) < self.chunk_size:
+                    break
+
+    @staticmethod
+    def _route(url, route):
+        return route if route is not None else route_template(urlsplit(url).path)
+
+    def endpoint_stats(self, begin=None, end=None, buckets=DELTA_BUCKETS):
+        """
+        Статистика по маршрутам (`'POST /rsg/ipint'`): число запросов, ошибок (код >= 400),
+        доля ошибок, среднее, максимум и квантили `delta` (p50/p95/p99, оценка по гистограмме
+        :class:`LatencyHistogram` с корзинами `buckets`).
+        """
+        table = RSGRequestRecord.__table__
+        histograms = {}
+        errors = {}
+        for _, rows in self._chunks([table.c.method, table.c.url, table.c.route, table.c.delta,
+                                     table.c.status_code], begin, end):
+            for _, method, url, route, delta, status_code in rows:
+                key = '{} {}'.format(method, self._route(url, route))
+                histogram = histograms.get(key)
+                if histogram is None:
+                    histogram = histograms[key] = LatencyHistogram(buckets)
+                    errors[key] = 0
+                histogram.add(delta)
+                if _is_error(status_code):
+                    errors[key] += 1
+
+        result = {}
+        for key, histogram in histograms.items():
+            result[key] = {
+                'count': histogram.count,
+                'errors': errors[key],
+                'error_rate': float(errors[key]) / histogram.count,
+                'mean': histogram.sum / histogram.count,
+                'max': histogram.max,
+                'p50': histogram.quantile(0.5),
+                'p95': histogram.quantile(0.95),
+                'p99': histogram.quantile(0.99),
+            }
+        return result
+
+    def requests_per_second(self, window=60.0, begin=None, end=None):
+        """
+        Нагрузка по окнам времени.
+
+        :param float window: Ширина окна (сек.).
+        :return: Список словарей `{'start': datetime (UTC), 'count', 'errors', 'rps',
+                 'error_rate'}` по возрастанию времени; окна без запросов пропускаются.
+        """
+        table = RSGRequestRecord.__table__
+        # Секунды эпохи считает SQLite: разбор DateTime в Python -- основная часть времени обхода.
+        epoch = (func.julianday(table.c.utc_start) - _EPOCH_JULIAN_DAY) * 86400.0
+        windows = {}
+        for _, rows in self._chunks([epoch, table.c.status_code], begin, end):
+            for _, seconds, status_code in rows:
+                n = int(seconds // window)
+                counts = windows.get(n)
+                if counts is None:
+                    counts = windows[n] = [0, 0]
+                counts[0] += 1
+                if _is_error(status_code):
+                    counts[1] += 1
+        return [{
+            'start': datetime.utcfromtimestamp(n * window),
+            'count': count,
+            'errors': errors,
+            'rps': count / float(window),
+            'error_rate': float(errors) / count,
+        } for n, (count, errors) in sorted(windows.items())]
+
+    def status_codes(self, begin=None, end=None):
+        """
+        :return: Код ответа -> число запросов (по индексу `status_code`, без обхода таблицы).
+        """
+        table = RSGRequestRecord.__table__
+        result = {}
+        for _, engine in self.engines:
+            query = _select([table.c.status_code, func.count()]).group_by(table.c.status_code)
+            if begin is not None:
+                query = query.where(table.c.utc_start >= begin)
+            if end is not None:
+                query = query.where(table.c.utc_start < end)
+            with engine.connect() as conn:
+                for status_code, count in conn.execute(query):
+                    result[status_code] = result.get(status_code, 0) + count
+        return result
+
+    def slowest(self, n=20, begin=None, end=None):
+        """
+        Самые долгие запросы всех журналов.
+
+        :return: Список :class:`LoggedRequest` по убыванию `delta`.
+        """
+        table = RSGRequestRecord.__table__
+        columns = [table.c.id, table.c.method, table.c.url, table.c.route, table.c.utc_start,
+                   table.c.delta, table.c.status_code]
+        candidates = []
+        for path, engine in self.engines:
+            # SQLite выбирает top-N за один проход без сортировки всей таблицы.
+            query = _select(self._columns(engine, columns))
+            if begin is not None:
+                query = query.where(table.c.utc_start >= begin)
+            if end is not None:
+                query = query.where(table.c.utc_start < end)
+            query = query.order_by(table.c.delta.desc()).limit(n)
+            with engine.connect() as conn:
+                for id_, method, url, route, utc_start, delta, status_code in conn.execute(query):
+                    candidates.append(LoggedRequest(path, id_, method, url, self._route(url, route),
+                                                    utc_start, delta, status_code))
+        return heapq.nlargest(n, candidates, key=lambda r: r.delta)
+
+    def report(self, window=60.0, top=20, begin=None, end=None):
+        """
+        Все показатели одним словарем (пригоден для `json.dumps(..., default=str)`).
+        """
+        return {
+            'runs': [path for path, _ in self.engines],
+            'endpoints': self.endpoint_stats(begin, end),
+            'status_codes': self.status_codes(begin, end),
+            'windows': self.requests_per_second(window, begin, end),
+            'slowest': [r._asdict() for r in self.slowest(top, begin, end)],
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze RSG request log databases.')
+    parser.add_argument('log_dbs', nargs='+', help='SQLite request log files (one per run)')
+    parser.add_argument('--window', type=float, default=60.0, help='RPS window, seconds')
+    parser.add_argument('--top', type=int, default=20, help='number of slowest requests')
+    parser.add_argument('--chunk-size', type=int, default=20000)
+    parser.add_argument('--migrate', action='store_true',
+                        help='add route column and indexes to old log files')
+    parser.add_argument('--json', action='store_true', help='print the full report as JSON')
+    args = parser.parse_args(argv)
+
+    analyzer = RequestLogAnalyzer(args.log_dbs, chunk_size=args.chunk_size, migrate=args.migrate)
+    try:
+        report = analyzer.report(window=args.window, top=args.top)
+    finally:
+        analyzer.close()
+    if args.json:
+        print(json.dumps(report, indent=4, sort_keys=True, default=str))
+        return
+
+    print('{:<60} {:>8} {:>7} {:>9} {:>9} {:>9}'.format(
+        'endpoint', 'count', 'err%', 'p50, ms', 'p95, ms', 'p99, ms'))
+    for key, s in sorted(report['endpoints'].items()):
+        print('{:<60} {:>8} {:>7.2f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            key, s['count'], s['error_rate'] * 100, s['p50'] * 1000, s['p95'] * 1000,
+            s['p99'] * 1000))
+    print('\nstatus codes: {}'.format(report['status_codes']))
+    if report['windows']:
+        peak = max(report['windows'], key=lambda w: w['rps'])
+        print('windows: {}, peak {:.1f} rps at {}'.format(
+            len(report['windows']), peak['rps'], peak['start']))
+    print('\nslowest:')
+    for r in report['slowest']:
+        print('{:>9.3f} s  {}  {} {} {}'.format(r['delta'], r['utc_start'], r['status_code'],
+                                                r['method'], r['route']))
+
+
+if __name__ == '__main__':
+    main()
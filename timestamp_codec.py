@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+Быстрый разбор и форматирование отметок времени Web API вида `YYYYMMDDTHHmmss[.SSS]`
+(`TIMESTAMP_TOKEN`) без `arrow.get` с шаблонами.
+
+Основное представление -- целое число миллисекунд от эпохи (UTC). Объекты :class:`Arrow`
+создаются только по требованию: :func:`ms_to_arrow` или ленивое представление :class:`ArrowView`.
+"""
+
+from array import array
+from datetime import datetime, timedelta
+
+import arrow
+
+try:
+    array('q')
+    INT64_TYPECODE = 'q'
+except ValueError:
+    # Python 2: 'q' нет, а 'l' на Windows 32-битный. double хранит миллисекунды точно до 2**53.
+    INT64_TYPECODE = 'd'
+
+MS_IN_SECOND = 1000
+MS_IN_MINUTE = 60 * MS_IN_SECOND
+MS_IN_HOUR = 60 * MS_IN_MINUTE
+MS_IN_DAY = 24 * MS_IN_HOUR
+
+EPOCH = datetime(1970, 1, 1)
+
+# Отметки одного архива в основном отличаются минутами и секундами, поэтому
+# `YYYYMMDDTHH` кэшируется. Размер кэша ограничен на случай долгоживущих процессов.
+_HOUR_CACHE_SIZE = 100000
+_hour_cache = {}
+_day_cache = {}
+
+
+def _days_from_civil(y, m, d):
+    """
+    Число дней от 1970-01-01 по пролептическому григорианскому календарю
+    (алгоритм Howard Hinnant, http://howardhinnant.github.io/date_algorithms.html).
+    """
+    if m <= 2:
+        y -= 1
+    era = y // 400
+    yoe = y - era * 400
+    doy = (153 * (m + (-3 if m > 2 else 9)) + 2) // 5 + d - 1
+    doe = yoe * 365 + yoe // 4 - yoe // 100 + doy
+    return era * 146097 + doe - 719468
+
+
+def _civil_from_days(z):
+    z += 719468
+    era = z // 146097
+    doe = z - era * 146097
+    yoe = (doe - doe // 1460 + doe // 36524 - doe // 146096) // 365
+    doy = doe - (365 * yoe + yoe // 4 - yoe // 100)
+    mp = (5 * doy + 2) // 153
+    d = doy - (153 * mp + 2) // 5 + 1
+    m = mp + 3 if mp < 10 else mp - 9
+    return yoe + era * 400 + (m <= 2), m, d
+
+
+def _days_in_month(y, m):
+    if m == 2:
+        return 29 if y % 4 == 0 and (y % 100 != 0 or y % 400 == 0) else 28
+    return 30 if m in (4, 6, 9, 11) else 31
+
+
+def _hour_ms(prefix):
+    ms = _hour_cache.get(prefix)
+    if ms is None:
+        if prefix[8] != 'T':
+            raise ValueError('Time stamp {!r} doesn\'t satisfy YYYYMMDDTHHmmss[.SSS]'.format(prefix))
+        y, m, d, h = int(prefix[:4]), int(prefix[4:6]), int(prefix[6:8]), int(prefix[9:11])
+        if not (1 <= m <= 12 and 1 <= d <= _days_in_month(y, m) and 0 <= h <= 23):
+            raise ValueError('Time stamp {!r} is out of range'.format(prefix))
+        ms = _days_from_civil(y, m, d) * MS_IN_DAY + h * MS_IN_HOUR
+        if len(_hour_cache) >= _HOUR_CACHE_SIZE:
+            _hour_cache.clear()
+        _hour_cache[prefix] = ms
+    return ms
+
+
+def ts_to_ms(time_stamp):
+    """
+    `YYYYMMDDTHHmmss` или `YYYYMMDDTHHmmss.SSS` (UTC) -> миллисекунды от эпохи.
+    """
+    n = len(time_stamp)
+    try:
+        minutes, seconds = int(time_stamp[11:13]), int(time_stamp[13:15])
+        if not (0 <= minutes <= 59 and 0 <= seconds <= 59):
+            raise ValueError(time_stamp)
+        ms = _hour_ms(time_stamp[:11]) + minutes * MS_IN_MINUTE + seconds * MS_IN_SECOND
+        if n == 15:
+            return ms
+        if n > 16 and time_stamp[15] == '.':
+            return ms + int(time_stamp[16:19].ljust(3, '0'))
+    except (ValueError, IndexError):
+        pass
+    raise ValueError('Time stamp {!r} doesn\'t satisfy YYYYMMDDTHHmmss[.SSS]'.format(time_stamp))
+
+
+def ts_to_ms_bulk(time_stamps):
+    """
+    Разбор многих отметок сразу.
+
+    :return: `array` миллисекунд (int64, на Python 2 -- double).
+    """
+    return array(INT64_TYPECODE, [ts_to_ms(ts) for ts in time_stamps])
+
+
+def ms_to_ts(ms):
+    """
+    Миллисекунды от эпохи -> `YYYYMMDDTHHmmss.SSS` (UTC).
+    """
+    days, rest = divmod(int(ms), MS_IN_DAY)
+    day = _day_cache.get(days)
+    if day is None:
+        day = '{:04d}{:02d}{:02d}T'.format(*_civil_from_days(days))
+        if len(_day_cache) >= _HOUR_CACHE_SIZE:
+            _day_cache.clear()
+        _day_cache[days] = day
+    hours, rest = divmod(rest, MS_IN_HOUR)
+    minutes, rest = divmod(rest, MS_IN_MINUTE)
+    seconds, millis = divmod(rest, MS_IN_SECOND)
+    return '{}{:02d}{:02d}{:02d}.{:03d}'.format(day, hours, minutes, seconds, millis)
+
+
+def ms_to_arrow(ms):
+    return arrow.Arrow.fromdatetime(EPOCH + timedelta(milliseconds=int(ms)))
+
+
+def arrow_to_ms(arrow_):
+    delta = arrow_.to('utc').naive - EPOCH
+    return (delta.days * MS_IN_DAY + delta.seconds * MS_IN_SECOND +
+            delta.microseconds // 1000)
+
+
+class ArrowView(object):
+    """
+    Ленивое представление последовательности миллисекунд в виде объектов :class:`Arrow`.
+    """
+
+    def __init__(self, ms):
+        self.ms = ms
+
+    def __len__(self):
+        return len(self.ms)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return ArrowView(self.ms[index])
+        return ms_to_arrow(self.ms[index])
+
+    def __iter__(self):
+        for ms in self.ms:
+            yield ms_to_arrow(ms)
+
+
+if __name__ == '__main__':
+    # Микробенчмарк: python -m <пакет>.timestamp_codec (запуск из каталога пакета подменит
+    # стандартный calendar здешним calendar.py).
+    import random
+    import timeit
+
+    start = ts_to_ms('20180101T000000.000')
+    samples = [ms_to_ts(start + random.randint(0, 90 * MS_IN_DAY)) for _ in range(20000)]
+    assert all(ms_to_ts(ts_to_ms(ts)) == ts for ts in samples)
+    assert all(arrow_to_ms(arrow.get(ts, 'YYYYMMDDTHHmmss.SSS')) == ts_to_ms(ts)
+               for ts in samples[:1000])
+
+    def old():
+        return [arrow.get(ts, ['YYYYMMDDTHHmmss.SSS', 'YYYYMMDDTHHmmss'], tzinfo='utc')
+                for ts in samples]
+
+    t_old = min(timeit.repeat(old, number=1, repeat=3))
+    t_bulk = min(timeit.repeat(lambda: ts_to_ms_bulk(samples), number=1, repeat=3))
+    t_arrow = min(timeit.repeat(lambda: [ms_to_arrow(ms) for ms in ts_to_ms_bulk(samples)],
+                                number=1, repeat=3))
+    t_fmt = min(timeit.repeat(lambda: [ms_to_ts(ms) for ms in ts_to_ms_bulk(samples)],
+                              number=1, repeat=3))
+    n = len(samples)
+    print('{} time stamps:'.format(n))
+    print('  arrow.get with formats:  {:8.1f} ms'.format(t_old * 1000))
+    print('  ts_to_ms_bulk:           {:8.1f} ms (x{:.0f})'.format(t_bulk * 1000, t_old / t_bulk))
+    print('  ts_to_ms_bulk + Arrow:   {:8.1f} ms (x{:.0f})'.format(t_arrow * 1000, t_old / t_arrow))
+    print('  parse + ms_to_ts:        {:8.1f} ms'.format(t_fmt * 1000))